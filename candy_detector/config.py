@@ -3,14 +3,28 @@
 
 負責讀取、驗證和管理 config.ini 配置檔案。
 提供統一的配置訪問介面。
+
+偵測流程每幀使用的設定整理為不可變的 DetectionSettings，
+由 DetectionSettingsHolder 在設定檔或 API 變更時整個替換，偵測執行緒每幀只讀一次參考。
 """
 
 import configparser
 import os
-from typing import Any
+import stat
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable
 from pathlib import Path
 
 from .constants import CONFIG_FILE, YOLO_DEFAULT_CONF_THRESHOLD, YOLO_DEFAULT_NMS_THRESHOLD
+from .logger import get_logger
+from .postprocess import DetectionFilter
+
+logger = get_logger("candy_detector.config")
+
+# 重新載入時必須存在的區塊（缺少表示檔案正在寫入或已損毀，保留原本的配置）
+REQUIRED_SECTIONS = ("Paths", "Detection")
 
 
 class ConfigManager:
@@ -31,6 +45,46 @@ class ConfigManager:
 
         self.config.read(config_path, encoding="utf-8")
 
+    def reload(self) -> configparser.ConfigParser:
+        """
+        重新讀取配置檔案（讀到新的 ConfigParser 後再整個替換，讀取中的執行緒不會看到一半的內容）
+
+        Returns:
+            新的 ConfigParser 物件
+        """
+        config = configparser.ConfigParser()
+        config.read(self.config_path, encoding="utf-8")
+        # read() 遇到空檔或寫到一半的檔案不會報錯，缺少必要區塊時不替換
+        missing = [section for section in REQUIRED_SECTIONS if not config.has_section(section)]
+        if missing:
+            raise ValueError(f"設定檔缺少必要區塊 {missing}，可能正在寫入: {self.config_path}")
+        self.config = config
+        return config
+
+    def save(self) -> None:
+        """
+        將目前的配置寫回設定檔
+
+        先寫入同目錄的暫存檔再以 os.replace 替換，監看執行緒與其他程式不會讀到寫到一半的檔案。
+        """
+        path = os.path.abspath(self.config_path)
+        fd, temp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                self.config.write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp 建立的檔案權限為 0600，沿用原檔的權限
+            if os.path.exists(path):
+                os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
     def get(self, section: str, key: str, fallback: Any = None) -> Any:
         """
         取得配置值
@@ -119,3 +173,196 @@ class ConfigManager:
             "target_height": self.getint("Display", "target_height", fallback=480),
             "max_width": self.getint("Display", "max_width", fallback=0),
         }
+
+    def get_stream_config(self) -> dict:
+        """取得 MJPEG 串流配置（max_width 為 0 表示不縮放）"""
+        return {
+            "jpeg_quality": self.getint("Stream", "jpeg_quality", fallback=85),
+            "max_width": self.getint("Stream", "max_width", fallback=0),
+            "preview_jpeg_quality": self.getint("Stream", "preview_jpeg_quality", fallback=95),
+            "preview_max_width": self.getint("Stream", "preview_max_width", fallback=0),
+        }
+
+
+@dataclass(frozen=True)
+class DetectionSettings:
+    """
+    偵測流程設定快照（不可變）
+
+    每幀開始時取得一次參考，整幀都使用同一份設定；
+    重新載入時建立新的實例替換，不會修改正在使用的實例。
+    """
+
+    confidence_threshold: float = YOLO_DEFAULT_CONF_THRESHOLD
+    nms_threshold: float = YOLO_DEFAULT_NMS_THRESHOLD
+    # 黑點與顏色檢查
+    enable_black_spot: bool = True
+    black_spot_threshold: float = 0.03
+    enable_color: bool = True
+    color_threshold: float = 0.70
+    hsv_mode: str = "crop"
+    hsv_band_margin: int = 200
+    # 偵測框過濾
+    detection_filter: DetectionFilter = field(default_factory=DetectionFilter)
+    # 動態閘門
+    use_motion_gate: bool = False
+    motion_gate_margin: int = 150
+    motion_gate_downscale: int = 4
+    motion_gate_pixel_threshold: int = 18
+    motion_gate_min_ratio: float = 0.002
+    motion_gate_hold_frames: int = 3
+    motion_gate_force_every: int = 30
+    # 偵測線帶狀裁切
+    use_band_crop: bool = False
+    band_crop_margin: int = 200
+    band_crop_track_frames: int = 6
+    # 卡爾曼追蹤
+    kalman_match_distance: float = 120
+    kalman_max_coast_frames: int = 10
+    # 每次重新載入遞增，元件據此判斷是否需要重建
+    version: int = 0
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser | None, version: int = 0) -> "DetectionSettings":
+        """
+        從設定檔 [Detection] 區塊建立設定快照
+
+        Args:
+            config: ConfigParser 物件，為 None 時使用預設值
+            version: 設定版本
+
+        Returns:
+            DetectionSettings 實例
+        """
+        if config is None:
+            return cls(version=version)
+        d = cls()
+        section = "Detection"
+        return cls(
+            confidence_threshold=config.getfloat(section, "confidence_threshold", fallback=d.confidence_threshold),
+            nms_threshold=config.getfloat(section, "nms_threshold", fallback=d.nms_threshold),
+            enable_black_spot=config.getint(section, "enable_black_spot_detection", fallback=1) == 1,
+            black_spot_threshold=config.getfloat(section, "black_spot_threshold", fallback=d.black_spot_threshold),
+            enable_color=config.getint(section, "enable_color_detection", fallback=1) == 1,
+            color_threshold=config.getfloat(section, "color_yellow_threshold", fallback=d.color_threshold),
+            hsv_mode=config.get(section, "hsv_mode", fallback=d.hsv_mode).strip().lower(),
+            hsv_band_margin=config.getint(section, "hsv_band_margin", fallback=d.hsv_band_margin),
+            detection_filter=DetectionFilter.from_config(config),
+            use_motion_gate=config.getint(section, "use_motion_gate", fallback=0) == 1,
+            motion_gate_margin=config.getint(section, "motion_gate_margin", fallback=d.motion_gate_margin),
+            motion_gate_downscale=config.getint(section, "motion_gate_downscale", fallback=d.motion_gate_downscale),
+            motion_gate_pixel_threshold=config.getint(section, "motion_gate_pixel_threshold", fallback=d.motion_gate_pixel_threshold),
+            motion_gate_min_ratio=config.getfloat(section, "motion_gate_min_ratio", fallback=d.motion_gate_min_ratio),
+            motion_gate_hold_frames=config.getint(section, "motion_gate_hold_frames", fallback=d.motion_gate_hold_frames),
+            motion_gate_force_every=config.getint(section, "motion_gate_force_every", fallback=d.motion_gate_force_every),
+            use_band_crop=config.getint(section, "use_band_crop", fallback=0) == 1,
+            band_crop_margin=config.getint(section, "band_crop_margin", fallback=d.band_crop_margin),
+            band_crop_track_frames=config.getint(section, "band_crop_track_frames", fallback=d.band_crop_track_frames),
+            kalman_match_distance=config.getfloat(section, "kalman_match_distance", fallback=d.kalman_match_distance),
+            kalman_max_coast_frames=config.getint(section, "kalman_max_coast_frames", fallback=d.kalman_max_coast_frames),
+            version=version,
+        )
+
+
+class DetectionSettingsHolder:
+    """
+    偵測設定持有者 - 重新載入時以新的快照整個替換
+
+    讀取 current 只是一次屬性存取，偵測執行緒不需要加鎖；
+    可選擇啟動背景執行緒監看設定檔修改時間，檔案變更後自動重新載入。
+    """
+
+    def __init__(self, config_manager: ConfigManager):
+        """
+        以目前的配置建立第一份設定快照
+
+        Args:
+            config_manager: 配置管理器
+        """
+        self.config_manager = config_manager
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._current = DetectionSettings.from_config(config_manager.config, version=1)
+        self._mtime = self._read_mtime()
+        self._watch_stop = None
+        self._watch_thread = None
+
+    @property
+    def current(self) -> DetectionSettings:
+        """目前的設定快照"""
+        return self._current
+
+    def _read_mtime(self) -> float | None:
+        try:
+            return os.path.getmtime(self.config_manager.config_path)
+        except OSError:
+            return None
+
+    def add_listener(self, callback: Callable[[DetectionSettings], None]) -> None:
+        """註冊設定變更時的回呼（例如更新批次推論服務的閾值）"""
+        self._listeners.append(callback)
+
+    def reload(self, from_file: bool = False) -> DetectionSettings:
+        """
+        重新建立設定快照並替換
+
+        Args:
+            from_file: True 時先重新讀取設定檔；False 時使用記憶體中已修改的配置（例如 /api/config）
+
+        Returns:
+            新的設定快照
+        """
+        with self._lock:
+            if from_file:
+                self.config_manager.reload()
+            self._mtime = self._read_mtime()
+            settings = DetectionSettings.from_config(self.config_manager.config, version=self._current.version + 1)
+            self._current = settings
+
+        logger.info(
+            f"偵測設定已重新載入 (版本 {settings.version}): "
+            f"conf={settings.confidence_threshold}, nms={settings.nms_threshold}, "
+            f"黑點={settings.black_spot_threshold}, 顏色={settings.color_threshold}"
+        )
+        for callback in list(self._listeners):
+            try:
+                callback(settings)
+            except Exception as e:
+                logger.warning(f"設定變更回呼失敗: {e}")
+        return settings
+
+    def start_watch(self, interval: float = 1.0) -> "DetectionSettingsHolder":
+        """
+        啟動設定檔監看執行緒
+
+        Args:
+            interval: 檢查修改時間的間隔（秒）
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return self
+        self._watch_stop = threading.Event()
+        self._watch_thread = threading.Thread(
+            target=self._watch, args=(interval, self._watch_stop), name="config-watch", daemon=True
+        )
+        self._watch_thread.start()
+        return self
+
+    def _watch(self, interval: float, stop_event: threading.Event) -> None:
+        """設定檔監看主迴圈"""
+        while not stop_event.wait(interval):
+            mtime = self._read_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+            try:
+                self.reload(from_file=True)
+            except Exception as e:
+                # 檔案可能正在寫入，下次檢查再試
+                logger.warning(f"重新載入設定檔失敗: {e}")
+
+    def stop_watch(self) -> None:
+        """停止設定檔監看執行緒"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+        if self._watch_thread is not None and self._watch_thread is not threading.current_thread():
+            self._watch_thread.join(timeout=2.0)
+        self._watch_thread = None
@@ -14,6 +14,7 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_FILE = os.path.join(PROJECT_ROOT, "config.ini")
 LOGS_DIR = os.path.join(PROJECT_ROOT, "logs")
 RESULTS_DIR = os.path.join(PROJECT_ROOT, "results")
+EVENTS_DIR = os.path.join(PROJECT_ROOT, "events")
 
 # 確保日誌和結果目錄存在
 os.makedirs(LOGS_DIR, exist_ok=True)
@@ -44,6 +45,7 @@ YOLO_DEFAULT_NMS_THRESHOLD = 0.4
 CAMERA_DEFAULT_WIDTH = 1920
 CAMERA_DEFAULT_HEIGHT = 1080
 CAMERA_BACKEND = "CAP_DSHOW"  # 使用 DirectShow 作為相機後端
+CAPTURE_RING_BUFFER_SIZE = 3  # 抓取執行緒的環形緩衝區大小（偵測永遠取最新一張）
 
 # ============================================================================
 # 繼電器配置
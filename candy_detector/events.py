@@ -0,0 +1,434 @@
+"""
+糖果事件記錄模塊
+
+每顆過線計數的糖果產生一筆事件（攝影機、追蹤 ID、過線時間、最終類別、最高分數、
+判定規則、是否噴氣）。偵測執行緒只把整批事件的結構化陣列放進佇列，
+背景執行緒定期整批附加到當天的固定長度二進位記錄檔（只附加不修改）；
+日期改變後把前一天的記錄檔轉為壓縮的欄位式 .npz（攝影機與類別改存字典編號）。
+"""
+
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .constants import EVENTS_DIR
+from .logger import get_logger
+
+logger = get_logger("candy_detector.events")
+
+# 判定規則代碼（追蹤表 rule 欄位與事件記錄共用）
+RULE_NONE = 0  # 正常品
+RULE_MODEL = 1  # 模型判定 abnormal
+RULE_BLACK_SPOT = 2  # 黑點檢測
+RULE_COLOR = 3  # 顏色檢測
+RULE_INHERITED = 4  # 靠近先前的 abnormal 而繼承
+RULE_NAMES = ("none", "model", "black_spot", "color", "inherited")
+
+# 附加記錄檔的固定長度格式（70 bytes/筆，明確指定位元組順序）
+EVENT_DTYPE = np.dtype([
+    ("ts", "<f8"),  # 過線畫面的擷取時間 (time.time())
+    ("camera", "S32"),
+    ("track_id", "<i8"),
+    ("label", "S16"),
+    ("max_score", "<f4"),
+    ("rule", "u1"),
+    ("relay", "u1"),
+])
+
+# 日期以台北時間 (UTC+8) 分段，與歷史記錄彙總一致
+TAIPEI_OFFSET_SECONDS = 8 * 3600
+
+_LOG_PATTERN = re.compile(r"^events-(\d{8})\.bin$")
+
+
+def event_day(ts: float) -> str:
+    """事件時間所屬的日期 (YYYYMMDD，台北時間)"""
+    return time.strftime("%Y%m%d", time.gmtime(ts + TAIPEI_OFFSET_SECONDS))
+
+
+def _encode_fixed(text: str, size: int) -> bytes:
+    """編碼為 UTF-8 並截斷到 size 位元組以內（只在字元邊界截斷，不會切開多位元組字元）"""
+    return str(text).encode("utf-8")[:size].decode("utf-8", "ignore").encode("utf-8")
+
+
+class EventLog:
+    """糖果事件記錄 - 批次附加寫入，每日轉為欄位式壓縮檔"""
+
+    def __init__(self, directory, flush_interval: float = 1.0, max_pending: int = 1000):
+        """
+        初始化事件記錄（呼叫 start() 後才開始寫入）
+
+        Args:
+            directory: 記錄檔目錄
+            flush_interval: 寫入間隔秒數
+            max_pending: 佇列中最多累積的批次數，滿了之後新事件直接丟棄（不阻塞偵測執行緒）
+        """
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._stopped = threading.Event()
+        self._file_lock = threading.Lock()  # 轉檔與查詢互斥
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.rotated_days = 0
+
+    @classmethod
+    def from_config(cls, config) -> "EventLog | None":
+        """
+        依 [EventLog] 區塊建立事件記錄
+
+        Args:
+            config: ConfigParser 或 ConfigManager
+
+        Returns:
+            EventLog 實例（尚未啟動）；enabled=0 時回傳 None
+        """
+        if not config.getint('EventLog', 'enabled', fallback=1):
+            return None
+        directory = Path(config.get('EventLog', 'directory', fallback=EVENTS_DIR) or EVENTS_DIR)
+        if not directory.is_absolute():
+            directory = Path(EVENTS_DIR).parent / directory
+        return cls(
+            directory,
+            flush_interval=config.getint('EventLog', 'flush_interval_ms', fallback=1000) / 1000.0,
+        )
+
+    # ---- 路徑 ----
+
+    def _log_path(self, day: str) -> Path:
+        return self.directory / f"events-{day}.bin"
+
+    def _archive_path(self, day: str) -> Path:
+        return self.directory / f"events-{day}.npz"
+
+    # ---- 寫入 ----
+
+    def start(self) -> "EventLog":
+        """建立目錄、轉換前幾天未轉換的記錄檔並啟動寫入執行緒"""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stopped.clear()
+        self._rotate(event_day(time.time()))
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def record(self, camera: str, track_ids, max_scores, labels, rules, relay_fired, ts: float | None = None) -> int:
+        """
+        排入同一幀過線的多筆事件（立即返回）
+
+        Args:
+            camera: 攝影機名稱
+            track_ids: 追蹤 ID 陣列
+            max_scores: 各追蹤物體的最高信心分數
+            labels: 最終類別名稱
+            rules: 判定規則代碼（RULE_*）
+            relay_fired: 是否送出噴氣
+            ts: 過線時間 (time.time())，預設為現在
+
+        Returns:
+            排入的事件數（佇列已滿時為 0）
+        """
+        count = len(track_ids)
+        if count == 0:
+            return 0
+        events = np.empty(count, dtype=EVENT_DTYPE)
+        events["ts"] = time.time() if ts is None else ts
+        events["camera"] = _encode_fixed(camera, EVENT_DTYPE["camera"].itemsize)
+        events["track_id"] = track_ids
+        events["label"] = [_encode_fixed(label, EVENT_DTYPE["label"].itemsize) for label in labels]
+        events["max_score"] = max_scores
+        events["rule"] = rules
+        events["relay"] = relay_fired
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            self.dropped += count
+            if self.dropped == count or self.dropped % 1000 < count:
+                logger.warning(f"事件記錄佇列已滿，已丟棄 {self.dropped} 筆事件")
+            return 0
+        self.recorded += count
+        return count
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待目前佇列中的事件全部寫入檔案"""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _run(self) -> None:
+        """寫入迴圈：每隔 flush_interval 把累積的事件整批附加到當天的記錄檔"""
+        current_day = event_day(time.time())
+        while not self._stopped.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                first = None
+            batches, waiters = [], []
+            item = first
+            while item is not None:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batches.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if batches:
+                self._append(np.concatenate(batches))
+            for waiter in waiters:
+                waiter.set()
+
+            today = event_day(time.time())
+            if today != current_day:
+                current_day = today
+                self._rotate(today)
+
+    def _append(self, events: np.ndarray) -> None:
+        """依日期附加到記錄檔（跨午夜的批次拆到兩個檔案）"""
+        days = np.array([event_day(ts) for ts in events["ts"].tolist()])
+        try:
+            with self._file_lock:
+                for day in np.unique(days).tolist():
+                    with open(self._log_path(day), "ab") as f:
+                        f.write(events[days == day].tobytes())
+            self.written += len(events)
+        except OSError as e:
+            self.dropped += len(events)
+            logger.error(f"寫入 {len(events)} 筆事件失敗: {e}")
+
+    # ---- 每日轉檔 ----
+
+    def _rotate(self, today: str) -> None:
+        """把今天以前的附加記錄檔轉為欄位式 .npz"""
+        for path in sorted(self.directory.glob("events-*.bin")):
+            match = _LOG_PATTERN.match(path.name)
+            if match is None or match.group(1) >= today:
+                continue
+            day = match.group(1)
+            try:
+                with self._file_lock:
+                    columns = self._read_log(path)
+                    archive = self._archive_path(day)
+                    if archive.exists():
+                        # 午夜後才寫入的前一天事件：與已轉換的資料合併
+                        old = self._read_archive(archive)
+                        columns = {name: np.concatenate([old[name], columns[name]]) for name in columns}
+                    self._write_archive(archive, columns)
+                    path.unlink()
+                self.rotated_days += 1
+                logger.info(f"事件記錄 {day} 已轉為 {archive.name}（{len(columns['ts'])} 筆）")
+            except Exception as e:
+                logger.error(f"事件記錄 {path.name} 轉檔失敗: {e}")
+
+    @staticmethod
+    def _read_log(path: Path) -> dict:
+        """讀取附加記錄檔為欄位字典（忽略寫到一半的最後一筆）"""
+        count = path.stat().st_size // EVENT_DTYPE.itemsize
+        events = np.fromfile(path, dtype=EVENT_DTYPE, count=count)
+        # 以 replace 解碼，單筆損毀的文字欄位不會讓整天的記錄無法讀取
+        return {
+            "ts": events["ts"].astype(np.float64),
+            "camera": np.char.decode(events["camera"], "utf-8", "replace"),
+            "track_id": events["track_id"].astype(np.int64),
+            "label": np.char.decode(events["label"], "utf-8", "replace"),
+            "max_score": events["max_score"].astype(np.float32),
+            "rule": events["rule"],
+            "relay": events["relay"].astype(bool),
+        }
+
+    @staticmethod
+    def _write_archive(path: Path, columns: dict) -> None:
+        """依時間排序後以字典編碼寫成壓縮 .npz（先寫暫存檔再取代，避免留下不完整的檔案）"""
+        order = np.argsort(columns["ts"], kind="stable")
+        cameras, camera_id = np.unique(columns["camera"][order], return_inverse=True)
+        labels, label_id = np.unique(columns["label"][order], return_inverse=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez_compressed(
+            tmp,
+            ts=columns["ts"][order],
+            camera_id=camera_id.astype(np.uint16),
+            cameras=cameras,
+            track_id=columns["track_id"][order],
+            label_id=label_id.astype(np.uint8),
+            labels=labels,
+            max_score=columns["max_score"][order],
+            rule=columns["rule"][order],
+            relay=columns["relay"][order],
+        )
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read_archive(path: Path) -> dict:
+        """讀取 .npz 為欄位字典"""
+        with np.load(path) as data:
+            return {
+                "ts": data["ts"],
+                "camera": data["cameras"][data["camera_id"]],
+                "track_id": data["track_id"],
+                "label": data["labels"][data["label_id"]],
+                "max_score": data["max_score"],
+                "rule": data["rule"],
+                "relay": data["relay"],
+            }
+
+    # ---- 查詢 ----
+
+    def days(self) -> list[str]:
+        """有事件記錄的日期 (YYYY-MM-DD，由新到舊)"""
+        found = set()
+        for path in self.directory.glob("events-*.*"):
+            match = re.match(r"^events-(\d{8})\.(bin|npz)$", path.name)
+            if match:
+                day = match.group(1)
+                found.add(f"{day[:4]}-{day[4:6]}-{day[6:]}")
+        return sorted(found, reverse=True)
+
+    def load_day(self, day: str) -> dict:
+        """
+        讀取一天的事件（已轉檔的 .npz 加上尚未轉檔的附加記錄）
+
+        Args:
+            day: YYYYMMDD
+
+        Returns:
+            欄位字典，依時間排序
+        """
+        parts = []
+        with self._file_lock:
+            archive = self._archive_path(day)
+            if archive.exists():
+                parts.append(self._read_archive(archive))
+            log = self._log_path(day)
+            if log.exists():
+                parts.append(self._read_log(log))
+        if not parts:
+            return {
+                "ts": np.empty(0, np.float64), "camera": np.empty(0, str), "track_id": np.empty(0, np.int64),
+                "label": np.empty(0, str), "max_score": np.empty(0, np.float32),
+                "rule": np.empty(0, np.uint8), "relay": np.empty(0, bool),
+            }
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+        order = np.argsort(columns["ts"], kind="stable")
+        return {name: values[order] for name, values in columns.items()}
+
+    def query(
+        self,
+        day: str | None = None,
+        camera: str = "",
+        rule: str = "",
+        label: str = "",
+        since: float | None = None,
+        limit: int = 1000,
+        skip: int | None = None,
+    ) -> dict:
+        """
+        查詢一天的事件
+
+        Args:
+            day: YYYYMMDD 或 YYYY-MM-DD，預設今天（台北時間）
+            camera: 只看指定攝影機
+            rule: 只看指定判定規則（RULE_NAMES）
+            label: 只看指定類別
+            since: 只回傳時間晚於此值的事件（輪詢新事件用）
+            limit: 最多筆數（取最早的 limit 筆，配合 since 逐段讀取）
+            skip: 與 since 一起使用時改為包含時間等於 since 的事件，並略過其中前 skip 筆
+                （同一幀過線的多筆事件時間相同，分頁須以 next_since + next_skip 繼續才不會漏掉）
+
+        Returns:
+            {'day', 'events': [...], 'counts': {規則: 數量}, 'total', 'next_since', 'next_skip'}
+        """
+        day = (day or event_day(time.time())).replace("-", "")
+        if not re.fullmatch(r"\d{8}", day):
+            raise ValueError(f"日期格式錯誤: {day}")
+        columns = self.load_day(day)
+
+        mask = np.ones(len(columns["ts"]), dtype=bool)
+        if camera:
+            mask &= columns["camera"] == camera
+        if label:
+            mask &= columns["label"] == label
+        if rule:
+            if rule not in RULE_NAMES:
+                raise ValueError(f"rule 必須為 {'/'.join(RULE_NAMES)}")
+            mask &= columns["rule"] == RULE_NAMES.index(rule)
+        if since is not None:
+            mask &= (columns["ts"] >= since) if skip is not None else (columns["ts"] > since)
+
+        # load_day 已依時間穩定排序，時間等於 since 的事件都在最前面
+        idx = np.flatnonzero(mask)
+        skipped = 0
+        if since is not None and skip:
+            skipped = min(max(0, int(skip)), int(np.count_nonzero(columns["ts"][idx] == since)))
+            idx = idx[skipped:]
+        counts = np.bincount(columns["rule"][idx], minlength=len(RULE_NAMES))
+        page = idx[:max(0, int(limit))]
+        events = [
+            {
+                "ts": ts,
+                "time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts + TAIPEI_OFFSET_SECONDS)) + f".{int(ts * 1000) % 1000:03d}",
+                "camera": cam,
+                "track_id": track_id,
+                "label": lbl,
+                "max_score": round(score, 4),
+                "rule": RULE_NAMES[code] if code < len(RULE_NAMES) else str(code),
+                "relay": relay,
+            }
+            for ts, cam, track_id, lbl, score, code, relay in zip(
+                columns["ts"][page].tolist(),
+                columns["camera"][page].tolist(),
+                columns["track_id"][page].tolist(),
+                columns["label"][page].tolist(),
+                columns["max_score"][page].tolist(),
+                columns["rule"][page].tolist(),
+                columns["relay"][page].tolist(),
+            )
+        ]
+        next_skip = None
+        if len(page):
+            # 下一頁從最後一筆的時間開始，略過已回傳的同時間事件（包含前幾頁已略過的）
+            last_ts = columns["ts"][page[-1]]
+            next_skip = int(np.count_nonzero(columns["ts"][page] == last_ts))
+            if last_ts == since:
+                next_skip += skipped
+        return {
+            "day": f"{day[:4]}-{day[4:6]}-{day[6:]}",
+            "events": events,
+            "counts": dict(zip(RULE_NAMES, counts[:len(RULE_NAMES)].tolist())),
+            "total": int(len(idx)),
+            "next_since": events[-1]["ts"] if len(idx) > len(page) else None,
+            "next_skip": next_skip if len(idx) > len(page) else None,
+        }
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """寫完佇列中的事件後停止寫入執行緒"""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self._stopped.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def get_stats(self) -> dict:
+        """取得記錄統計"""
+        return {
+            "queued_batches": self._queue.qsize(),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotated_days": self.rotated_days,
+        }
@@ -0,0 +1,201 @@
+"""
+畫面緩衝池模塊
+
+每張 1080p 畫面約 6 MB，逐幀配置新陣列與整張複製會佔用大量記憶體頻寬。
+緩衝池預先保留同尺寸的陣列，攝影機以 cap.read(image=...) 直接寫入重複使用的緩衝區；
+讀出的畫面包成引用計數的唯讀 FrameHandle，預覽、錄影、串流等使用者各自持有引用即可共用，
+最後一個引用釋放時緩衝區才回到池中。
+"""
+
+import threading
+
+import numpy as np
+
+
+class FrameHandle:
+    """
+    引用計數的唯讀畫面
+
+    建立時引用數為 1（屬於建立者）。其他使用者需要跨執行緒保留畫面時呼叫 acquire()，
+    用完呼叫 release()；引用數歸零後緩衝區回到緩衝池，之後不可再使用此 handle。
+    """
+
+    __slots__ = ("array", "_buffer", "_pool", "_refs")
+
+    def __init__(self, buffer: np.ndarray, pool: "FramePool | None" = None):
+        """
+        包裝緩衝區
+
+        Args:
+            buffer: 畫面緩衝區（handle 持有期間不可再寫入）
+            pool: 所屬緩衝池，None 表示釋放後交給垃圾回收
+        """
+        view = buffer.view()
+        view.flags.writeable = False
+        self.array = view
+        self._buffer = buffer
+        self._pool = pool
+        self._refs = 1
+
+    @property
+    def shape(self) -> tuple:
+        return self._buffer.shape
+
+    @property
+    def refs(self) -> int:
+        """目前的引用數"""
+        return self._refs
+
+    def acquire(self) -> "FrameHandle":
+        """增加一個引用並回傳自己"""
+        with _lock_of(self._pool):
+            if self._refs <= 0:
+                raise RuntimeError("畫面已釋放，無法再取得引用")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        """釋放一個引用（最後一個引用釋放時歸還緩衝區）"""
+        with _lock_of(self._pool):
+            if self._refs <= 0:
+                raise RuntimeError("畫面重複釋放")
+            self._refs -= 1
+            if self._refs:
+                return
+            buffer, self._buffer = self._buffer, None
+            self.array = None
+        if self._pool is not None:
+            self._pool._recycle(buffer)
+
+    def __enter__(self) -> np.ndarray:
+        return self.array
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+_standalone_lock = threading.Lock()
+
+
+def _lock_of(pool: "FramePool | None") -> threading.Lock:
+    return pool._lock if pool is not None else _standalone_lock
+
+
+class FramePool:
+    """同尺寸畫面緩衝區的重複使用池（執行緒安全）"""
+
+    def __init__(self, max_free: int = 8):
+        """
+        初始化緩衝池
+
+        Args:
+            max_free: 池中最多保留的閒置緩衝區數（超過的交給垃圾回收）
+        """
+        self.max_free = max_free
+        self._lock = threading.Lock()
+        self._free = []
+        self._shape = None
+        self._dtype = None
+
+        self.allocated = 0
+        self.reused = 0
+
+    def _take(self, shape: tuple, dtype, count: bool = True) -> np.ndarray:
+        """取出一個指定尺寸的緩衝區（尺寸改變時丟棄舊的閒置緩衝區；count=False 時不計入統計）"""
+        dtype = np.dtype(dtype)
+        with self._lock:
+            if shape != self._shape or dtype != self._dtype:
+                self._shape, self._dtype = shape, dtype
+                self._free.clear()
+            if self._free:
+                self.reused += count
+                return self._free.pop()
+            self.allocated += count
+        return np.empty(shape, dtype=dtype)
+
+    def _recycle(self, buffer: np.ndarray) -> None:
+        with self._lock:
+            if buffer.shape == self._shape and buffer.dtype == self._dtype and len(self._free) < self.max_free:
+                self._free.append(buffer)
+
+    def wrap(self, buffer: np.ndarray) -> FrameHandle:
+        """將寫好的緩衝區包成唯讀 handle（引用數 1，屬於呼叫端）"""
+        return FrameHandle(buffer, self)
+
+    def copy(self, frame: np.ndarray) -> np.ndarray:
+        """將畫面複製到池中的緩衝區（取代 frame.copy()，不重新配置記憶體）"""
+        buffer = self._take(frame.shape, frame.dtype)
+        np.copyto(buffer, frame)
+        return buffer
+
+    def read(self, cap) -> tuple[bool, FrameHandle | None]:
+        """
+        從攝影機讀取一張畫面到池中的緩衝區
+
+        第一次讀取或解析度改變時由 OpenCV 配置新陣列，之後的尺寸即為池的尺寸。
+
+        Args:
+            cap: cv2.VideoCapture（或提供 read(image=...) 的物件）
+
+        Returns:
+            (ret, handle)；讀取失敗時 handle 為 None
+        """
+        with self._lock:
+            shape, dtype = self._shape, self._dtype
+        # 讀取失敗（攝影機斷線時會連續失敗）不計入統計，成功後才計數
+        buffer = self._take(shape, dtype, count=False) if shape is not None else None
+        if buffer is not None:
+            ret, frame = cap.read(image=buffer)
+        else:
+            ret, frame = cap.read()
+        if not ret or frame is None:
+            if buffer is not None:
+                self._recycle(buffer)
+            return False, None
+
+        if buffer is not None and frame.shape == buffer.shape and np.shares_memory(frame, buffer):
+            with self._lock:
+                self.reused += 1
+            return True, FrameHandle(buffer, self)
+
+        # OpenCV 重新配置了陣列（第一次讀取或解析度改變），改以新尺寸為準
+        with self._lock:
+            if frame.shape != self._shape or frame.dtype != self._dtype:
+                self._shape, self._dtype = frame.shape, frame.dtype
+                self._free.clear()
+            self.allocated += 1
+        if buffer is not None:
+            self._recycle(buffer)
+        if not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame)
+        return True, FrameHandle(frame, self)
+
+    def get_stats(self) -> dict:
+        """取得緩衝池統計"""
+        with self._lock:
+            return {
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "free": len(self._free),
+                "shape": list(self._shape) if self._shape is not None else None,
+            }
+
+
+def acquire_frame(frame):
+    """畫面為 FrameHandle 時增加引用（一般陣列原樣回傳）"""
+    if isinstance(frame, FrameHandle):
+        return frame.acquire()
+    return frame
+
+
+def release_frame(frame) -> None:
+    """畫面為 FrameHandle 時釋放引用（None 與一般陣列不做事）"""
+    if isinstance(frame, FrameHandle):
+        frame.release()
+
+
+def frame_array(frame) -> np.ndarray | None:
+    """取得畫面的陣列（FrameHandle 回傳唯讀視圖）"""
+    if isinstance(frame, FrameHandle):
+        return frame.array
+    return frame
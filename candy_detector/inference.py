@@ -0,0 +1,244 @@
+"""
+批次推論模塊
+
+多個攝影機的偵測執行緒各自送出最新畫面，推論執行緒在最長等待時間內
+收集所有攝影機的畫面後合併為一次 YOLOv8 model.predict 呼叫，
+再將結果分送回各攝影機，避免各攝影機輪流搶模型鎖並各付一次呼叫開銷。
+"""
+
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger("candy_detector.inference")
+
+# 沒有偵測結果時回傳的空陣列
+EMPTY_CLASSES = np.empty(0, dtype=np.int32)
+EMPTY_SCORES = np.empty(0, dtype=np.float32)
+EMPTY_BOXES = np.empty((0, 4), dtype=np.float32)
+
+
+def extract_yolov8_result(result) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    將單張畫面的 YOLOv8 結果轉為與 YOLOv4 相同的 (classes, scores, boxes) 格式
+
+    由 boxes.data 一次取出 xyxy/conf/cls，只做一次裝置到主機的傳輸，不逐框轉換。
+
+    Args:
+        result: ultralytics Results 物件
+
+    Returns:
+        ((N,) int32 類別, (N,) float32 分數, (N,4) float32 xywh 邊界框)
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return EMPTY_CLASSES, EMPTY_SCORES, EMPTY_BOXES
+
+    # data 欄位為 [x1, y1, x2, y2, conf, cls]（追蹤模式會多一欄 id）
+    data = boxes.data.cpu().numpy()
+    xywh = data[:, :4].astype(np.float32)
+    xywh[:, 2:] -= xywh[:, :2]
+    return data[:, -1].astype(np.int32), data[:, -2].astype(np.float32), xywh
+
+
+class _InferenceRequest:
+    """單一攝影機送出的推論請求"""
+
+    __slots__ = ("key", "frame", "done", "result", "error", "abandoned")
+
+    def __init__(self, key: str, frame):
+        self.key = key
+        self.frame = frame
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False  # 呼叫端已逾時放棄，不再需要推論
+
+
+class InferenceService:
+    """YOLOv8 跨攝影機批次推論服務"""
+
+    def __init__(
+        self,
+        get_model: Callable,
+        model_lock: threading.Lock,
+        conf_threshold: float,
+        nms_threshold: float,
+        max_wait_ms: float = 8,
+        max_batch: int = 8,
+        expected_requests: Callable[[], int] | None = None,
+    ):
+        """
+        初始化批次推論服務
+
+        Args:
+            get_model: 回傳目前模型的函數（切換模型後自動使用新模型）
+            model_lock: 模型鎖（與切換模型共用）
+            conf_threshold: 信心閾值
+            nms_threshold: NMS 閾值
+            max_wait_ms: 收到第一張畫面後最多等待其他攝影機的毫秒數
+            max_batch: 單批最多畫面數
+            expected_requests: 回傳目前應參與批次的攝影機數，全部到齊即立即推論
+        """
+        self.get_model = get_model
+        self.model_lock = model_lock
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.expected_requests = expected_requests or (lambda: self.max_batch)
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+        self.batches = 0
+        self.batched_frames = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self.abandoned = 0
+
+    def start(self) -> "InferenceService":
+        """啟動推論執行緒"""
+        self._thread = threading.Thread(target=self._run, name="batch-inference", daemon=True)
+        self._thread.start()
+        return self
+
+    def infer(self, key: str, frame, timeout: float = 5.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        送出畫面並等待該畫面的偵測結果（由各攝影機的偵測執行緒呼叫）
+
+        Args:
+            key: 攝影機名稱
+            frame: 要偵測的畫面
+            timeout: 最長等待秒數
+
+        Returns:
+            (classes, scores, boxes)，格式與 run_detection 相同
+        """
+        request = _InferenceRequest(key, frame)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("批次推論服務已停止")
+            self._pending.append(request)
+            self._cond.notify_all()
+
+        if not request.done.wait(timeout):
+            with self._cond:
+                # 尚未進入批次的請求直接移出佇列；已在推論中的結果會被丟棄
+                request.abandoned = True
+                if request in self._pending:
+                    self._pending.remove(request)
+                    request.frame = None
+                    self.abandoned += 1
+            raise TimeoutError(f"{key} 等待批次推論逾時")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect_batch(self) -> list | None:
+        """等待第一張畫面，再於最長等待時間內收集其他攝影機的畫面"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or self._stopped)
+            if self._stopped:
+                return None
+            self._drop_abandoned()
+            if not self._pending:
+                return []
+
+            deadline = time.monotonic() + self.max_wait
+            target = min(self.max_batch, max(1, self.expected_requests()))
+            while len(self._pending) < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    break
+                self._cond.wait(remaining)
+
+            self._drop_abandoned()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _drop_abandoned(self) -> None:
+        """移除呼叫端已放棄的請求（需持有 _cond）"""
+        kept = [request for request in self._pending if not request.abandoned]
+        if len(kept) != len(self._pending):
+            for request in self._pending:
+                if request.abandoned:
+                    request.frame = None
+                    request.done.set()
+            self.abandoned += len(self._pending) - len(kept)
+            self._pending[:] = kept
+
+    def _run(self) -> None:
+        """推論執行緒主迴圈"""
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            if batch:
+                self._run_batch(batch)
+
+        # 停止後喚醒仍在等待的攝影機
+        with self._cond:
+            leftover, self._pending = self._pending, []
+        for request in leftover:
+            request.error = RuntimeError("批次推論服務已停止")
+            request.done.set()
+
+    def _run_batch(self, batch: list) -> None:
+        """以單次 predict 處理整批畫面並分送結果"""
+        start = time.perf_counter()
+        try:
+            model = self.get_model()
+            if model is None:
+                raise RuntimeError("模型尚未載入")
+            with self.model_lock:
+                results = model.predict(
+                    [request.frame for request in batch],
+                    conf=self.conf_threshold,
+                    iou=self.nms_threshold,
+                    verbose=False,
+                )
+            results = list(results)
+            if len(results) != len(batch):
+                raise RuntimeError(f"模型回傳 {len(results)} 個結果，預期 {len(batch)} 個")
+            for request, result in zip(batch, results):
+                request.result = extract_yolov8_result(result)
+        except Exception as exc:
+            logger.error(f"批次推論失敗 ({len(batch)} 張): {exc}")
+            for request in batch:
+                request.error = exc
+        finally:
+            for request in batch:
+                request.frame = None
+                request.done.set()
+
+        self.batches += 1
+        self.batched_frames += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000.0
+
+    def get_stats(self) -> dict:
+        """取得批次推論統計"""
+        return {
+            "batches": self.batches,
+            "frames": self.batched_frames,
+            "mean_batch_size": round(self.batched_frames / self.batches, 2) if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "abandoned": self.abandoned,
+        }
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """停止推論執行緒"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
@@ -0,0 +1,289 @@
+"""
+糖果外觀檢查模塊
+
+對模型判定為 normal 的糖果做額外的黑點與顏色檢查。
+每顆糖果只轉換一次 HSV，黑色與黃色遮罩都由同一份 HSV 產生，
+形態學核心在模塊載入時建立一次並重複使用。
+
+糖果很多時可改為每幀只轉換所有偵測框的聯集（重疊的框合併後轉換一次）
+或偵測線附近的帶狀區域，預先算好遮罩的積分影像後，每顆糖果只需查表計數。
+"""
+
+import cv2
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger("candy_detector.inspection")
+
+# 檢查結果（None 表示通過）
+REASON_BLACK_SPOT = "black_spot"
+REASON_COLOR = "color"
+
+# HSV 轉換範圍：crop=每顆糖果各自轉換，union=偵測框的聯集，band=偵測線附近的帶狀區域
+HSV_MODES = ("crop", "union", "band")
+
+# 黑色範圍（H 可以是任意值，S 可以較寬鬆，V < 60 表示暗色）
+BLACK_LOWER = np.array([0, 0, 0], dtype=np.uint8)
+BLACK_UPPER = np.array([180, 255, 60], dtype=np.uint8)
+
+# 亮黃色範圍（H 15-45 黃色及偏橙、偏綠的黃色；S 50-255 允許較淡；V 100-255 允許較暗）
+YELLOW_LOWER = np.array([15, 50, 100], dtype=np.uint8)
+YELLOW_UPPER = np.array([45, 255, 255], dtype=np.uint8)
+
+# 去除遮罩噪點的形態學核心（共用）
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+
+def clip_bbox(bbox, frame_shape) -> tuple[int, int, int, int] | None:
+    """
+    將 [x, y, w, h] 邊界框裁切到畫面範圍內
+
+    Returns:
+        (x1, y1, x2, y2)；完全在畫面外時回傳 None
+    """
+    x, y, w, h = bbox
+    frame_h, frame_w = frame_shape[:2]
+    x1 = max(0, int(x))
+    y1 = max(0, int(y))
+    x2 = min(frame_w, int(x + w))
+    y2 = min(frame_h, int(y + h))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def clean_mask(mask: np.ndarray) -> np.ndarray:
+    """開運算加閉運算去除遮罩噪點"""
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, MORPH_KERNEL)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, MORPH_KERNEL)
+
+
+def mask_ratio(hsv: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> float:
+    """計算 HSV 影像中落在範圍內（去噪後）的像素比例"""
+    mask = clean_mask(cv2.inRange(hsv, lower, upper))
+    total_pixels = hsv.shape[0] * hsv.shape[1]
+    return cv2.countNonZero(mask) / total_pixels if total_pixels > 0 else 0.0
+
+
+def inspect_candy(
+    frame: np.ndarray,
+    bbox,
+    check_black: bool = True,
+    black_threshold: float = 0.03,
+    check_color: bool = True,
+    color_threshold: float = 0.70,
+    debug: bool = False,
+) -> str | None:
+    """
+    檢查單顆糖果的黑點與顏色（黑點優先，找到黑點就不再檢查顏色）
+
+    Args:
+        frame: 原始畫面 (BGR)
+        bbox: 邊界框 [x, y, w, h]
+        check_black: 是否檢查黑點
+        black_threshold: 黑色像素比例超過此值視為有黑點
+        check_color: 是否檢查顏色
+        color_threshold: 黃色像素比例低於此值視為顏色異常
+        debug: 是否輸出調試信息
+
+    Returns:
+        REASON_BLACK_SPOT、REASON_COLOR，或通過時回傳 None
+    """
+    if not (check_black or check_color):
+        return None
+    try:
+        rect = clip_bbox(bbox, frame.shape)
+        if rect is None:
+            return None
+        x1, y1, x2, y2 = rect
+        hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+
+        if check_black:
+            black_ratio = mask_ratio(hsv, BLACK_LOWER, BLACK_UPPER)
+            if black_ratio > black_threshold:
+                if debug:
+                    print(f"  [黑點檢測] 黑色像素比例: {black_ratio:.2%} (閾值: {black_threshold:.2%})")
+                return REASON_BLACK_SPOT
+
+        if check_color:
+            yellow_ratio = mask_ratio(hsv, YELLOW_LOWER, YELLOW_UPPER)
+            is_abnormal = yellow_ratio < color_threshold
+            if debug:
+                print(f"  [顏色檢測] 黃色像素比例: {yellow_ratio:.2%} (閾值: {color_threshold:.2%}) - {'異常' if is_abnormal else '正常'}")
+            if is_abnormal:
+                return REASON_COLOR
+
+        return None
+
+    except Exception as e:
+        logger.warning(f"糖果外觀檢查失敗: {e}")
+        return None
+
+
+class FrameInspector:
+    """
+    區域遮罩快取 - 對畫面中的一個區域只做一次 HSV 轉換與形態學處理
+
+    遮罩轉為積分影像後，任意矩形內的像素數只需四次查表，
+    整批糖果以 NumPy 一次算完，成本幾乎與糖果數量無關。
+    形態學在整個區域上進行，糖果邊界附近的像素會參考框外的鄰近像素，
+    因此比例與逐框檢查可能有極小差異。
+    """
+
+    def __init__(self, frame: np.ndarray, region: tuple[int, int, int, int], check_black: bool = True, check_color: bool = True):
+        """
+        轉換區域並建立遮罩的積分影像
+
+        Args:
+            frame: 原始畫面 (BGR)
+            region: 區域 (x1, y1, x2, y2)，需已在畫面範圍內
+            check_black: 是否建立黑色遮罩
+            check_color: 是否建立黃色遮罩
+        """
+        self.region = region
+        x1, y1, x2, y2 = region
+        hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+        self.black_sum = self._integral(hsv, BLACK_LOWER, BLACK_UPPER) if check_black else None
+        self.yellow_sum = self._integral(hsv, YELLOW_LOWER, YELLOW_UPPER) if check_color else None
+
+    @staticmethod
+    def _integral(hsv: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+        """去噪後遮罩的積分影像（值為像素數）"""
+        mask = clean_mask(cv2.inRange(hsv, lower, upper))
+        return cv2.integral(mask, sdepth=cv2.CV_32S) // 255
+
+    def covers(self, rect: tuple[int, int, int, int]) -> bool:
+        """區域是否完整包含 rect (x1, y1, x2, y2)"""
+        rx1, ry1, rx2, ry2 = self.region
+        x1, y1, x2, y2 = rect
+        return rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2
+
+    def inspect_rects(self, rects, black_threshold: float, color_threshold: float) -> list[str | None]:
+        """
+        以積分影像一次檢查多顆糖果（rects 需都在區域內）
+
+        Args:
+            rects: [(x1, y1, x2, y2), ...] 畫面座標
+            black_threshold: 黑色像素比例超過此值視為有黑點
+            color_threshold: 黃色像素比例低於此值視為顏色異常
+
+        Returns:
+            與 rects 對應的檢查結果串列
+        """
+        if not len(rects):
+            return []
+        coords = np.asarray(rects, dtype=np.int64) - np.array(self.region[:2] * 2)
+        x1, y1, x2, y2 = coords.T
+        area = (x2 - x1) * (y2 - y1)
+
+        def box_sum(integral):
+            return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+
+        is_black = np.zeros(len(coords), dtype=bool)
+        is_color = np.zeros(len(coords), dtype=bool)
+        if self.black_sum is not None:
+            is_black = box_sum(self.black_sum) / area > black_threshold
+        if self.yellow_sum is not None:
+            is_color = ~is_black & (box_sum(self.yellow_sum) / area < color_threshold)
+
+        return [
+            REASON_BLACK_SPOT if black else (REASON_COLOR if color else None)
+            for black, color in zip(is_black.tolist(), is_color.tolist())
+        ]
+
+
+def merge_rects(rects: list[tuple[int, int, int, int]], gap: int = 0) -> list[tuple[tuple[int, int, int, int], list[int]]]:
+    """
+    將互相重疊（或距離小於 gap）的矩形合併為群組（群組範圍為成員的外接矩形）
+
+    Args:
+        rects: [(x1, y1, x2, y2), ...]
+        gap: 間距小於此值的矩形也合併，以少量多餘像素換取較少的轉換次數
+
+    Returns:
+        [(群組範圍, [成員索引, ...]), ...]
+    """
+    groups = [(rect, [idx]) for idx, rect in enumerate(rects)]
+    merged = True
+    while merged and len(groups) > 1:
+        # 合併後外接矩形變大，可能又碰到其他群組，重複直到沒有重疊
+        merged = False
+        result = []
+        for rect, members in groups:
+            x1, y1, x2, y2 = rect
+            for pos, ((gx1, gy1, gx2, gy2), group_members) in enumerate(result):
+                if x1 < gx2 + gap and gx1 < x2 + gap and y1 < gy2 + gap and gy1 < y2 + gap:
+                    result[pos] = (
+                        (min(gx1, x1), min(gy1, y1), max(gx2, x2), max(gy2, y2)),
+                        group_members + members,
+                    )
+                    merged = True
+                    break
+            else:
+                result.append((rect, members))
+        groups = result
+    return groups
+
+
+def inspect_candies(
+    frame: np.ndarray,
+    bboxes,
+    check_black: bool = True,
+    black_threshold: float = 0.03,
+    check_color: bool = True,
+    color_threshold: float = 0.70,
+    mode: str = "crop",
+    region: tuple[int, int, int, int] | None = None,
+    merge_gap: int = 32,
+) -> list[str | None]:
+    """
+    檢查同一畫面中的多顆糖果
+
+    Args:
+        frame: 原始畫面 (BGR)
+        bboxes: 邊界框串列 [[x, y, w, h], ...]
+        mode: HSV 轉換範圍（見 HSV_MODES）
+        region: band 模式的區域 (x1, y1, x2, y2)；區域外的糖果改為逐框檢查
+        merge_gap: union 模式下間距小於此值的偵測框合併為同一區域
+        其餘參數同 inspect_candy
+
+    Returns:
+        與 bboxes 對應的檢查結果串列
+    """
+    if mode == "crop" or not (check_black or check_color):
+        return [
+            inspect_candy(frame, bbox, check_black, black_threshold, check_color, color_threshold)
+            for bbox in bboxes
+        ]
+
+    rects = [clip_bbox(bbox, frame.shape) for bbox in bboxes]
+    results = [None] * len(rects)
+    try:
+        if mode == "band" and region is not None:
+            # band：偵測線附近的固定區域轉換一次，區域外的糖果逐框檢查
+            frame_h, frame_w = frame.shape[:2]
+            x1, y1, x2, y2 = region
+            inspector = FrameInspector(
+                frame, (max(0, x1), max(0, y1), min(frame_w, x2), min(frame_h, y2)), check_black, check_color
+            )
+            inside = [idx for idx, rect in enumerate(rects) if rect is not None and inspector.covers(rect)]
+            reasons = inspector.inspect_rects([rects[idx] for idx in inside], black_threshold, color_threshold)
+            for idx, reason in zip(inside, reasons):
+                results[idx] = reason
+            covered = set(inside)
+            for idx, (bbox, rect) in enumerate(zip(bboxes, rects)):
+                if rect is not None and idx not in covered:
+                    results[idx] = inspect_candy(frame, bbox, check_black, black_threshold, check_color, color_threshold)
+        else:
+            # union：重疊或相鄰的偵測框合併後各轉換一次，重疊部分的像素不會重複轉換
+            valid_idx = [idx for idx, rect in enumerate(rects) if rect is not None]
+            for group_rect, members in merge_rects([rects[idx] for idx in valid_idx], merge_gap):
+                inspector = FrameInspector(frame, group_rect, check_black, check_color)
+                member_idx = [valid_idx[member] for member in members]
+                reasons = inspector.inspect_rects([rects[idx] for idx in member_idx], black_threshold, color_threshold)
+                for idx, reason in zip(member_idx, reasons):
+                    results[idx] = reason
+    except Exception as e:
+        logger.warning(f"糖果外觀檢查失敗: {e}")
+    return results
@@ -0,0 +1,247 @@
+"""
+效能指標模塊
+
+以固定區間的直方圖記錄各處理階段的耗時，並以 Prometheus 文字格式輸出（/metrics）。
+直方圖只累加各區間的次數與總和，不保留樣本，每次記錄只需一次二分搜尋，
+可以在偵測迴圈中每幀使用。同名攝影機共用同一組指標，重新建立攝影機後繼續累計。
+"""
+
+import bisect
+import math
+import threading
+
+# 處理階段耗時的區間上限（秒）
+STAGE_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0)
+# 噴氣延遲誤差的區間上限（秒）
+LATENESS_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+# 每幀的處理階段（jpeg_encode / preview_jpeg_encode 由串流廣播器記錄）
+STAGES = (
+    "capture_wait",
+    "inference",
+    "postprocess",
+    "color_check",
+    "tracking",
+    "drawing",
+    "jpeg_encode",
+    "preview_jpeg_encode",
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """固定區間直方圖（執行緒安全）"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        """
+        初始化直方圖
+
+        Args:
+            buckets: 各區間的上限（由小到大，+Inf 區間自動加上）
+        """
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """記錄一個數值"""
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        """取得各區間次數（非累計）與總和"""
+        with self._lock:
+            return list(self._counts), self._sum
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def quantile(self, q: float) -> float:
+        """
+        由區間次數估計分位數（區間內線性內插，與 Prometheus histogram_quantile 相同）
+
+        Args:
+            q: 0 到 1 之間的分位
+
+        Returns:
+            估計值；沒有資料時為 0
+        """
+        counts, _ = self.snapshot()
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for idx, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if idx == len(self.buckets):
+                    # 落在 +Inf 區間時只能回傳最大的有限上限
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx else 0.0
+                upper = self.buckets[idx]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def summary(self) -> dict:
+        """取得摘要（毫秒）"""
+        counts, total_sum = self.snapshot()
+        total = sum(counts)
+        return {
+            "count": total,
+            "mean_ms": round(total_sum / total * 1000.0, 3) if total else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000.0, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000.0, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000.0, 3),
+        }
+
+
+class Counter:
+    """只增不減的計數器（執行緒安全）"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        """增加計數"""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """指標登錄表 - 依名稱與標籤取得（必要時建立）指標，並輸出 Prometheus 文字格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}  # name -> [type, help, {labels: metric}]
+
+    def _get(self, kind: str, name: str, help_text: str, labels: dict, factory):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = [kind, help_text, {}]
+            elif family[0] != kind:
+                raise ValueError(f"指標 {name} 已登錄為 {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def histogram(self, name: str, help_text: str, buckets=STAGE_BUCKETS, **labels) -> Histogram:
+        """取得直方圖（同名同標籤回傳同一個實例）"""
+        return self._get("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        """取得計數器（同名同標籤回傳同一個實例）"""
+        return self._get("counter", name, help_text, labels, Counter)
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式"""
+        with self._lock:
+            families = [(name, kind, help_text, list(metrics.items())) for name, (kind, help_text, metrics) in self._families.items()]
+
+        lines = []
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                    continue
+                counts, total_sum = metric.snapshot()
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total_sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class CameraMetrics:
+    """單一攝影機的處理階段耗時與計數"""
+
+    def __init__(self, camera: str, registry: MetricsRegistry = REGISTRY):
+        """
+        建立（或取得既有的）攝影機指標
+
+        Args:
+            camera: 攝影機名稱（標籤值）
+            registry: 指標登錄表
+        """
+        self.camera = camera
+        self.stages = {
+            stage: registry.histogram("candy_stage_seconds", "每幀各處理階段的耗時（秒）", camera=camera, stage=stage)
+            for stage in STAGES
+        }
+        self.relay_lateness = registry.histogram(
+            "candy_relay_lateness_seconds", "噴氣實際觸發比預定時間晚的秒數", LATENESS_BUCKETS, camera=camera
+        )
+        self.frames = registry.counter("candy_frames_total", "已處理的畫面數", camera=camera)
+        self.dropped_frames = registry.counter("candy_dropped_frames_total", "偵測來不及處理而跳過的畫面數", camera=camera)
+        self.skipped_inferences = registry.counter(
+            "candy_skipped_inferences_total", "動態閘門判定無變化而略過的推論次數", camera=camera
+        )
+
+    def stage(self, name: str) -> Histogram:
+        """取得處理階段的直方圖"""
+        return self.stages[name]
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """記錄一個處理階段的耗時"""
+        self.stages[stage].observe(seconds)
+
+    def summary(self) -> dict:
+        """取得摘要（只列出有資料的階段，單位毫秒）"""
+        stages = {name: hist.summary() for name, hist in self.stages.items() if hist.count}
+        return {
+            "frames": self.frames.value,
+            "dropped_frames": self.dropped_frames.value,
+            "skipped_inferences": self.skipped_inferences.value,
+            "stages": stages,
+            "relay_lateness": self.relay_lateness.summary() if self.relay_lateness.count else None,
+        }
+
+
+_camera_metrics = {}
+_camera_metrics_lock = threading.Lock()
+
+
+def camera_metrics(camera: str) -> CameraMetrics:
+    """取得攝影機指標（同名攝影機共用）"""
+    with _camera_metrics_lock:
+        metrics = _camera_metrics.get(camera)
+        if metrics is None:
+            metrics = _camera_metrics[camera] = CameraMetrics(camera)
+        return metrics
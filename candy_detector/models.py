@@ -7,6 +7,10 @@
 from dataclasses import dataclass, field
 import cv2
 
+from .framepool import FramePool, release_frame
+from .streaming import FrameSlot
+from .tracker import TrackTable
+
 
 @dataclass
 class TrackState:
@@ -22,6 +26,10 @@ class TrackState:
         missed_frames: 連續遺漏的幀數
         last_class: 最後檢測到的類別
         age: 物體被追蹤的總幀數
+        bbox: 最後一次偵測的邊界框 (x, y, w, h)
+        score: 最後一次偵測的信心分數
+        max_score: 追蹤期間的最高信心分數
+        rule: 判定 abnormal 的規則代碼（events.RULE_*）
     """
 
     center: tuple[int, int]
@@ -32,6 +40,10 @@ class TrackState:
     missed_frames: int = 0
     last_class: str = ""
     age: int = 0
+    bbox: tuple[int, int, int, int] | None = None
+    score: float = 0.0
+    max_score: float = 0.0
+    rule: int = 0
 
 
 @dataclass
@@ -48,7 +60,7 @@ class CameraContext:
         line_x1: 偵測線起點 X 坐標
         line_x2: 偵測線終點 X 坐標
         cap: OpenCV 攝影機物件
-        tracking_objects: 追蹤物體字典 {track_id: TrackState}
+        tracking_objects: 追蹤物體表（TrackTable，欄位陣列）
         track_id: 下一個追蹤 ID
         total_num: 通過的糖果總數
         normal_num: 正常糖果數
@@ -59,10 +71,23 @@ class CameraContext:
         frame_index: 當前幀索引
         use_roi: 是否使用 ROI
         roi_processor: ROI 處理器
-        kalman_trackers: 卡爾曼追蹤器字典
+        kalman_tracker: 批次卡爾曼濾波追蹤器（所有追蹤物體共用）
         use_kalman: 是否使用卡爾曼濾波
         adaptive_tracker: 自適應追蹤器
         use_adaptive: 是否使用自適應追蹤
+        frame_slot: 偵測執行緒發布最新畫面的共享槽
+        detection_thread: 偵測執行緒
+        detection_stop: 偵測執行緒停止事件
+        stream_hub: 處理後畫面的 MJPEG 廣播器
+        preview_hub: 原始畫面（錄影預覽）的 MJPEG 廣播器
+        grabber: 抓取執行緒（啟用時由它負責 cap.read()）
+        last_capture_ts: 目前處理畫面的擷取時間 (time.monotonic)
+        dropped_frames: 偵測來不及處理而跳過的畫面數
+        relay_scheduler: 繼電器排程器（依擷取時間觸發噴氣）
+        motion_gate: 動態閘門（偵測線附近沒有變化時略過推論）
+        band_cropper: 偵測線帶狀裁切處理器（只把偵測線附近送進模型）
+        event_log: 糖果事件記錄（每顆過線計數的糖果一筆，None 表示不記錄）
+        metrics: 處理階段耗時與計數（metrics.CameraMetrics，第一次處理畫面時建立）
     """
 
     name: str
@@ -73,7 +98,7 @@ class CameraContext:
     line_x1: int
     line_x2: int
     cap: cv2.VideoCapture
-    tracking_objects: dict = field(default_factory=dict)
+    tracking_objects: TrackTable = field(default_factory=TrackTable)
     track_id: int = 1
     total_num: int = 0
     normal_num: int = 0
@@ -87,20 +112,67 @@ class CameraContext:
     # 優化相關字段
     use_roi: bool = False
     roi_processor: object = None
-    kalman_trackers: dict = field(default_factory=dict)
+    kalman_tracker: object = None
     use_kalman: bool = False
     adaptive_tracker: object = None
     use_adaptive: bool = False
     relay_paused: bool = False
     
-    # 畫面緩存（供錄影預覽等功能使用）
+    # 畫面緩存（供錄影預覽等功能使用，皆為唯讀 FrameHandle，換下一張時釋放）
     latest_frame: object = None  # 最新的原始畫面
     latest_processed_frame: object = None  # 最新的處理後畫面
+    frame_pool: FramePool = field(default_factory=FramePool)  # 未使用抓取執行緒時的讀取緩衝池
+    display_pool: FramePool = field(default_factory=FramePool)  # 繪製標註用的顯示緩衝池
+
+    # 偵測執行緒（與串流觀看者解耦）
+    frame_slot: FrameSlot = field(default_factory=FrameSlot)
+    detection_thread: object = None
+    detection_stop: object = None
+    stream_hub: object = None
+    preview_hub: object = None
+
+    # 抓取執行緒
+    grabber: object = None
+    last_capture_ts: float = 0.0
+    dropped_frames: int = 0
+
+    # 繼電器排程
+    relay_scheduler: object = None
+
+    # 動態閘門
+    motion_gate: object = None
+
+    # 偵測線帶狀裁切
+    band_cropper: object = None
+
+    # 糖果事件記錄
+    event_log: object = None
+
+    # 效能指標
+    metrics: object = None
 
     def release(self) -> None:
         """釋放攝影機資源"""
         if self.cap and self.cap.isOpened():
             self.cap.release()
+        if self.relay_scheduler is not None:
+            self.relay_scheduler.stop()
+            self.relay_scheduler = None
+        self.set_latest_frames(None, None)
+
+    def set_latest_frames(self, raw, processed) -> None:
+        """
+        更新最新畫面緩存（接手呼叫端的引用，並釋放上一張畫面的引用）
+
+        Args:
+            raw: 原始畫面 FrameHandle
+            processed: 處理後畫面 FrameHandle
+        """
+        old_raw, old_processed = self.latest_frame, self.latest_processed_frame
+        self.latest_frame = raw
+        self.latest_processed_frame = processed
+        release_frame(old_raw)
+        release_frame(old_processed)
 
     def get_stats(self) -> dict:
         """
@@ -114,4 +186,8 @@ class CameraContext:
             "normal": self.normal_num,
             "abnormal": self.abnormal_num,
             "tracking": len(self.tracking_objects),
+            "dropped_frames": self.dropped_frames,
+            "relay": self.relay_scheduler.get_stats() if self.relay_scheduler is not None else {},
+            "motion_gate": self.motion_gate.get_stats() if self.motion_gate is not None else {},
+            "band_crop": self.band_cropper.get_stats() if self.band_cropper is not None else {},
         }
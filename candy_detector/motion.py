@@ -0,0 +1,156 @@
+"""
+動態閘門模塊
+
+大部分畫面中偵測線附近只有空輸送帶。這裡只看偵測線左右延伸一段距離的帶狀區域，
+縮小後轉灰階與前一幀相減，畫面沒有變化時略過 YOLO 推論。
+偵測到變化後會持續推論數幀，並定期強制推論一次，避免漏掉緩慢進入的糖果。
+"""
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """偵測線帶狀區域的畫面差異閘門"""
+
+    def __init__(
+        self,
+        margin: int = 150,
+        downscale: int = 4,
+        pixel_threshold: int = 18,
+        min_changed_ratio: float = 0.002,
+        hold_frames: int = 3,
+        force_every: int = 30,
+    ):
+        """
+        初始化閘門
+
+        Args:
+            margin: 偵測線左右各延伸的像素數（需大於糖果在推論間隔內移動的距離）
+            downscale: 縮小倍率（差異只需粗略判斷）
+            pixel_threshold: 灰階差異超過此值的像素視為有變化
+            min_changed_ratio: 有變化的像素比例超過此值才推論
+            hold_frames: 偵測到變化後持續推論的幀數
+            force_every: 每隔多少幀強制推論一次（0 表示不強制）
+        """
+        self.margin = margin
+        self.downscale = max(1, int(downscale))
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.hold_frames = hold_frames
+        self.force_every = force_every
+
+        self._prev = None
+        self._band = None
+        self._hold = 0
+        self._since_inference = 0
+
+        self.frames = 0
+        self.inferred = 0
+        self.skipped = 0
+        self.forced = 0
+        self.last_changed_ratio = 0.0
+        self.last_decision = True
+
+    @classmethod
+    def from_settings(cls, settings) -> "MotionGate":
+        """
+        從偵測設定快照建立閘門
+
+        Args:
+            settings: DetectionSettings 實例
+
+        Returns:
+            MotionGate 實例
+        """
+        return cls(
+            margin=settings.motion_gate_margin,
+            downscale=settings.motion_gate_downscale,
+            pixel_threshold=settings.motion_gate_pixel_threshold,
+            min_changed_ratio=settings.motion_gate_min_ratio,
+            hold_frames=settings.motion_gate_hold_frames,
+            force_every=settings.motion_gate_force_every,
+        )
+
+    def _band_image(self, frame: np.ndarray, line_x1: int, line_x2: int) -> np.ndarray:
+        """取出帶狀區域並縮小為灰階影像"""
+        frame_w = frame.shape[1]
+        x1 = max(0, min(line_x1, line_x2) - self.margin)
+        x2 = min(frame_w, max(line_x1, line_x2) + self.margin)
+        band = (x1, x2)
+        if band != self._band:
+            # 偵測線移動後重新建立參考畫面
+            self._band = band
+            self._prev = None
+        region = frame[:, x1:x2]
+        small = cv2.resize(
+            region,
+            (max(1, region.shape[1] // self.downscale), max(1, region.shape[0] // self.downscale)),
+            interpolation=cv2.INTER_AREA,
+        )
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_infer(self, frame: np.ndarray, line_x1: int, line_x2: int) -> bool:
+        """
+        判斷這一幀是否需要推論
+
+        Args:
+            frame: 原始畫面
+            line_x1: 偵測線起點 X 坐標
+            line_x2: 偵測線終點 X 坐標
+
+        Returns:
+            True 表示需要推論
+        """
+        self.frames += 1
+        small = self._band_image(frame, line_x1, line_x2)
+        prev, self._prev = self._prev, small
+
+        if prev is None:
+            changed_ratio = 1.0
+        else:
+            diff = cv2.absdiff(small, prev)
+            changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+            changed_ratio = changed / diff.size
+        self.last_changed_ratio = changed_ratio
+
+        if changed_ratio > self.min_changed_ratio:
+            self._hold = self.hold_frames
+            decision = True
+        elif self._hold > 0:
+            self._hold -= 1
+            decision = True
+        elif self.force_every and self._since_inference + 1 >= self.force_every:
+            self.forced += 1
+            decision = True
+        else:
+            decision = False
+
+        if decision:
+            self.inferred += 1
+            self._since_inference = 0
+        else:
+            self.skipped += 1
+            self._since_inference += 1
+        self.last_decision = decision
+        return decision
+
+    def reset(self) -> None:
+        """清除參考畫面（下一幀一定推論）"""
+        self._prev = None
+        self._hold = 0
+        self._since_inference = 0
+
+    def get_stats(self) -> dict:
+        """取得閘門統計"""
+        return {
+            "frames": self.frames,
+            "inferred": self.inferred,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "skip_ratio": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+            "last_changed_ratio": round(self.last_changed_ratio, 4),
+            "last_decision": "infer" if self.last_decision else "skip",
+        }
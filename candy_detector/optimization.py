@@ -15,6 +15,9 @@ from dataclasses import dataclass
 from typing import List, Tuple, Optional, Dict
 import cv2
 
+from .inference import extract_yolov8_result
+from .postprocess import nms, to_arrays
+
 
 # ============================================================================
 # 卡爾曼濾波追蹤器
@@ -109,129 +112,271 @@ class KalmanTracker:
         return self.state.vx, self.state.vy
 
 
+class BatchKalmanTracker:
+    """
+    批次卡爾曼濾波追蹤器 - 所有追蹤物體的狀態與協方差疊成陣列，每幀一次完成預測與更新
+    
+    狀態為常速度模型 [x, y, vx, vy]，測量值為偵測框中心 [x, y]。
+    以 key（追蹤 ID）對應到陣列列號，移除時把最後一列搬到空出的位置，陣列保持緊密。
+    """
+    
+    def __init__(self, process_noise: float = 0.1, measure_noise: float = 0.5, capacity: int = 64):
+        """
+        初始化批次追蹤器
+        
+        Args:
+            process_noise: 過程噪聲 - 越大越相信新測量值
+            measure_noise: 測量噪聲 - 越大越相信預測值
+            capacity: 初始容量（不足時自動加倍）
+        """
+        self.process_noise = process_noise
+        self.measure_noise = measure_noise
+        self.Q = np.eye(4) * process_noise
+        self.R = np.eye(2) * measure_noise
+        
+        self._x = np.zeros((capacity, 4))
+        self._P = np.zeros((capacity, 4, 4))
+        self._keys = []
+        self._rows = {}
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._rows
+    
+    def _grow(self) -> None:
+        capacity = len(self._x) * 2
+        x = np.zeros((capacity, 4))
+        P = np.zeros((capacity, 4, 4))
+        x[:len(self._keys)] = self._x[:len(self._keys)]
+        P[:len(self._keys)] = self._P[:len(self._keys)]
+        self._x, self._P = x, P
+    
+    def add(self, key, position: Tuple[float, float], velocity: Optional[Tuple[float, float]] = None) -> None:
+        """
+        加入一個追蹤物體
+        
+        Args:
+            key: 追蹤 ID
+            position: 初始位置 (x, y)
+            velocity: 初始速度（例如其他糖果的輸送帶速度），None 時為 0 並放大速度不確定度
+        """
+        if key in self._rows:
+            self.remove(key)
+        if len(self._keys) == len(self._x):
+            self._grow()
+        row = len(self._keys)
+        vx, vy = velocity if velocity is not None else (0.0, 0.0)
+        self._x[row] = (position[0], position[1], vx, vy)
+        velocity_var = 10.0 if velocity is not None else 400.0
+        self._P[row] = np.diag([100.0, 100.0, velocity_var, velocity_var])
+        self._keys.append(key)
+        self._rows[key] = row
+    
+    def remove(self, key) -> None:
+        """移除一個追蹤物體"""
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self._keys) - 1
+        if row != last:
+            moved_key = self._keys[last]
+            self._x[row] = self._x[last]
+            self._P[row] = self._P[last]
+            self._keys[row] = moved_key
+            self._rows[moved_key] = row
+        self._keys.pop()
+    
+    def retain(self, keys) -> None:
+        """只保留指定的追蹤物體（外部清除追蹤字典後同步用）"""
+        keep = set(keys)
+        for key in [key for key in self._keys if key not in keep]:
+            self.remove(key)
+    
+    def clear(self) -> None:
+        """清除所有追蹤物體"""
+        self._keys.clear()
+        self._rows.clear()
+    
+    def rows(self, keys) -> np.ndarray:
+        """取得追蹤 ID 對應的列號"""
+        return np.fromiter((self._rows[key] for key in keys), dtype=np.intp, count=len(keys))
+    
+    def predict(self, dt: float = 1.0) -> None:
+        """
+        所有追蹤物體同時預測下一幀位置
+        
+        Args:
+            dt: 時間步長（幀）
+        """
+        n = len(self._keys)
+        if n == 0:
+            return
+        F = np.array([[1.0, 0.0, dt, 0.0],
+                      [0.0, 1.0, 0.0, dt],
+                      [0.0, 0.0, 1.0, 0.0],
+                      [0.0, 0.0, 0.0, 1.0]])
+        self._x[:n] = self._x[:n] @ F.T
+        self._P[:n] = F @ self._P[:n] @ F.T + self.Q
+    
+    def update(self, rows: np.ndarray, measurements: np.ndarray) -> None:
+        """
+        以測量值更新指定列的狀態
+        
+        Args:
+            rows: (K,) 列號
+            measurements: (K,2) 測量位置
+        """
+        if len(rows) == 0:
+            return
+        x = self._x[rows]
+        P = self._P[rows]
+        # H = [I 0]，H P H^T 即為位置區塊
+        S = P[:, :2, :2] + self.R
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        innovation = np.asarray(measurements, dtype=np.float64) - x[:, :2]
+        self._x[rows] = x + np.einsum('nij,nj->ni', K, innovation)
+        self._P[rows] = P - K @ P[:, :2, :]
+    
+    def positions(self, rows: np.ndarray = None) -> np.ndarray:
+        """取得位置（預設為全部，順序與加入順序無關，需以 rows() 對應）"""
+        if rows is None:
+            return self._x[:len(self._keys), :2]
+        return self._x[rows, :2]
+    
+    def velocities(self, rows: np.ndarray = None) -> np.ndarray:
+        """取得速度"""
+        if rows is None:
+            return self._x[:len(self._keys), 2:]
+        return self._x[rows, 2:]
+
+
 # ============================================================================
 # 多尺度檢測器
 # ============================================================================
 
 class MultiScaleDetector:
-    """多尺度檢測 - 增強對不同尺寸物體的檢測"""
+    """
+    多尺度檢測 - 增強對不同尺寸物體的檢測
+
+    兩種後端都會把輸入畫面縮放到固定的網路輸入尺寸，事先縮放畫面並不會改變偵測尺度，
+    因此這裡把縮放因子對應為網路輸入尺寸（416 x 1.25 -> 512），每個尺度推論一次，
+    再以陣列 NMS 合併所有尺度的結果。
+    """
     
-    def __init__(self, scales: List[float] = None):
+    def __init__(
+        self,
+        scales: List[float] = None,
+        base_input_size: int = 416,
+        nms_method: str = "hard",
+        soft_nms_sigma: float = 0.5,
+    ):
         """
         初始化多尺度檢測器
         
         Args:
             scales: 縮放因子列表，例如 [0.5, 0.75, 1.0, 1.25]
+            base_input_size: 模型原本的輸入尺寸（config.ini [Detection] input_size）
+            nms_method: 合併各尺度結果的方式，"hard" 或 "gaussian"（軟 NMS）
+            soft_nms_sigma: 高斯軟 NMS 的衰減參數
         """
         self.scales = scales or [0.75, 1.0, 1.25]
+        self.base_input_size = int(base_input_size)
+        self.nms_method = nms_method
+        self.soft_nms_sigma = soft_nms_sigma
+        # 網路輸入需為 32 的倍數，重複的尺寸只推論一次
+        self.input_sizes = sorted({max(32, int(round(self.base_input_size * scale / 32)) * 32) for scale in self.scales})
+    
+    def _detect_at_size(self, frame: np.ndarray, gray_frame, model, size: int, conf_threshold: float, nms_threshold: float, model_type: str):
+        """以指定的網路輸入尺寸推論一次，回傳原始畫面座標的 (classes, scores, boxes)"""
+        if model_type == 'yolov8':
+            results = model.predict(frame, imgsz=size, conf=conf_threshold, iou=nms_threshold, verbose=False)
+            return extract_yolov8_result(results[0])
+
+        model.setInputParams(size=(size, size), scale=1 / 255, swapRB=False)
+        try:
+            return model.detect(gray_frame, conf_threshold, nms_threshold)
+        finally:
+            if size != self.base_input_size:
+                model.setInputParams(size=(self.base_input_size, self.base_input_size), scale=1 / 255, swapRB=False)
     
-    def detect_multi_scale(self, frame: np.ndarray, model, conf_threshold: float, nms_threshold: float) -> List[Dict]:
+    def detect_arrays(
+        self,
+        frame: np.ndarray,
+        model,
+        conf_threshold: float,
+        nms_threshold: float,
+        model_type: str = 'yolov4',
+        model_lock=None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
-        在多個尺度上進行檢測
+        在多個尺度上進行檢測並合併結果
         
         Args:
-            frame: 輸入影像
-            model: YOLO 模型
+            frame: 輸入影像 (BGR)
+            model: YOLO 模型（cv2.dnn_DetectionModel 或 ultralytics YOLO）
             conf_threshold: 信心度閾值
             nms_threshold: NMS 閾值
+            model_type: 'yolov4' 或 'yolov8'
+            model_lock: 模型鎖（YOLOv4 需在鎖內切換輸入尺寸）
             
         Returns:
-            合併後的檢測結果列表
+            (classes, scores, boxes)，boxes 為原始畫面座標的 xywh
         """
-        all_detections = []
-        frame_h, frame_w = frame.shape[:2]
-        
-        for scale in self.scales:
-            # 縮放影像
-            scaled_w = int(frame_w * scale)
-            scaled_h = int(frame_h * scale)
-            scaled_frame = cv2.resize(frame, (scaled_w, scaled_h))
-            
-            # 執行檢測
-            gray_frame = cv2.cvtColor(scaled_frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else scaled_frame
-            classes, scores, boxes = model.detect(gray_frame, conf_threshold, nms_threshold)
-            
-            # 縮放回原始尺寸
-            for classid, score, (x, y, w, h) in zip(classes, scores, boxes):
-                x_orig = int(x / scale)
-                y_orig = int(y / scale)
-                w_orig = int(w / scale)
-                h_orig = int(h / scale)
-                cx = x_orig + w_orig // 2
-                cy = y_orig + h_orig // 2
-                
-                all_detections.append({
-                    'classid': int(classid),
-                    'score': float(score),
-                    'bbox': (x_orig, y_orig, w_orig, h_orig),
-                    'center': (cx, cy),
-                    'scale': scale
-                })
-        
-        # 使用軟NMS合併多尺度結果
-        return self._soft_nms(all_detections, nms_threshold)
-    
-    @staticmethod
-    def _soft_nms(detections: List[Dict], nms_threshold: float) -> List[Dict]:
-        """
-        軟NMS - 降低重複檢測，同時保留有價值的檢測
+        # YOLOv4 使用灰階輸入，所有尺度共用同一次轉換
+        gray_frame = None
+        if model_type != 'yolov8':
+            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+        
+        all_classes, all_scores, all_boxes = [], [], []
+        for size in self.input_sizes:
+            if model_lock is not None:
+                with model_lock:
+                    classes, scores, boxes = self._detect_at_size(frame, gray_frame, model, size, conf_threshold, nms_threshold, model_type)
+            else:
+                classes, scores, boxes = self._detect_at_size(frame, gray_frame, model, size, conf_threshold, nms_threshold, model_type)
+            classes, scores, boxes = to_arrays(classes, scores, boxes)
+            all_classes.append(classes)
+            all_scores.append(scores)
+            all_boxes.append(boxes)
+        
+        classes = np.concatenate(all_classes)
+        scores = np.concatenate(all_scores)
+        boxes = np.concatenate(all_boxes)
+        if len(self.input_sizes) == 1:
+            return classes, scores, boxes
+        
+        keep, kept_scores = nms(
+            classes, scores, boxes, nms_threshold,
+            method=self.nms_method, sigma=self.soft_nms_sigma, score_threshold=conf_threshold,
+        )
+        return classes[keep], kept_scores, boxes[keep]
+    
+    def detect_multi_scale(self, frame: np.ndarray, model, conf_threshold: float, nms_threshold: float, model_type: str = 'yolov4') -> List[Dict]:
+        """
+        在多個尺度上進行檢測（字典格式）
         
         Args:
-            detections: 檢測結果列表
+            frame: 輸入影像
+            model: YOLO 模型
+            conf_threshold: 信心度閾值
             nms_threshold: NMS 閾值
+            model_type: 'yolov4' 或 'yolov8'
             
         Returns:
-            過濾後的檢測結果
+            合併後的檢測結果列表
         """
-        if not detections:
-            return []
-        
-        # 按分數排序
-        sorted_detections = sorted(detections, key=lambda x: x['score'], reverse=True)
-        keep = []
-        
-        for i, det in enumerate(sorted_detections):
-            keep_det = True
-            det_box = det['bbox']
-            det_area = det_box[2] * det_box[3]
-            
-            for kept_det in keep:
-                kept_box = kept_det['bbox']
-                kept_area = kept_box[2] * kept_box[3]
-                
-                # 計算 IoU
-                iou = MultiScaleDetector._calculate_iou(det_box, kept_box)
-                
-                if iou > nms_threshold and det['classid'] == kept_det['classid']:
-                    keep_det = False
-                    break
-            
-            if keep_det:
-                keep.append(det)
-        
-        return keep
-    
-    @staticmethod
-    def _calculate_iou(box1: Tuple[int, int, int, int], box2: Tuple[int, int, int, int]) -> float:
-        """計算兩個邊界框的 IoU (交集除以並集)"""
-        x1_min, y1_min, w1, h1 = box1
-        x1_max, y1_max = x1_min + w1, y1_min + h1
-        
-        x2_min, y2_min, w2, h2 = box2
-        x2_max, y2_max = x2_min + w2, y2_min + h2
-        
-        inter_x_min = max(x1_min, x2_min)
-        inter_y_min = max(y1_min, y2_min)
-        inter_x_max = min(x1_max, x2_max)
-        inter_y_max = min(y1_max, y2_max)
-        
-        if inter_x_max < inter_x_min or inter_y_max < inter_y_min:
-            return 0.0
-        
-        inter_area = (inter_x_max - inter_x_min) * (inter_y_max - inter_y_min)
-        union_area = w1 * h1 + w2 * h2 - inter_area
-        
-        return inter_area / union_area if union_area > 0 else 0.0
+        classes, scores, boxes = self.detect_arrays(frame, model, conf_threshold, nms_threshold, model_type)
+        detections = []
+        for classid, score, (x, y, w, h) in zip(classes.tolist(), scores.tolist(), boxes.astype(int).tolist()):
+            detections.append({
+                'classid': classid,
+                'score': score,
+                'bbox': (x, y, w, h),
+                'center': (x + w // 2, y + h // 2),
+            })
+        return detections
 
 
 # ============================================================================
@@ -277,6 +422,117 @@ class ROIProcessor:
         return self.roi_x1 <= x <= self.roi_x2 and self.roi_y1 <= y <= self.roi_y2
 
 
+class BandCropProcessor:
+    """
+    偵測線帶狀裁切 - 只把偵測線附近的區域送進模型
+    
+    計數只取決於偵測線附近的追蹤物體，帶狀區域補成正方形（letterbox）後再交給模型，
+    模型縮放時長寬等比例，同樣的輸入尺寸下糖果的解析度比整張畫面高。
+    帶狀區域的寬度依實測輸送帶速度調整，確保糖果過線前後都有足夠幀數可以追蹤。
+    """
+    
+    def __init__(
+        self,
+        frame_w: int,
+        frame_h: int,
+        min_margin: int = 200,
+        track_frames: int = 6,
+        max_margin: int = None,
+        y1: int = 0,
+        y2: int = None,
+        pad_value: int = 114,
+    ):
+        """
+        初始化帶狀裁切處理器
+        
+        Args:
+            frame_w: 影像寬度
+            frame_h: 影像高度
+            min_margin: 偵測線左右至少延伸的像素數
+            track_frames: 糖果過線前後至少需要被偵測到的幀數（依速度換算延伸距離）
+            max_margin: 延伸距離上限，預設為影像寬度
+            y1: 帶狀區域上邊界
+            y2: 帶狀區域下邊界
+            pad_value: letterbox 補邊的灰階值
+        """
+        self.frame_w = frame_w
+        self.frame_h = frame_h
+        self.min_margin = min_margin
+        self.track_frames = track_frames
+        self.max_margin = max_margin or frame_w
+        self.y1 = max(0, y1)
+        self.y2 = min(frame_h, y2 or frame_h)
+        self.pad_value = pad_value
+        
+        self.speed = 0.0  # 輸送帶速度（像素/幀，指數移動平均）
+        self.last_crop = (0, self.y1, frame_w, self.y2)
+        self._canvas = None
+    
+    @property
+    def margin(self) -> int:
+        """目前的延伸距離（取 32 的倍數，避免畫布尺寸頻繁變動）"""
+        margin = max(self.min_margin, self.speed * self.track_frames)
+        margin = int(math.ceil(margin / 32)) * 32
+        return min(margin, self.max_margin)
+    
+    def update_speed(self, displacements: List[float], alpha: float = 0.2) -> None:
+        """
+        以本幀配對成功的追蹤物體位移更新輸送帶速度
+        
+        Args:
+            displacements: 各追蹤物體本幀的 X 方向位移（像素）
+            alpha: 指數移動平均的權重
+        """
+        if not displacements:
+            return
+        speed = float(np.median(np.abs(displacements)))
+        self.speed = speed if self.speed == 0.0 else (1 - alpha) * self.speed + alpha * speed
+    
+    def extract(self, frame: np.ndarray, line_x1: int, line_x2: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        取出偵測線附近的帶狀區域並補成正方形
+        
+        Args:
+            frame: 原始畫面
+            line_x1: 偵測線起點 X 坐標
+            line_x2: 偵測線終點 X 坐標
+            
+        Returns:
+            (送進模型的畫面, 帶狀區域左上角在原始畫面中的座標)
+            帶狀區域放在畫布左上角，偵測框只需加上這個偏移
+        """
+        margin = self.margin
+        x1 = max(0, min(line_x1, line_x2) - margin)
+        x2 = min(frame.shape[1], max(line_x1, line_x2) + margin)
+        y1, y2 = self.y1, min(frame.shape[0], self.y2)
+        self.last_crop = (x1, y1, x2, y2)
+        band = frame[y1:y2, x1:x2]
+        
+        band_h, band_w = band.shape[:2]
+        side = max(band_h, band_w)
+        if band_h == band_w:
+            return band, (x1, y1)
+        
+        canvas_shape = (side, side) + band.shape[2:]
+        if self._canvas is None or self._canvas.shape != canvas_shape or self._canvas.dtype != band.dtype:
+            self._canvas = np.full(canvas_shape, self.pad_value, dtype=band.dtype)
+        else:
+            # 畫布重複使用，只需重設補邊區域
+            self._canvas[:band_h, band_w:] = self.pad_value
+            self._canvas[band_h:] = self.pad_value
+        self._canvas[:band_h, :band_w] = band
+        return self._canvas, (x1, y1)
+    
+    def get_stats(self) -> Dict:
+        """取得帶狀裁切狀態"""
+        x1, y1, x2, y2 = self.last_crop
+        return {
+            "speed_px_per_frame": round(self.speed, 2),
+            "margin": self.margin,
+            "crop": [x1, y1, x2, y2],
+        }
+
+
 # ============================================================================
 # 自適應追蹤參數調整器
 # ============================================================================
@@ -0,0 +1,213 @@
+"""
+偵測後處理模塊
+
+將模型輸出的 classes/scores/boxes 轉為 NumPy 陣列，
+以陣列遮罩一次完成尺寸、長寬比、可見比例、ROI 座標轉換與類別範圍檢查，
+輸出緊湊的結構化偵測陣列；並提供以陣列運算的硬 NMS 與高斯軟 NMS。
+"""
+
+import configparser
+from dataclasses import dataclass
+
+import numpy as np
+
+# 結構化偵測陣列的欄位（bbox 為 x, y, w, h，皆為原始畫面座標）
+DETECTION_DTYPE = np.dtype([
+    ("classid", np.int32),
+    ("score", np.float32),
+    ("bbox", np.int32, (4,)),
+    ("center", np.int32, (2,)),
+])
+
+
+@dataclass(frozen=True)
+class DetectionFilter:
+    """偵測框過濾條件（對應 config.ini [Detection] 區塊）"""
+
+    min_box_size: float = 20
+    max_box_size: float = 400
+    min_aspect_ratio: float = 0.4
+    max_aspect_ratio: float = 2.5
+    min_visible_ratio: float = 0.3
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser | None) -> "DetectionFilter":
+        """
+        從設定檔讀取過濾條件
+
+        Args:
+            config: ConfigParser 物件，為 None 時使用預設值
+
+        Returns:
+            DetectionFilter 實例
+        """
+        if config is None:
+            return cls()
+        defaults = cls()
+        return cls(
+            min_box_size=config.getfloat("Detection", "min_box_size", fallback=defaults.min_box_size),
+            max_box_size=config.getfloat("Detection", "max_box_size", fallback=defaults.max_box_size),
+            min_aspect_ratio=config.getfloat("Detection", "min_aspect_ratio", fallback=defaults.min_aspect_ratio),
+            max_aspect_ratio=config.getfloat("Detection", "max_aspect_ratio", fallback=defaults.max_aspect_ratio),
+            min_visible_ratio=config.getfloat("Detection", "min_visible_ratio", fallback=defaults.min_visible_ratio),
+        )
+
+
+def to_arrays(classes, scores, boxes) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    將模型輸出統一轉為 NumPy 陣列
+
+    YOLOv4 (cv2.dnn) 回傳 (N,1)/(N,) 陣列或空 tuple，YOLOv8 可能回傳巢狀串列，
+    這裡全部攤平為 (N,) 類別、(N,) 分數與 (N,4) xywh 邊界框。
+
+    Returns:
+        (class_ids, scores, boxes)
+    """
+    class_ids = np.asarray(classes, dtype=np.int32).reshape(-1)
+    score_arr = np.asarray(scores, dtype=np.float32).reshape(-1)
+    box_arr = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return class_ids, score_arr, box_arr
+
+
+def filter_detections(
+    classes,
+    scores,
+    boxes,
+    frame_shape: tuple,
+    num_classes: int,
+    det_filter: DetectionFilter | None = None,
+    offset: tuple[int, int] = (0, 0),
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    以陣列遮罩過濾偵測結果
+
+    Args:
+        classes: 模型輸出的類別 ID
+        scores: 模型輸出的信心分數
+        boxes: 模型輸出的 xywh 邊界框（偵測畫面座標）
+        frame_shape: 偵測畫面的 shape（用於計算可見比例）
+        num_classes: 有效類別數量
+        det_filter: 過濾條件，None 時使用預設值
+        offset: 偵測畫面左上角在原始畫面中的座標（ROI 偏移）
+
+    Returns:
+        (DETECTION_DTYPE 結構化陣列, 通過幾何過濾但類別超出範圍的類別 ID)
+    """
+    det_filter = det_filter or DetectionFilter()
+    class_ids, score_arr, box_arr = to_arrays(classes, scores, boxes)
+    if len(class_ids) == 0:
+        return np.empty(0, dtype=DETECTION_DTYPE), np.empty(0, dtype=np.int32)
+
+    frame_height, frame_width = frame_shape[:2]
+    x, y, w, h = box_arr.T
+
+    # 1. 邊界框大小
+    keep = (w >= det_filter.min_box_size) & (h >= det_filter.min_box_size)
+    keep &= (w <= det_filter.max_box_size) & (h <= det_filter.max_box_size)
+
+    # 2. 長寬比（大小過濾已保證 h > 0）
+    aspect_ratio = w / np.maximum(h, 1e-6)
+    keep &= (aspect_ratio >= det_filter.min_aspect_ratio) & (aspect_ratio <= det_filter.max_aspect_ratio)
+
+    # 3. 畫面內可見比例（允許邊緣物體）
+    visible_w = np.clip(np.minimum(frame_width, x + w) - np.maximum(0, x), 0, None)
+    visible_h = np.clip(np.minimum(frame_height, y + h) - np.maximum(0, y), 0, None)
+    keep &= visible_w * visible_h >= det_filter.min_visible_ratio * w * h
+
+    # 4. 類別範圍（超出範圍的另外回傳供呼叫端警告）
+    valid_class = (class_ids >= 0) & (class_ids < num_classes)
+    invalid_ids = np.unique(class_ids[keep & ~valid_class])
+    keep &= valid_class
+
+    count = int(np.count_nonzero(keep))
+    detections = np.empty(count, dtype=DETECTION_DTYPE)
+    if count == 0:
+        return detections, invalid_ids
+
+    kx, ky, kw, kh = x[keep], y[keep], w[keep], h[keep]
+    offset_x, offset_y = offset
+    detections["classid"] = class_ids[keep]
+    detections["score"] = score_arr[keep]
+    # 與逐框版本相同：中心點先在偵測畫面取整再加上偏移，座標皆向零截斷
+    detections["center"][:, 0] = (kx + kw / 2).astype(np.int32) + offset_x
+    detections["center"][:, 1] = (ky + kh / 2).astype(np.int32) + offset_y
+    detections["bbox"][:, 0] = (kx + offset_x).astype(np.int32)
+    detections["bbox"][:, 1] = (ky + offset_y).astype(np.int32)
+    detections["bbox"][:, 2] = kw.astype(np.int32)
+    detections["bbox"][:, 3] = kh.astype(np.int32)
+    return detections, invalid_ids
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    計算一個 xywh 邊界框與多個邊界框的 IoU
+
+    Args:
+        box: (4,) xywh
+        boxes: (N,4) xywh
+
+    Returns:
+        (N,) IoU
+    """
+    inter_w = np.minimum(box[0] + box[2], boxes[:, 0] + boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+    inter_h = np.minimum(box[1] + box[3], boxes[:, 1] + boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    union = box[2] * box[3] + boxes[:, 2] * boxes[:, 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter, dtype=np.float64), where=union > 0)
+
+
+def nms(
+    class_ids: np.ndarray,
+    scores: np.ndarray,
+    boxes: np.ndarray,
+    iou_threshold: float,
+    method: str = "hard",
+    sigma: float = 0.5,
+    score_threshold: float = 0.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    依類別分開的 NMS（硬 NMS 或高斯軟 NMS）
+
+    每輪取出分數最高的框，與其餘同類別框的 IoU 以向量一次計算。
+    硬 NMS 直接移除 IoU 超過閾值的框；高斯軟 NMS 依 exp(-IoU²/sigma) 衰減分數，
+    衰減後低於 score_threshold 的框才移除。
+
+    Args:
+        class_ids: (N,) 類別
+        scores: (N,) 分數
+        boxes: (N,4) xywh 邊界框
+        iou_threshold: 硬 NMS 的 IoU 閾值
+        method: "hard" 或 "gaussian"
+        sigma: 高斯軟 NMS 的衰減參數
+        score_threshold: 軟 NMS 保留的最低分數
+
+    Returns:
+        (保留的索引（依分數由高到低）, 對應的分數（軟 NMS 為衰減後分數）)
+    """
+    class_ids, scores, boxes = to_arrays(class_ids, scores, boxes)
+    if len(scores) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+    boxes = boxes.astype(np.float64)
+    remaining = np.arange(len(scores))
+    current = scores.astype(np.float64)
+    keep = []
+    keep_scores = []
+    while len(remaining):
+        best_pos = int(np.argmax(current[remaining]))
+        best = remaining[best_pos]
+        keep.append(best)
+        keep_scores.append(current[best])
+        remaining = np.delete(remaining, best_pos)
+        if not len(remaining):
+            break
+
+        same_class = class_ids[remaining] == class_ids[best]
+        iou = np.where(same_class, box_iou(boxes[best], boxes[remaining]), 0.0)
+        if method == "gaussian":
+            current[remaining] *= np.exp(-(iou * iou) / sigma)
+            remaining = remaining[current[remaining] >= score_threshold]
+        else:
+            remaining = remaining[iou <= iou_threshold]
+
+    return np.asarray(keep, dtype=np.intp), np.asarray(keep_scores, dtype=np.float32)
@@ -0,0 +1,218 @@
+"""
+繼電器排程模塊
+
+每個攝影機一個排程執行緒，以單調時鐘的優先佇列在
+「畫面擷取時間 + 噴氣延遲」觸發繼電器。HTTP 請求交給小型執行緒池
+以保持連線的 Session 送出，不會阻塞計時；並記錄每次噴氣實際比預定時間
+晚了多少毫秒，以及請求往返時間。
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import RELAY_TIMEOUT_SECONDS
+from .logger import get_logger
+from . import tracing
+from .metrics import camera_metrics
+
+logger = get_logger("candy_detector.relay")
+
+# 預定時間前多少秒改為短暫輪詢（Condition.wait 在 Windows 上精度約 15ms）
+_SPIN_WINDOW_SECONDS = 0.003
+# 超過此延遲（毫秒）時輸出警告
+LATE_WARNING_MS = 20.0
+
+
+def build_relay_urls(url: str) -> tuple[str, str]:
+    """
+    由設定的繼電器 URL 產生開啟與關閉的 URL
+
+    Args:
+        url: 設定檔中的繼電器 URL（可含或不含 value=1）
+
+    Returns:
+        (開啟 URL, 關閉 URL)
+    """
+    on_url = url if 'value=1' in url else (url + '&value=1' if '?' in url else url + '?value=1')
+    off_url = on_url.replace('value=1', 'value=0')
+    return on_url, off_url
+
+
+class RelayScheduler:
+    """單一攝影機的繼電器排程器 - 一條執行緒處理所有噴氣，不再每次開新執行緒睡眠"""
+
+    def __init__(self, name: str, relay_url: str = "", lateness_window: int = 500, pool_size: int = 4):
+        """
+        初始化排程器並啟動執行緒
+
+        Args:
+            name: 攝影機名稱（日誌用）
+            relay_url: 預設繼電器 URL
+            lateness_window: 保留多少筆延遲紀錄供統計
+            pool_size: 送出請求的執行緒數與 HTTP 連線池大小
+        """
+        self.name = name
+        self.relay_url = relay_url
+
+        self._heap = []  # [(fire_at, seq, kind, url, pulse), ...]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # 保持連線，避免每次噴氣都重新建立 TCP 連線
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._sender = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f"relay-{name}-send")
+
+        self._lateness_ms = deque(maxlen=lateness_window)
+        self._rtt_ms = deque(maxlen=lateness_window)
+        self.pulses = 0
+        self.failures = 0
+        self.last_lateness_ms = 0.0
+        self.max_lateness_ms = 0.0
+        self._lateness_histogram = camera_metrics(name).relay_lateness
+
+        self._thread = threading.Thread(target=self._run, name=f"relay-{name}", daemon=True)
+        self._thread.start()
+
+    def schedule(self, capture_ts: float, delay_ms: int, duration_ms: int = 50, url: str | None = None) -> float | None:
+        """
+        排程一次噴氣
+
+        Args:
+            capture_ts: 觸發噴氣的畫面擷取時間 (time.monotonic)
+            delay_ms: 從擷取到噴氣的延遲（毫秒）
+            duration_ms: 噴氣持續時間（毫秒），0 表示不送出關閉指令
+            url: 繼電器 URL，未指定時使用預設值
+
+        Returns:
+            預定觸發的單調時間；未設定 URL 時回傳 None
+        """
+        url = url or self.relay_url
+        if not url:
+            return None
+
+        on_url, off_url = build_relay_urls(url)
+        fire_at = capture_ts + max(0, delay_ms) / 1000.0
+        pulse = {"on": None}  # 開啟請求的 Future，關閉請求需等它完成以確保順序
+        with self._cond:
+            heapq.heappush(self._heap, (fire_at, next(self._seq), "on", on_url, pulse))
+            if duration_ms > 0:
+                off_at = fire_at + duration_ms / 1000.0
+                heapq.heappush(self._heap, (off_at, next(self._seq), "off", off_url, pulse))
+            self._cond.notify()
+        return fire_at
+
+    def _next_due(self):
+        """等待並取出下一個到期的工作；停止時回傳 None"""
+        while True:
+            with self._cond:
+                while not self._stopped and not self._heap:
+                    self._cond.wait()
+                if self._stopped:
+                    return None
+                fire_at = self._heap[0][0]
+                remaining = fire_at - time.monotonic()
+                if remaining <= 0:
+                    return heapq.heappop(self._heap)
+                if remaining > _SPIN_WINDOW_SECONDS:
+                    self._cond.wait(remaining - _SPIN_WINDOW_SECONDS)
+                    continue
+
+            # 最後幾毫秒以短暫睡眠逼近預定時間，期間新加入的更早工作會在下一輪被取出
+            while time.monotonic() < fire_at:
+                time.sleep(0.0002)
+
+    def _run(self) -> None:
+        """排程執行緒主迴圈"""
+        while True:
+            job = self._next_due()
+            if job is None:
+                return
+
+            fire_at, _, kind, url, pulse = job
+            if kind == "on":
+                lateness_ms = (time.monotonic() - fire_at) * 1000.0
+                self._record_lateness(lateness_ms)
+                tracing.instant("relay_fire", self.name, {"lateness_ms": round(lateness_ms, 3)})
+                pulse["on"] = self._sender.submit(self._post, url, kind)
+            else:
+                self._sender.submit(self._post_off, url, pulse)
+
+    def _post(self, url: str, kind: str) -> bool:
+        """送出繼電器請求並記錄往返時間"""
+        start = time.monotonic()
+        try:
+            with tracing.span(f"relay_{kind}", self.name):
+                response = self._session.post(url, timeout=RELAY_TIMEOUT_SECONDS)
+        except requests.exceptions.RequestException as exc:
+            self.failures += 1
+            logger.error(f"{self.name} 無法操作繼電器 {url} - {exc}")
+            return False
+        self._rtt_ms.append((time.monotonic() - start) * 1000.0)
+        if response.status_code != 200:
+            self.failures += 1
+            logger.warning(f"{self.name} 繼電器{'開啟' if kind == 'on' else '關閉'}失敗: {response.text}")
+            return False
+        return True
+
+    def _post_off(self, url: str, pulse: dict) -> bool:
+        """等同一次噴氣的開啟請求完成後再關閉（開啟失敗時仍送出關閉，確保閥門不會卡在開啟）"""
+        if pulse["on"] is not None:
+            pulse["on"].result()
+        return self._post(url, "off")
+
+    def _record_lateness(self, lateness_ms: float) -> None:
+        """記錄一次噴氣的延遲誤差"""
+        self.pulses += 1
+        self.last_lateness_ms = lateness_ms
+        self.max_lateness_ms = max(self.max_lateness_ms, lateness_ms)
+        self._lateness_ms.append(lateness_ms)
+        self._lateness_histogram.observe(max(0.0, lateness_ms) / 1000.0)
+        if lateness_ms > LATE_WARNING_MS:
+            logger.warning(f"{self.name} 噴氣比預定時間晚 {lateness_ms:.1f}ms")
+
+    def get_stats(self) -> dict:
+        """取得噴氣統計（延遲單位為毫秒）"""
+        with self._cond:
+            pending = sum(1 for job in self._heap if job[2] == "on")
+        samples = np.array(self._lateness_ms) if self._lateness_ms else None
+        rtt = list(self._rtt_ms)
+        return {
+            "pulses": self.pulses,
+            "failures": self.failures,
+            "pending": pending,
+            "last_lateness_ms": round(self.last_lateness_ms, 2),
+            "mean_lateness_ms": round(float(samples.mean()), 2) if samples is not None else 0.0,
+            "p95_lateness_ms": round(float(np.percentile(samples, 95)), 2) if samples is not None else 0.0,
+            "max_lateness_ms": round(self.max_lateness_ms, 2),
+            "mean_rtt_ms": round(sum(rtt) / len(rtt), 2) if rtt else 0.0,
+        }
+
+    def stop(self) -> None:
+        """停止排程器（尚未觸發的噴氣會被捨棄，已開啟的閥門會立即關閉）"""
+        with self._cond:
+            self._stopped = True
+            dropped = sum(1 for job in self._heap if job[2] == "on")
+            pending_off = [job for job in self._heap if job[2] == "off" and job[4]["on"] is not None]
+            self._heap.clear()
+            self._cond.notify_all()
+        if dropped:
+            logger.info(f"{self.name} 停止繼電器排程，捨棄 {dropped} 個未觸發的噴氣")
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=RELAY_TIMEOUT_SECONDS + 1)
+        for _, _, _, url, pulse in pending_off:
+            self._sender.submit(self._post_off, url, pulse)
+        # 已送出的請求（含關閉指令）執行完再關閉連線
+        self._sender.shutdown(wait=True)
+        self._session.close()
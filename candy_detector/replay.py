@@ -0,0 +1,285 @@
+"""
+離線重播模塊
+
+ReplayCapture 以錄好的影片或圖片序列取代 cv2.VideoCapture，可直接放進 CameraContext.cap，
+讓 process_camera_frame 的追蹤、計數與噴氣邏輯在沒有攝影機的環境下執行。
+預設盡快讀取（每幀都處理，結果可重現）；realtime=True 時依影片幀率的時間戳記播放，
+處理來不及時跳過過期的畫面，行為與實際攝影機相同。
+
+RelayRecorder 是本機的繼電器替身 HTTP 伺服器，記錄每次開啟與關閉的時間。
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger("candy_detector.replay")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class ReplayCapture:
+    """影片或圖片序列的重播來源（提供 cv2.VideoCapture 的 read/get/set/isOpened/release）"""
+
+    def __init__(self, source, realtime: bool = False, speed: float = 1.0, fps: float | None = None, loop: bool = False):
+        """
+        開啟重播來源
+
+        Args:
+            source: 影片檔、圖片目錄，或圖片路徑的 glob 樣式（例如 frames/*.jpg）
+            realtime: True 時依時間戳記播放，False 時盡快讀取
+            speed: realtime 模式的播放倍速
+            fps: 圖片序列的幀率；影片預設使用檔案內的幀率
+            loop: 播完後從頭重播
+        """
+        self.source = str(source)
+        self.realtime = realtime
+        self.speed = max(0.01, float(speed))
+        self.loop = loop
+
+        self._video = None
+        self._images = []
+        path = Path(self.source)
+        if path.is_dir():
+            self._images = sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        elif any(ch in path.name for ch in "*?["):
+            self._images = sorted(p for p in path.parent.glob(path.name) if p.suffix.lower() in IMAGE_EXTENSIONS)
+        else:
+            self._video = cv2.VideoCapture(self.source)
+
+        if self._video is not None:
+            self.fps = fps or self._video.get(cv2.CAP_PROP_FPS) or 30.0
+            self.frame_count = int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.width = int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        else:
+            self.fps = fps or 30.0
+            self.frame_count = len(self._images)
+            first = cv2.imread(str(self._images[0])) if self._images else None
+            self.height, self.width = first.shape[:2] if first is not None else (0, 0)
+
+        self._index = 0  # 下一張畫面的序號
+        self._clock_start = None  # realtime 模式第一張畫面的單調時間
+        self.timestamp_ms = 0.0  # 最近讀出畫面的時間戳記
+        self.frames_read = 0
+        self.frames_skipped = 0
+
+    def isOpened(self) -> bool:
+        if self._video is not None:
+            return self._video.isOpened()
+        return bool(self._images)
+
+    def _frame_time_ms(self, index: int) -> float:
+        return index * 1000.0 / self.fps
+
+    def _due_offset(self, index: int) -> float:
+        """realtime 模式下第 index 張畫面相對於開始播放的秒數（以固定幀率計算）"""
+        return index / self.fps / self.speed
+
+    def _grab(self) -> bool:
+        """略過一張畫面（不解碼）"""
+        if self._video is not None:
+            ok = self._video.grab()
+        else:
+            ok = self._index < len(self._images)
+        if ok:
+            self._index += 1
+        return ok
+
+    def _rewind(self) -> bool:
+        if not self.loop or self._index == 0:
+            return False
+        if self._video is not None:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._index = 0
+        self._clock_start = None
+        return True
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        讀取下一張畫面
+
+        Args:
+            image: 寫入的目的緩衝區（尺寸相同時直接寫入，與 cv2.VideoCapture 相同）
+
+        Returns:
+            (ret, frame)
+        """
+        if self.realtime:
+            now = time.monotonic()
+            if self._clock_start is None:
+                self._clock_start = now - self._due_offset(self._index)
+            # 處理來不及時跳過已過期的畫面（實際攝影機也只保留最新畫面）
+            while now >= self._clock_start + self._due_offset(self._index + 1):
+                if not self._grab():
+                    break
+                self.frames_skipped += 1
+            due = self._clock_start + self._due_offset(self._index)
+            if due > now:
+                time.sleep(due - now)
+
+        frame = self._decode(image)
+        if frame is None and self._rewind():
+            frame = self._decode(image)
+        if frame is None:
+            return False, None
+
+        self.timestamp_ms = self._frame_time_ms(self._index)
+        if self._video is not None:
+            position = self._video.get(cv2.CAP_PROP_POS_MSEC)
+            if position > 0:
+                self.timestamp_ms = position
+        self._index += 1
+        self.frames_read += 1
+        return True, frame
+
+    def _decode(self, image: np.ndarray | None) -> np.ndarray | None:
+        if self._video is not None:
+            ret, frame = self._video.read(image) if image is not None else self._video.read()
+            return frame if ret else None
+        if self._index >= len(self._images):
+            return None
+        frame = cv2.imread(str(self._images[self._index]))
+        if frame is None:
+            logger.warning(f"無法讀取圖片: {self._images[self._index]}")
+            return None
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return image
+        return frame
+
+    def get(self, prop: int) -> float:
+        """支援寬、高、幀率、總幀數與目前位置；其他屬性回傳 0"""
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._index)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return float(self.timestamp_ms)
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        """攝影機設定（焦距、曝光等）在重播時忽略"""
+        return False
+
+    def release(self) -> None:
+        if self._video is not None:
+            self._video.release()
+
+    def get_stats(self) -> dict:
+        """取得重播統計"""
+        return {
+            "source": self.source,
+            "fps": round(self.fps, 3),
+            "frames_read": self.frames_read,
+            "frames_skipped": self.frames_skipped,
+            "position_ms": round(self.timestamp_ms, 1),
+        }
+
+
+class RelayRecorder:
+    """本機繼電器替身 - 接受與實際繼電器相同的 ?value=1 / ?value=0 請求並記錄時間"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        初始化（呼叫 start() 後開始接受請求）
+
+        Args:
+            host: 綁定位址
+            port: 連接埠，0 表示自動選擇
+        """
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = []  # [(time.monotonic(), path, value), ...]
+
+    @property
+    def url(self) -> str:
+        """繼電器 URL（填入 CameraContext.relay_url）"""
+        return f"http://{self.host}:{self.port}/relay"
+
+    def start(self) -> "RelayRecorder":
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                received = time.monotonic()
+                parsed = urlparse(self.path)
+                value = parse_qs(parsed.query).get("value", [""])[0]
+                with recorder._lock:
+                    recorder.requests.append((received, parsed.path, value))
+                body = b'{"success": true}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="relay-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def pulses(self) -> list[dict]:
+        """
+        將開啟與關閉請求配對為噴氣
+
+        Returns:
+            [{'on': 單調時間, 'off': 單調時間或 None, 'width_ms': 持續毫秒或 None}, ...]
+        """
+        with self._lock:
+            requests = sorted(self.requests)
+        pulses = []
+        open_pulses = {}
+        for received, path, value in requests:
+            if value == "1":
+                pulse = {"on": received, "off": None, "width_ms": None}
+                pulses.append(pulse)
+                open_pulses.setdefault(path, []).append(pulse)
+            elif value == "0" and open_pulses.get(path):
+                pulse = open_pulses[path].pop(0)
+                pulse["off"] = received
+                pulse["width_ms"] = (received - pulse["on"]) * 1000.0
+        return pulses
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def get_stats(self) -> dict:
+        """取得噴氣統計（毫秒）"""
+        pulses = self.pulses()
+        widths = np.array([p["width_ms"] for p in pulses if p["width_ms"] is not None])
+        gaps = np.diff([p["on"] for p in pulses]) * 1000.0 if len(pulses) > 1 else np.empty(0)
+        return {
+            "pulses": len(pulses),
+            "unclosed": sum(1 for p in pulses if p["off"] is None),
+            "mean_width_ms": round(float(widths.mean()), 2) if len(widths) else 0.0,
+            "max_width_ms": round(float(widths.max()), 2) if len(widths) else 0.0,
+            "min_gap_ms": round(float(gaps.min()), 2) if len(gaps) else 0.0,
+        }
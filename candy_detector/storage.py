@@ -0,0 +1,655 @@
+"""
+偵測記錄儲存模塊
+
+所有寫入都交給單一寫入執行緒：偵測執行緒只把記錄放進佇列就返回，
+寫入執行緒把佇列中累積的記錄合併為一個交易寫入。資料庫使用 WAL 模式，
+API 查詢使用唯讀連線池，讀取與寫入互不阻塞，報表查詢不會拖慢偵測執行緒。
+
+每筆快照寫入時同一交易內也累加到每分鐘、每小時、每日的彙總表（以台北時間分段），
+長時間範圍的查詢改查彙總表，並以時間游標（keyset）分頁取代 OFFSET。
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+from .logger import get_logger
+
+logger = get_logger("candy_detector.storage")
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        camera_name TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        total_count INTEGER DEFAULT 0,
+        normal_count INTEGER DEFAULT 0,
+        abnormal_count INTEGER DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS defect_images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        camera_name TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        image_path TEXT,
+        confidence REAL
+    )
+    """,
+    # 查詢加速索引
+    "CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_cam ON detections(camera_name)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_cam_ts ON detections(camera_name, timestamp)",
+)
+
+# 彙總表：解析度 -> (資料表, 區間起點格式)；區間以台北時間 (UTC+8) 分段
+TAIPEI_OFFSET = '+8 hours'
+ROLLUPS = {
+    "minute": ("detections_minute", "%Y-%m-%d %H:%M:00"),
+    "hour": ("detections_hour", "%Y-%m-%d %H:00:00"),
+    "day": ("detections_day", "%Y-%m-%d 00:00:00"),
+}
+RESOLUTIONS = ("raw",) + tuple(ROLLUPS)
+
+# 快照的 total/normal/abnormal 為攝影機啟動後的累計值，彙總表保存區間內最後一筆快照
+# 以及區間內的增量（累計值變小代表重新啟動，該筆快照本身即為增量）
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        camera_name TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 0,
+        total_count INTEGER DEFAULT 0,
+        normal_count INTEGER DEFAULT 0,
+        abnormal_count INTEGER DEFAULT 0,
+        delta_total INTEGER DEFAULT 0,
+        delta_normal INTEGER DEFAULT 0,
+        delta_abnormal INTEGER DEFAULT 0,
+        PRIMARY KEY (camera_name, bucket)
+    ) WITHOUT ROWID
+"""
+
+_UPSERT_ROLLUP = """
+    INSERT INTO {table} (
+        camera_name, bucket, samples, total_count, normal_count, abnormal_count,
+        delta_total, delta_normal, delta_abnormal
+    )
+    VALUES (?, strftime('{fmt}', ?, '{offset}'), 1, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (camera_name, bucket) DO UPDATE SET
+        samples = samples + 1,
+        total_count = excluded.total_count,
+        normal_count = excluded.normal_count,
+        abnormal_count = excluded.abnormal_count,
+        delta_total = delta_total + excluded.delta_total,
+        delta_normal = delta_normal + excluded.delta_normal,
+        delta_abnormal = delta_abnormal + excluded.delta_abnormal
+"""
+
+# 由原始快照重建彙總表：LAG 取得同攝影機上一筆快照計算增量，
+# 每個區間的最後一筆快照以 SQLite 的 MAX() 裸欄位規則取得
+_BACKFILL_ROLLUP = """
+    INSERT OR REPLACE INTO {table} (
+        camera_name, bucket, samples, total_count, normal_count, abnormal_count,
+        delta_total, delta_normal, delta_abnormal
+    )
+    SELECT camera_name, bucket, samples, total_count, normal_count, abnormal_count,
+           delta_total, delta_normal, delta_abnormal
+    FROM (
+    SELECT camera_name, bucket, MAX(id), COUNT(*) AS samples, total_count, normal_count, abnormal_count,
+           SUM(d_total) AS delta_total, SUM(d_normal) AS delta_normal, SUM(d_abnormal) AS delta_abnormal
+    FROM (
+        SELECT id, camera_name, total_count, normal_count, abnormal_count,
+               strftime('{fmt}', timestamp, '{offset}') AS bucket,
+               CASE WHEN prev_total IS NULL OR total_count < prev_total
+                    THEN total_count ELSE total_count - prev_total END AS d_total,
+               CASE WHEN prev_total IS NULL OR total_count < prev_total
+                    THEN normal_count ELSE normal_count - prev_normal END AS d_normal,
+               CASE WHEN prev_total IS NULL OR total_count < prev_total
+                    THEN abnormal_count ELSE abnormal_count - prev_abnormal END AS d_abnormal
+        FROM (
+            SELECT id, camera_name, timestamp, total_count, normal_count, abnormal_count,
+                   LAG(total_count) OVER w AS prev_total,
+                   LAG(normal_count) OVER w AS prev_normal,
+                   LAG(abnormal_count) OVER w AS prev_abnormal
+            FROM detections
+            WINDOW w AS (PARTITION BY camera_name ORDER BY id)
+        )
+    )
+    GROUP BY camera_name, bucket
+    )
+"""
+
+# 寫入連線：WAL 讓讀取不被寫入阻塞；NORMAL 在 WAL 下只在檢查點同步，斷電最多遺失最後幾個交易
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# 讀取連線：禁止寫入，快取較小
+READER_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    "PRAGMA cache_size=-8000",
+)
+
+_INSERT_DETECTION = (
+    "INSERT INTO detections (camera_name, timestamp, total_count, normal_count, abnormal_count) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+def utc_timestamp(ts: float | None = None) -> str:
+    """與 SQLite CURRENT_TIMESTAMP 相同格式的 UTC 時間字串"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+def pick_resolution(hours: int) -> str:
+    """
+    依時間範圍選擇解析度（resolution=auto 時使用）
+
+    Args:
+        hours: 查詢的小時數，0 表示全部
+
+    Returns:
+        RESOLUTIONS 其中之一
+    """
+    if 0 < hours <= 6:
+        return "raw"
+    if 0 < hours <= 48:
+        return "minute"
+    if 0 < hours <= 24 * 60:
+        return "hour"
+    return "day"
+
+
+def history_query(
+    resolution: str,
+    hours: int = 0,
+    camera: str = "",
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> tuple[str, list]:
+    """
+    產生歷史記錄查詢（依時間由新到舊，以游標分頁）
+
+    每列欄位固定為 (camera, 台北時間, total, normal, abnormal, samples,
+    delta_total, delta_normal, delta_abnormal, 游標)；原始記錄的 samples 為 1、增量為 NULL。
+    時間轉換在 SQL 內完成，不需在 Python 逐列轉換。
+
+    Args:
+        resolution: raw / minute / hour / day
+        hours: 最近幾小時，0 表示全部
+        camera: 攝影機名稱，空字串表示全部
+        cursor: 上一頁最後一列的游標，None 表示第一頁
+        limit: 最多筆數，None 表示不限制
+
+    Returns:
+        (SQL, 參數)
+    """
+    if resolution == "raw":
+        select = (
+            f"SELECT camera_name, datetime(timestamp, '{TAIPEI_OFFSET}'), total_count, normal_count, abnormal_count, "
+            "1, NULL, NULL, NULL, timestamp || '|' || id FROM detections"
+        )
+        time_column, key_column = "timestamp", "id"
+        since = "datetime('now', ?)"
+    elif resolution in ROLLUPS:
+        table, fmt = ROLLUPS[resolution]
+        select = (
+            "SELECT camera_name, bucket, total_count, normal_count, abnormal_count, "
+            f"samples, delta_total, delta_normal, delta_abnormal, bucket || '|' || camera_name FROM {table}"
+        )
+        time_column, key_column = "bucket", "camera_name"
+        # 包含起點所在的區間
+        since = f"strftime('{fmt}', 'now', '{TAIPEI_OFFSET}', ?)"
+    else:
+        raise ValueError(f"未知的解析度: {resolution}")
+
+    conditions, params = [], []
+    if hours > 0:
+        conditions.append(f"{time_column} >= {since}")
+        params.append(f"-{int(hours)} hours")
+    if camera:
+        conditions.append("camera_name = ?")
+        params.append(camera)
+    if cursor:
+        # 游標格式為「時間|鍵」，時間內不含 |，鍵（攝影機名稱）可能含 |
+        cursor_time, _, cursor_key = cursor.partition("|")
+        conditions.append(f"({time_column}, {key_column}) < (?, ?)")
+        params.extend([cursor_time, int(cursor_key) if key_column == "id" else cursor_key])
+
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {time_column} DESC, {key_column} DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, params
+
+
+def history_record(row, resolution: str) -> dict:
+    """將 history_query 的一列轉為 API 回傳格式"""
+    camera, timestamp, total, normal, abnormal, samples, delta_total, delta_normal, delta_abnormal, _ = row
+    record = {
+        'camera': camera,
+        'timestamp': timestamp,
+        'total': total,
+        'normal': normal,
+        'abnormal': abnormal,
+        'defect_rate': round(abnormal / total * 100, 2) if total else 0,
+    }
+    if resolution != "raw":
+        # 彙總列：total/normal/abnormal 為區間內最後一筆快照，delta_* 為區間內的產量
+        record.update({
+            'samples': samples,
+            'delta_total': delta_total,
+            'delta_normal': delta_normal,
+            'delta_abnormal': delta_abnormal,
+            'delta_defect_rate': round(delta_abnormal / delta_total * 100, 2) if delta_total else 0,
+        })
+    return record
+
+
+class _Call:
+    """送到寫入執行緒執行的函數"""
+
+    __slots__ = ("fn", "future", "transaction")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], object], transaction: bool):
+        self.fn = fn
+        self.future = Future()
+        self.transaction = transaction
+
+
+class DetectionStore:
+    """SQLite 偵測記錄儲存 - 單一寫入執行緒批次寫入，唯讀連線池供查詢"""
+
+    def __init__(
+        self,
+        db_path,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        read_pool_size: int = 4,
+        max_queue: int = 10000,
+        busy_timeout_ms: int = 5000,
+    ):
+        """
+        初始化儲存（呼叫 start() 後才開始寫入）
+
+        Args:
+            db_path: 資料庫檔案路徑
+            batch_size: 單一交易最多寫入的記錄數
+            flush_interval: 佇列空閒時最長等待秒數（也是停止時的反應時間）
+            read_pool_size: 唯讀連線數上限
+            max_queue: 佇列上限，滿了之後新記錄直接丟棄（不阻塞偵測執行緒）
+            busy_timeout_ms: 連線等待鎖的最長毫秒數
+        """
+        self.db_path = Path(db_path)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.read_pool_size = max(1, int(read_pool_size))
+        self.busy_timeout_ms = int(busy_timeout_ms)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._readers = queue.LifoQueue()
+        self._reader_lock = threading.Lock()
+        self._reader_count = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self._last_counts = {}  # 攝影機 -> 上一筆快照 (total, normal, abnormal)，寫入執行緒專用
+
+    # ---- 連線 ----
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(
+                f"{self.db_path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=self.busy_timeout_ms / 1000.0,
+                check_same_thread=False,
+            )
+            pragmas = READER_PRAGMAS
+        else:
+            # isolation_level=None：交易由寫入執行緒自行 BEGIN/COMMIT
+            conn = sqlite3.connect(
+                self.db_path, timeout=self.busy_timeout_ms / 1000.0, isolation_level=None, check_same_thread=False
+            )
+            pragmas = WRITER_PRAGMAS
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def start(self) -> "DetectionStore":
+        """建立資料表並啟動寫入執行緒（重複呼叫不會重新啟動）"""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stopped.clear()
+        writer = self._connect()
+        for statement in SCHEMA:
+            writer.execute(statement)
+        for table, _ in ROLLUPS.values():
+            writer.execute(ROLLUP_SCHEMA.format(table=table))
+            writer.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+        self._thread = threading.Thread(target=self._run, args=(writer,), name="db-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"資料庫寫入執行緒已啟動 (WAL, 每批最多 {self.batch_size} 筆)")
+        return self
+
+    @contextmanager
+    def reader(self, timeout: float | None = None) -> Iterator[sqlite3.Connection]:
+        """
+        借用一條唯讀連線
+
+        Args:
+            timeout: 連線全部借出時最長等待秒數，預設為 busy_timeout_ms
+
+        Yields:
+            sqlite3.Connection（用完自動歸還連線池）
+
+        Raises:
+            TimeoutError: 等待逾時
+        """
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self.read_pool_size
+                if create:
+                    self._reader_count += 1
+            if create:
+                try:
+                    conn = self._connect(readonly=True)
+                except Exception:
+                    with self._reader_lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                wait = self.busy_timeout_ms / 1000.0 if timeout is None else timeout
+                try:
+                    conn = self._readers.get(timeout=wait)
+                except queue.Empty:
+                    raise TimeoutError(f"等待唯讀連線逾時（{wait:g} 秒，{self.read_pool_size} 條連線皆使用中）") from None
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def query_history(
+        self,
+        resolution: str,
+        hours: int = 0,
+        camera: str = "",
+        cursor: str | None = None,
+        limit: int = 500,
+        with_total: bool = False,
+    ) -> dict:
+        """
+        以游標分頁查詢歷史記錄
+
+        Args:
+            resolution: raw / minute / hour / day
+            hours: 最近幾小時，0 表示全部
+            camera: 攝影機名稱，空字串表示全部
+            cursor: 上一頁回傳的 next_cursor
+            limit: 每頁筆數
+            with_total: 是否計算符合條件的總筆數（只在第一頁需要）
+
+        Returns:
+            {'data': [...], 'next_cursor': str | None, 'total': int | None}
+        """
+        sql, params = history_query(resolution, hours, camera, cursor, limit + 1)
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            total = None
+            if with_total:
+                count_sql, count_params = history_query(resolution, hours, camera)
+                total = conn.execute(f"SELECT COUNT(*) FROM ({count_sql})", count_params).fetchone()[0]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'data': [history_record(row, resolution) for row in rows],
+            'next_cursor': rows[-1][-1] if has_more else None,
+            'total': total,
+        }
+
+    def iter_query(self, sql: str, params=(), chunk_size: int = 2000) -> Iterator[list]:
+        """
+        以 fetchmany 分批讀取查詢結果（匯出等大量資料使用，記憶體用量與總筆數無關）
+
+        迭代期間（可能與客戶端下載一樣久）使用獨立的唯讀連線，不佔用查詢連線池；
+        WAL 模式下讀取快照不會阻塞寫入執行緒。結束或提早結束迭代（例如下載中斷）時關閉連線。
+
+        Args:
+            sql: 查詢語句
+            params: 查詢參數
+            chunk_size: 每批筆數
+
+        Yields:
+            每批的列串列
+        """
+        conn = self._connect(readonly=True)
+        try:
+            cursor = conn.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    # ---- 寫入 ----
+
+    def save_detection(self, camera_name: str, total: int, normal: int, abnormal: int, ts: float | None = None) -> bool:
+        """
+        排入一筆偵測記錄（立即返回）
+
+        Args:
+            camera_name: 攝影機名稱
+            total: 總數
+            normal: 正常數
+            abnormal: 異常數
+            ts: 記錄時間 (time.time())，預設為現在；寫入時間較晚也保留排入時的時間
+
+        Returns:
+            是否成功排入（佇列已滿時丟棄並回傳 False）
+        """
+        row = (camera_name, utc_timestamp(ts), int(total), int(normal), int(abnormal))
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(f"資料庫寫入佇列已滿，已丟棄 {self.dropped} 筆記錄")
+            return False
+
+    def submit(self, fn: Callable[[sqlite3.Connection], object], transaction: bool = True) -> Future:
+        """
+        在寫入執行緒上執行函數（刪除、維護等需要寫入的操作）
+
+        排在前面的記錄會先寫入，函數看得到它們。
+
+        Args:
+            fn: 接收寫入連線的函數，回傳值即為 Future 的結果
+            transaction: 是否包在交易中（VACUUM 等不能在交易中執行的指令傳 False）
+
+        Returns:
+            concurrent.futures.Future
+        """
+        call = _Call(fn, transaction)
+        if self._thread is None or not self._thread.is_alive():
+            call.future.set_exception(RuntimeError("資料庫寫入執行緒未啟動"))
+            return call.future
+        # 維護操作不可丟棄，佇列滿時等待
+        self._queue.put(call)
+        return call.future
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待目前佇列中的記錄全部寫入"""
+        try:
+            self.submit(lambda conn: None, transaction=False).result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def _run(self, writer: sqlite3.Connection) -> None:
+        """寫入迴圈：取出佇列中累積的項目，連續的記錄合併為一個交易"""
+        pending = None
+        try:
+            self._prepare_rollups(writer)
+            while True:
+                item = pending
+                pending = None
+                if item is None:
+                    try:
+                        item = self._queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        if self._stopped.is_set():
+                            break
+                        continue
+
+                if isinstance(item, _Call):
+                    self._execute(writer, item)
+                    continue
+
+                rows = [item]
+                while len(rows) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, _Call):
+                        # 維護操作留到這批寫完後執行，保持先後順序
+                        pending = item
+                        break
+                    rows.append(item)
+                self._write_rows(writer, rows)
+        finally:
+            writer.close()
+
+    def _prepare_rollups(self, writer: sqlite3.Connection) -> None:
+        """補建空的彙總表（升級前的資料庫），並載入各攝影機最後一筆快照供計算增量"""
+        has_rows = writer.execute("SELECT 1 FROM detections LIMIT 1").fetchone() is not None
+        for table, fmt in ROLLUPS.values():
+            if not has_rows or writer.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                writer.execute("BEGIN")
+                writer.execute(_BACKFILL_ROLLUP.format(table=table, fmt=fmt, offset=TAIPEI_OFFSET))
+                writer.execute("COMMIT")
+            except sqlite3.Error as e:
+                if writer.in_transaction:
+                    writer.execute("ROLLBACK")
+                logger.error(f"補建彙總表 {table} 失敗: {e}")
+                continue
+            logger.info(f"已由原始記錄補建彙總表 {table} ({time.perf_counter() - start:.2f}s)")
+
+        # 各攝影機 id 最大的一筆即為最後快照（MAX() 裸欄位規則）
+        rows = writer.execute(
+            "SELECT camera_name, MAX(id), total_count, normal_count, abnormal_count FROM detections GROUP BY camera_name"
+        ).fetchall()
+        self._last_counts = {camera: (total, normal, abnormal) for camera, _, total, normal, abnormal in rows}
+
+    def _rollup_rows(self, rows: list, last_counts: dict) -> list:
+        """計算每筆快照相對同攝影機上一筆的增量（會更新 last_counts）"""
+        result = []
+        for camera, ts, total, normal, abnormal in rows:
+            prev = last_counts.get(camera)
+            if prev is None or total < prev[0]:
+                # 第一筆或攝影機重新啟動（累計值歸零）
+                delta = (total, normal, abnormal)
+            else:
+                delta = (total - prev[0], normal - prev[1], abnormal - prev[2])
+            last_counts[camera] = (total, normal, abnormal)
+            result.append((camera, ts, total, normal, abnormal) + delta)
+        return result
+
+    def _write_rows(self, writer: sqlite3.Connection, rows: list) -> None:
+        start = time.perf_counter()
+        last_counts = dict(self._last_counts)
+        rollup_rows = self._rollup_rows(rows, last_counts)
+        try:
+            writer.execute("BEGIN")
+            writer.executemany(_INSERT_DETECTION, rows)
+            # 同一交易內累加彙總表，查詢端永遠看到一致的原始記錄與彙總
+            for table, fmt in ROLLUPS.values():
+                writer.executemany(_UPSERT_ROLLUP.format(table=table, fmt=fmt, offset=TAIPEI_OFFSET), rollup_rows)
+            writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            if writer.in_transaction:
+                writer.execute("ROLLBACK")
+            self.failures += 1
+            logger.error(f"批次寫入 {len(rows)} 筆偵測記錄失敗: {e}")
+            return
+        self._last_counts = last_counts
+        self.written += len(rows)
+        self.batches += 1
+        self.last_batch_size = len(rows)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+
+    def _execute(self, writer: sqlite3.Connection, call: _Call) -> None:
+        if not call.future.set_running_or_notify_cancel():
+            return
+        try:
+            if call.transaction:
+                writer.execute("BEGIN")
+            result = call.fn(writer)
+            if call.transaction:
+                writer.execute("COMMIT")
+        except BaseException as e:
+            if writer.in_transaction:
+                writer.execute("ROLLBACK")
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """寫完佇列中的記錄後停止寫入執行緒並關閉所有連線"""
+        if self._thread is not None:
+            self.flush(timeout)
+            self._stopped.set()
+            self._thread.join(timeout)
+            self._thread = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._reader_lock:
+            self._reader_count = 0
+
+    def get_stats(self) -> dict:
+        """取得寫入統計"""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "readers": self._reader_count,
+        }
@@ -0,0 +1,254 @@
+"""
+影像串流共享模塊
+
+偵測執行緒將最新的處理結果發布到共享畫面槽，
+任意數量的串流客戶端只讀取畫面槽，不直接操作攝影機或模型。
+廣播器對每個世代只編碼一次 JPEG，所有訂閱者共用同一份位元組。
+畫面可以是 FrameHandle：共享槽與讀取者各自持有引用，不需複製畫面。
+"""
+
+import threading
+import time
+from typing import Callable, Iterator
+
+import cv2
+import numpy as np
+
+from . import tracing
+from .framepool import acquire_frame, frame_array, release_frame
+
+
+class FrameSlot:
+    """
+    最新畫面共享槽 - 單一寫入者、多個讀取者
+
+    發布 FrameHandle 時共享槽自行取得引用，換下一張時釋放；
+    latest/latest_raw/wait_newer 回傳的 FrameHandle 也已取得引用，讀取者用完需 release_frame()。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._frame = None
+        self._raw_frame = None
+        self._stats = {}
+        self._timestamp = 0.0
+
+    @property
+    def generation(self) -> int:
+        """目前畫面的世代編號（每次發布加一）"""
+        return self._generation
+
+    def publish(self, frame, raw_frame=None, stats: dict | None = None) -> int:
+        """
+        發布新畫面並喚醒所有等待中的讀取者
+
+        Args:
+            frame: 處理後（含標註）的畫面（陣列或 FrameHandle）
+            raw_frame: 原始畫面（可選）
+            stats: 與此畫面對應的統計數據
+
+        Returns:
+            新的世代編號
+        """
+        frame = acquire_frame(frame)
+        raw_frame = acquire_frame(raw_frame)
+        with self._cond:
+            old_frame, old_raw = self._frame, self._raw_frame
+            self._generation += 1
+            self._frame = frame
+            self._raw_frame = raw_frame
+            self._stats = stats or {}
+            self._timestamp = time.time()
+            self._cond.notify_all()
+            generation = self._generation
+        release_frame(old_frame)
+        release_frame(old_raw)
+        return generation
+
+    def latest(self) -> tuple[int, object, dict]:
+        """取得最新的 (世代, 畫面, 統計)，不等待"""
+        with self._cond:
+            return self._generation, acquire_frame(self._frame), self._stats
+
+    def latest_stats(self) -> dict:
+        """取得最新畫面的統計（不取得畫面引用，讀取者不需釋放）"""
+        with self._cond:
+            return self._stats
+
+    def latest_raw(self) -> tuple[int, object]:
+        """取得最新的 (世代, 原始畫面)，不等待"""
+        with self._cond:
+            return self._generation, acquire_frame(self._raw_frame)
+
+    def wait_newer(self, generation: int, timeout: float = 1.0, raw: bool = False) -> tuple[int, object, dict]:
+        """
+        等待比指定世代更新的畫面
+
+        Args:
+            generation: 讀取者目前持有的世代編號
+            timeout: 最長等待秒數
+            raw: True 時回傳原始畫面而非處理後畫面
+
+        Returns:
+            (世代, 畫面, 統計)；逾時則回傳目前內容，呼叫端可比對世代判斷是否為新畫面
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._generation != generation, timeout)
+            frame = self._raw_frame if raw else self._frame
+            return self._generation, acquire_frame(frame), self._stats
+
+    def clear(self) -> None:
+        """清除畫面內容（攝影機移除或停止時使用）"""
+        with self._cond:
+            old_frame, old_raw = self._frame, self._raw_frame
+            self._generation += 1
+            self._frame = None
+            self._raw_frame = None
+            self._stats = {}
+            self._cond.notify_all()
+        release_frame(old_frame)
+        release_frame(old_raw)
+
+
+class FrameBroadcaster:
+    """
+    MJPEG 廣播器 - 每個世代只編碼一次，所有訂閱者共用同一份 JPEG
+
+    訂閱者每次送完一張才向廣播器要下一張，且永遠只拿最新世代，
+    因此慢速客戶端會自動跳過畫面，而不會在伺服器端排隊累積。
+    """
+
+    def __init__(
+        self,
+        slot: FrameSlot,
+        raw: bool = False,
+        jpeg_quality: int = 85,
+        max_width: int = 0,
+        annotate: Callable | None = None,
+        encode_histogram=None,
+        name: str = "",
+    ):
+        """
+        初始化廣播器
+
+        Args:
+            slot: 畫面來源的共享槽
+            raw: True 時廣播原始畫面，否則廣播處理後畫面
+            jpeg_quality: JPEG 品質 (1-100)
+            max_width: 編碼前縮放的最大寬度，0 表示不縮放
+            annotate: 編碼前在畫面上繪製覆蓋資訊的函數（接收可修改的畫面）
+            encode_histogram: 記錄每次縮放與編碼耗時的直方圖（metrics.Histogram）
+            name: 名稱（追蹤紀錄的分類）
+        """
+        self.slot = slot
+        self.raw = raw
+        self.jpeg_quality = int(jpeg_quality)
+        self.max_width = int(max_width)
+        self.annotate = annotate
+        self.encode_histogram = encode_histogram
+        self.name = name
+
+        self._encode_lock = threading.Lock()
+        self._scratch = None  # 縮放或繪製覆蓋資訊用的重複使用緩衝區
+        self._cached_generation = None
+        self._cached_chunk = None
+        self._subscribers = 0
+        self.encoded_frames = 0
+        self.sent_frames = 0
+        self.skipped_frames = 0
+
+    @property
+    def subscribers(self) -> int:
+        """目前的訂閱者數量"""
+        return self._subscribers
+
+    def _scratch_buffer(self, shape: tuple, dtype) -> np.ndarray:
+        """取得指定尺寸的暫存緩衝區（需持有 _encode_lock）"""
+        if self._scratch is None or self._scratch.shape != shape or self._scratch.dtype != dtype:
+            self._scratch = np.empty(shape, dtype=dtype)
+        return self._scratch
+
+    def _encode(self, frame) -> bytes | None:
+        """縮放、繪製覆蓋資訊並編碼為 multipart 區塊（需持有 _encode_lock）"""
+        frame = frame_array(frame)
+        height, width = frame.shape[:2]
+        if self.max_width > 0 and width > self.max_width:
+            scale = self.max_width / width
+            size = (self.max_width, max(1, int(height * scale)))
+            scratch = self._scratch_buffer((size[1], size[0]) + frame.shape[2:], frame.dtype)
+            frame = cv2.resize(frame, size, dst=scratch, interpolation=cv2.INTER_AREA)
+        elif self.annotate is not None:
+            # 畫面為共用的唯讀畫面，繪製前複製到重複使用的暫存緩衝區
+            scratch = self._scratch_buffer(frame.shape, frame.dtype)
+            np.copyto(scratch, frame)
+            frame = scratch
+
+        if self.annotate is not None:
+            self.annotate(frame)
+
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ret:
+            return None
+        return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n'
+
+    def get_chunk(self, generation: int, frame) -> bytes | None:
+        """取得指定世代的 multipart 區塊（同一世代只編碼一次；已快取更新的世代時直接回傳較新的區塊）"""
+        with self._encode_lock:
+            if self._cached_generation is None or generation > self._cached_generation:
+                start = time.perf_counter()
+                self._cached_chunk = self._encode(frame)
+                end = time.perf_counter()
+                if self.encode_histogram is not None:
+                    self.encode_histogram.observe(end - start)
+                tracing.complete("jpeg_encode", start, end, self.name, {"generation": generation})
+                self._cached_generation = generation
+                self.encoded_frames += 1
+            return self._cached_chunk
+
+    def subscribe(self, should_continue: Callable[[], bool] = lambda: True, timeout: float = 1.0) -> Iterator[bytes]:
+        """
+        產生 multipart 串流區塊
+
+        Args:
+            should_continue: 每輪呼叫一次，回傳 False 時結束串流
+            timeout: 等待新畫面的最長秒數
+
+        Yields:
+            已編碼的 multipart 區塊
+        """
+        with self._encode_lock:
+            self._subscribers += 1
+        generation = 0
+        try:
+            while should_continue():
+                new_generation, frame, _ = self.slot.wait_newer(generation, timeout, raw=self.raw)
+                if new_generation == generation or frame is None:
+                    release_frame(frame)
+                    generation = new_generation
+                    continue
+                if generation and new_generation > generation + 1:
+                    self.skipped_frames += new_generation - generation - 1
+                generation = new_generation
+
+                try:
+                    chunk = self.get_chunk(generation, frame)
+                finally:
+                    release_frame(frame)
+                if chunk is not None:
+                    self.sent_frames += 1
+                    # yield 返回前的時間即為送出給客戶端的時間（慢速客戶端會拉長）
+                    with tracing.span("stream_send", self.name):
+                        yield chunk
+        finally:
+            with self._encode_lock:
+                self._subscribers -= 1
+
+    def get_stats(self) -> dict:
+        """取得廣播統計"""
+        return {
+            'subscribers': self._subscribers,
+            'encoded_frames': self.encoded_frames,
+            'sent_frames': self.sent_frames,
+            'skipped_frames': self.skipped_frames,
+        }
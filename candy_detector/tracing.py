@@ -0,0 +1,248 @@
+"""
+畫面層級追蹤模塊
+
+選用的追蹤模式：記錄每個處理階段的開始與結束時間（span），
+可匯出為 Chrome / Perfetto 可開啟的 trace JSON，用來找出產線卡頓的來源。
+
+每條執行緒寫入自己的環形緩衝區，記錄時不需取得任何鎖；緩衝區寫滿後覆蓋最舊的紀錄。
+停用時 complete() / span() 只檢查一個模組旗標就返回，可以常駐在正式環境。
+"""
+
+import json
+import os
+import threading
+import time
+import weakref
+
+DEFAULT_BUFFER_SIZE = 20000  # 每條執行緒保留的事件數
+
+_enabled = False
+_buffer_size = DEFAULT_BUFFER_SIZE
+_generation = 0  # 清除或改變容量時遞增，執行緒下次記錄時換新的緩衝區
+_buffers = []  # 所有執行緒的緩衝區（匯出時讀取）
+_buffers_lock = threading.Lock()  # 只在建立緩衝區與匯出時使用
+_local = threading.local()
+
+
+class _ThreadBuffer:
+    """單一執行緒的事件環形緩衝區（只有所屬執行緒寫入）"""
+
+    __slots__ = ("thread", "tid", "thread_name", "generation", "events", "index")
+
+    def __init__(self, capacity: int, generation: int):
+        thread = threading.current_thread()
+        self.thread = weakref.ref(thread)
+        self.tid = thread.native_id or threading.get_ident()
+        self.thread_name = thread.name
+        self.generation = generation
+        self.events = [None] * capacity
+        self.index = 0
+
+    def add(self, event: tuple) -> None:
+        self.events[self.index % len(self.events)] = event
+        # 先寫入事件再推進索引，匯出時最多漏掉正在寫入的這一筆
+        self.index += 1
+
+    def snapshot(self) -> list:
+        """由舊到新複製目前的事件"""
+        index = self.index
+        events = list(self.events)
+        capacity = len(events)
+        if index <= capacity:
+            return events[:index]
+        start = index % capacity
+        return [event for event in events[start:] + events[:start] if event is not None]
+
+
+def _buffer() -> _ThreadBuffer:
+    """取得目前執行緒的緩衝區（第一次記錄或清除後建立）"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or buffer.generation != _generation:
+        buffer = _ThreadBuffer(_buffer_size, _generation)
+        _local.buffer = buffer
+        with _buffers_lock:
+            # 同時移除已結束執行緒與過期世代的緩衝區
+            _buffers[:] = [
+                b for b in _buffers
+                if b.generation == _generation and b.thread() is not None and b.thread().is_alive()
+            ]
+            _buffers.append(buffer)
+    return buffer
+
+
+def is_enabled() -> bool:
+    """是否正在記錄"""
+    return _enabled
+
+
+def enable(buffer_size: int | None = None) -> None:
+    """
+    開始記錄
+
+    Args:
+        buffer_size: 每條執行緒保留的事件數（改變時清除既有紀錄）
+    """
+    global _enabled, _buffer_size
+    if buffer_size is not None and int(buffer_size) != _buffer_size:
+        _buffer_size = max(100, int(buffer_size))
+        clear()
+    _enabled = True
+
+
+def disable() -> None:
+    """停止記錄（已記錄的事件保留到 clear() 或下次改變容量）"""
+    global _enabled
+    _enabled = False
+
+
+def clear() -> None:
+    """清除所有紀錄"""
+    global _generation
+    with _buffers_lock:
+        _generation += 1
+        _buffers.clear()
+
+
+def configure(config) -> None:
+    """
+    依 [Tracing] 區塊啟用或停用追蹤
+
+    Args:
+        config: ConfigParser 或 ConfigManager
+    """
+    if config.getint("Tracing", "enabled", fallback=0):
+        enable(config.getint("Tracing", "buffer_size", fallback=DEFAULT_BUFFER_SIZE))
+    else:
+        disable()
+
+
+def complete(name: str, start: float, end: float, cat: str = "", args: dict | None = None) -> None:
+    """
+    記錄一個已完成的 span（停用時立即返回）
+
+    Args:
+        name: 階段名稱
+        start: 開始時間 (time.perf_counter())
+        end: 結束時間 (time.perf_counter())
+        cat: 分類（通常為攝影機名稱）
+        args: 附加資訊
+    """
+    if not _enabled:
+        return
+    _buffer().add((name, cat, start, end, args))
+
+
+def instant(name: str, cat: str = "", args: dict | None = None) -> None:
+    """記錄一個瞬間事件（例如噴氣觸發）"""
+    if not _enabled:
+        return
+    now = time.perf_counter()
+    _buffer().add((name, cat, now, None, args))
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name: str, cat: str, args: dict | None):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        complete(self.name, self.start, time.perf_counter(), self.cat, self.args)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, cat: str = "", args: dict | None = None):
+    """
+    以 with 區塊記錄 span（停用時回傳共用的空物件，不記錄時間）
+
+    Args:
+        name: 階段名稱
+        cat: 分類
+        args: 附加資訊
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, cat, args)
+
+
+def export(seconds: float = 10.0) -> dict:
+    """
+    匯出最近幾秒的事件為 Chrome trace 格式
+
+    Args:
+        seconds: 匯出的時間範圍（0 表示緩衝區內的全部事件）
+
+    Returns:
+        {'traceEvents': [...], 'displayTimeUnit': 'ms'}（可直接 json.dumps）
+    """
+    now = time.perf_counter()
+    since = now - seconds if seconds and seconds > 0 else float("-inf")
+    with _buffers_lock:
+        buffers = list(_buffers)
+
+    pid = os.getpid()
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "candy_detector"}}]
+    for buffer in buffers:
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": buffer.tid, "args": {"name": buffer.thread_name}})
+        for name, cat, start, end, args in buffer.snapshot():
+            if (end if end is not None else start) < since:
+                continue
+            event = {"name": name, "cat": cat or "default", "pid": pid, "tid": buffer.tid, "ts": round(start * 1e6, 1)}
+            if end is None:
+                event["ph"] = "i"
+                event["s"] = "t"
+            else:
+                event["ph"] = "X"
+                event["dur"] = round((end - start) * 1e6, 1)
+            if args:
+                event["args"] = args
+            events.append(event)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def dump(path, seconds: float = 0.0) -> int:
+    """
+    將事件寫入 trace JSON 檔
+
+    Args:
+        path: 輸出檔案路徑
+        seconds: 匯出的時間範圍（0 表示全部）
+
+    Returns:
+        寫入的事件數（不含執行緒名稱等中繼資料）
+    """
+    trace = export(seconds)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace, f, ensure_ascii=False)
+    return sum(1 for event in trace["traceEvents"] if event["ph"] != "M")
+
+
+def get_stats() -> dict:
+    """取得追蹤狀態"""
+    with _buffers_lock:
+        buffers = list(_buffers)
+    return {
+        "enabled": _enabled,
+        "buffer_size": _buffer_size,
+        "threads": len(buffers),
+        "events": sum(min(b.index, len(b.events)) for b in buffers),
+        "overwritten": sum(max(0, b.index - len(b.events)) for b in buffers),
+    }
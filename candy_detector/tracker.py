@@ -0,0 +1,355 @@
+"""
+追蹤關聯模塊
+
+以均勻網格作為空間索引，只比對相鄰格子內的追蹤物體與偵測結果，
+並依距離由近到遠貪婪配對，成本隨畫面中糖果數量線性成長而非平方成長。
+最近消失的 abnormal 位置也以相同索引保存，供新物體繼承 abnormal 狀態。
+追蹤物體本身存放在預先配置的欄位陣列（TrackTable），過期與過線判斷以向量運算完成。
+"""
+
+import math
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Iterator, Sequence
+
+import numpy as np
+
+from .constants import CLASS_ABNORMAL
+
+if TYPE_CHECKING:
+    # 僅供型別標註，執行時在 TrackTable.get 內匯入
+    from .models import TrackState
+
+
+class SpatialGrid:
+    """均勻網格空間索引 - 格子邊長等於查詢半徑時只需檢查 3x3 鄰格"""
+
+    def __init__(self, cell_size: float):
+        """
+        初始化網格
+
+        Args:
+            cell_size: 格子邊長（像素）
+        """
+        self.cell_size = float(cell_size)
+        self._cells = defaultdict(list)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, item, x: float, y: float) -> None:
+        """加入一個項目"""
+        self._cells[self._cell(x, y)].append(item)
+
+    def remove(self, item, x: float, y: float) -> None:
+        """移除一個項目（需提供加入時的座標）"""
+        cell = self._cell(x, y)
+        items = self._cells.get(cell)
+        if items is None:
+            return
+        try:
+            items.remove(item)
+        except ValueError:
+            return
+        if not items:
+            del self._cells[cell]
+
+    def nearby(self, x: float, y: float, radius: float | None = None) -> Iterator:
+        """
+        列出可能在半徑內的項目（呼叫端仍需自行計算實際距離）
+
+        Args:
+            x: 查詢點 X 座標
+            y: 查詢點 Y 座標
+            radius: 查詢半徑，預設為格子邊長
+
+        Yields:
+            鄰近格子內的項目
+        """
+        reach = 1 if radius is None else max(1, math.ceil(radius / self.cell_size))
+        cx, cy = self._cell(x, y)
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                items = self._cells.get((gx, gy))
+                if items:
+                    yield from items
+
+    def clear(self) -> None:
+        """清除所有項目"""
+        self._cells.clear()
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._cells.values())
+
+
+def associate(
+    track_centers: Sequence[tuple[float, float]],
+    det_centers: Sequence[tuple[float, float]],
+    max_distance: float,
+) -> list[tuple[int, int]]:
+    """
+    將追蹤物體與偵測結果配對
+
+    只計算相鄰格子內的距離，再依距離由近到遠貪婪配對，
+    每個追蹤物體與偵測結果最多配對一次。
+
+    Args:
+        track_centers: 追蹤物體中心點
+        det_centers: 偵測結果中心點
+        max_distance: 最大配對距離（不含）
+
+    Returns:
+        [(追蹤索引, 偵測索引), ...]
+    """
+    if not track_centers or not det_centers:
+        return []
+
+    grid = SpatialGrid(max_distance)
+    for det_idx, (x, y) in enumerate(det_centers):
+        grid.insert(det_idx, x, y)
+
+    candidates = []
+    for track_idx, (tx, ty) in enumerate(track_centers):
+        for det_idx in grid.nearby(tx, ty):
+            dx, dy = det_centers[det_idx]
+            distance = math.hypot(tx - dx, ty - dy)
+            if distance < max_distance:
+                candidates.append((distance, track_idx, det_idx))
+
+    candidates.sort()
+    used_tracks = set()
+    used_dets = set()
+    matches = []
+    for _, track_idx, det_idx in candidates:
+        if track_idx in used_tracks or det_idx in used_dets:
+            continue
+        used_tracks.add(track_idx)
+        used_dets.add(det_idx)
+        matches.append((track_idx, det_idx))
+    return matches
+
+
+class RecentAbnormals:
+    """最近消失的 abnormal 位置 - 依時間排序的佇列加上空間索引"""
+
+    def __init__(self, radius: float = 400, max_age_frames: int = 60, max_records: int = 60):
+        """
+        初始化記錄
+
+        Args:
+            radius: 新物體距離小於此值時繼承 abnormal 狀態（像素）
+            max_age_frames: 記錄保留的幀數
+            max_records: 最多保留的記錄數
+        """
+        self.radius = radius
+        self.max_age_frames = max_age_frames
+        self.max_records = max_records
+        self._records = deque()  # [(center, frame_index), ...]，由舊到新
+        self._grid = SpatialGrid(radius)
+
+    def add(self, center: tuple[int, int], frame_index: int) -> None:
+        """記錄一個消失的 abnormal 追蹤物體"""
+        record = (center, frame_index)
+        self._records.append(record)
+        self._grid.insert(record, *center)
+        while len(self._records) > self.max_records:
+            self._pop_oldest()
+
+    def _pop_oldest(self) -> None:
+        record = self._records.popleft()
+        self._grid.remove(record, *record[0])
+
+    def expire(self, frame_index: int) -> None:
+        """移除超過保留幀數的記錄"""
+        while self._records and frame_index - self._records[0][1] > self.max_age_frames:
+            self._pop_oldest()
+
+    def find_near(self, center: tuple[int, int], frame_index: int) -> float | None:
+        """
+        尋找附近的 abnormal 記錄
+
+        Args:
+            center: 新物體中心點
+            frame_index: 目前幀索引
+
+        Returns:
+            最近記錄的距離；找不到時回傳 None
+        """
+        self.expire(frame_index)
+        best = None
+        for old_center, _ in self._grid.nearby(center[0], center[1]):
+            distance = math.hypot(center[0] - old_center[0], center[1] - old_center[1])
+            if distance < self.radius and (best is None or distance < best):
+                best = distance
+        return best
+
+    def clear(self) -> None:
+        """清除所有記錄"""
+        self._records.clear()
+        self._grid.clear()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class TrackTable:
+    """
+    追蹤物體表 - 以預先配置的 NumPy 欄位保存所有追蹤物體（struct of arrays）
+
+    每個追蹤物體佔用固定一列（約 65 bytes），移除後的列號放回空閒串列重複使用，
+    配對、過期與過線判斷都可以對整個欄位一次運算。
+    """
+
+    # flags 欄位的位元
+    FLAG_SEEN_ABNORMAL = 1
+    FLAG_COUNTED = 2
+    FLAG_TRIGGERED = 4
+
+    def __init__(self, capacity: int = 64):
+        """
+        初始化追蹤表
+
+        Args:
+            capacity: 初始列數（不足時自動加倍）
+        """
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        self.track_id = np.zeros(capacity, dtype=np.int64)
+        self.center = np.zeros((capacity, 2), dtype=np.int32)
+        self.prev_center = np.zeros((capacity, 2), dtype=np.int32)
+        self.bbox = np.zeros((capacity, 4), dtype=np.int32)
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.max_score = np.zeros(capacity, dtype=np.float32)  # 追蹤期間的最高信心分數
+        self.rule = np.zeros(capacity, dtype=np.uint8)  # 判定 abnormal 的規則（events.RULE_*）
+        self.classid = np.zeros(capacity, dtype=np.int16)  # 最後一次偵測的類別
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.missed = np.zeros(capacity, dtype=np.int32)
+        self.age = np.zeros(capacity, dtype=np.int32)
+        self.active = np.zeros(capacity, dtype=bool)
+        # 空閒列號（由小到大取用）
+        self._free = list(range(capacity - 1, -1, -1))
+        self._slots = {}  # track_id -> 列號
+
+    def _grow(self) -> None:
+        old_capacity = len(self.active)
+        columns = ("track_id", "center", "prev_center", "bbox", "score", "max_score", "rule", "classid", "flags", "missed", "age", "active")
+        old = {name: getattr(self, name) for name in columns}
+        slots = self._slots
+        self._allocate(old_capacity * 2)
+        for name, values in old.items():
+            getattr(self, name)[:old_capacity] = values
+        self._free = list(range(old_capacity * 2 - 1, old_capacity - 1, -1))
+        self._slots = slots
+
+    def add(
+        self, track_id: int, center, bbox, score: float, classid: int, seen_abnormal: bool = False, rule: int = 0
+    ) -> int:
+        """
+        新增一個追蹤物體
+
+        Args:
+            track_id: 追蹤 ID
+            center: 中心點 (x, y)
+            bbox: 邊界框 [x, y, w, h]
+            score: 信心分數
+            classid: 偵測類別
+            seen_abnormal: 是否已判定為 abnormal
+            rule: 判定 abnormal 的規則代碼（0 表示正常）
+
+        Returns:
+            使用的列號
+        """
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.track_id[slot] = track_id
+        self.center[slot] = center
+        self.prev_center[slot] = center
+        self.bbox[slot] = bbox
+        self.score[slot] = score
+        self.max_score[slot] = score
+        self.rule[slot] = rule
+        self.classid[slot] = classid
+        self.flags[slot] = self.FLAG_SEEN_ABNORMAL if seen_abnormal else 0
+        self.missed[slot] = 0
+        self.age[slot] = 0
+        self.active[slot] = True
+        self._slots[track_id] = slot
+        return slot
+
+    def remove(self, slots) -> None:
+        """移除指定列號的追蹤物體"""
+        for slot in np.asarray(slots, dtype=np.intp).tolist():
+            if not self.active[slot]:
+                continue
+            self.active[slot] = False
+            self._slots.pop(int(self.track_id[slot]), None)
+            self._free.append(slot)
+
+    def slots(self) -> np.ndarray:
+        """目前使用中的列號（由小到大）"""
+        return np.flatnonzero(self.active)
+
+    def slot_of(self, track_id: int) -> int | None:
+        """追蹤 ID 對應的列號"""
+        return self._slots.get(track_id)
+
+    def has_flag(self, slots: np.ndarray, flag: int) -> np.ndarray:
+        """指定列是否設定了 flag"""
+        return (self.flags[slots] & flag) != 0
+
+    def set_flag(self, slots: np.ndarray, flag: int) -> None:
+        """設定指定列的 flag"""
+        self.flags[slots] |= flag
+
+    def clear(self) -> None:
+        """清除所有追蹤物體（保留已配置的容量）"""
+        self.active[:] = False
+        self._free = list(range(len(self.active) - 1, -1, -1))
+        self._slots.clear()
+
+    def get(self, track_id: int, class_names: Sequence[str] | None = None) -> "TrackState | None":
+        """
+        取得單一追蹤物體的快照（除錯與 API 用，修改快照不會影響追蹤表）
+
+        Args:
+            track_id: 追蹤 ID
+            class_names: 類別名稱，用於還原 last_class
+
+        Returns:
+            TrackState；找不到時回傳 None
+        """
+        from .models import TrackState  # models 匯入本模塊，避免循環匯入
+
+        slot = self._slots.get(track_id)
+        if slot is None:
+            return None
+        flags = int(self.flags[slot])
+        seen_abnormal = bool(flags & self.FLAG_SEEN_ABNORMAL)
+        classid = int(self.classid[slot])
+        if seen_abnormal:
+            last_class = CLASS_ABNORMAL
+        elif class_names is not None and 0 <= classid < len(class_names):
+            last_class = class_names[classid]
+        else:
+            last_class = str(classid)
+        return TrackState(
+            center=tuple(self.center[slot].tolist()),
+            prev_center=tuple(self.prev_center[slot].tolist()),
+            seen_abnormal=seen_abnormal,
+            counted=bool(flags & self.FLAG_COUNTED),
+            triggered=bool(flags & self.FLAG_TRIGGERED),
+            missed_frames=int(self.missed[slot]),
+            last_class=last_class,
+            age=int(self.age[slot]),
+            bbox=tuple(self.bbox[slot].tolist()),
+            score=float(self.score[slot]),
+            max_score=float(self.max_score[slot]),
+            rule=int(self.rule[slot]),
+        )
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self._slots
@@ -14,7 +14,6 @@ import time
 import threading
 import argparse
 import requests
-import math
 import numpy as np
 import os
 import ctypes
@@ -26,10 +25,11 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from candy_detector.config import ConfigManager
-from candy_detector.models import CameraContext, TrackState
+from candy_detector.config import ConfigManager, DetectionSettings
+from candy_detector.models import CameraContext
 from candy_detector.constants import (
     PROJECT_ROOT,
+    CAPTURE_RING_BUFFER_SIZE,
     TRACK_DISTANCE_THRESHOLD_PX,
     MAX_MISSED_FRAMES,
     DEFAULT_DISPLAY_HEIGHT,
@@ -38,16 +38,29 @@ from candy_detector.constants import (
     DISPLAY_COLORS,
     CLASS_NORMAL,
     CLASS_ABNORMAL,
+    LOGS_DIR,
 )
 from candy_detector.logger import get_logger, setup_logger, APP_LOG_FILE
+from candy_detector.relay import RelayScheduler, build_relay_urls
+from candy_detector.postprocess import filter_detections
+from candy_detector.inference import extract_yolov8_result
+from candy_detector.tracker import RecentAbnormals, TrackTable, associate
+from candy_detector.motion import MotionGate
+from candy_detector.inspection import REASON_BLACK_SPOT, REASON_COLOR, inspect_candy, inspect_candies
+from candy_detector.metrics import camera_metrics
+from candy_detector import tracing
+from candy_detector.events import EventLog, RULE_BLACK_SPOT, RULE_COLOR, RULE_INHERITED, RULE_MODEL, RULE_NONE
 from candy_detector.optimization import (
     MultiScaleDetector,
+    BandCropProcessor,
+    BatchKalmanTracker,
     ROIProcessor,
     KalmanTracker,
     AdaptiveTracker,
     DynamicThresholdAdjuster,
     PerformanceMonitor,
 )
+from utils.performance_optimizer import MultiThreadedFrameReader
 
 # 設置日誌
 setup_logger("candy_detector", APP_LOG_FILE)
@@ -154,8 +167,7 @@ def trigger_relay(url: str, delay_ms: int = 0, duration_ms: int = 50) -> None:
     
     try:
         # 2. 開啟繼電器 (value=1)
-        # 確保 URL 包含 value=1
-        on_url = url if 'value=1' in url else (url + '&value=1' if '?' in url else url + '?value=1')
+        on_url, off_url = build_relay_urls(url)
         
         response = requests.post(on_url, timeout=2)
         # print(f"觸發繼電器(ON): {on_url}, 狀態碼: {response.status_code}") # 減少日誌
@@ -169,7 +181,6 @@ def trigger_relay(url: str, delay_ms: int = 0, duration_ms: int = 50) -> None:
             time.sleep(duration_ms / 1000.0)
             
             # 4. 關閉繼電器 (value=0)
-            off_url = on_url.replace('value=1', 'value=0')
             response_off = requests.post(off_url, timeout=2)
             # print(f"關閉繼電器(OFF): {off_url}, 狀態碼: {response_off.status_code}")
             
@@ -193,58 +204,8 @@ def detect_black_spots(frame: np.ndarray, bbox: list, threshold: float = 0.03, d
     Returns:
         True 如果檢測到黑點，False 否則
     """
-    try:
-        x, y, w, h = bbox
-        
-        # 確保邊界框在畫面範圍內
-        frame_h, frame_w = frame.shape[:2]
-        x1 = max(0, int(x))
-        y1 = max(0, int(y))
-        x2 = min(frame_w, int(x + w))
-        y2 = min(frame_h, int(y + h))
-        
-        if x2 <= x1 or y2 <= y1:
-            return False
-        
-        # 提取糖果區域
-        roi = frame[y1:y2, x1:x2]
-        
-        if roi.size == 0:
-            return False
-        
-        # 轉換為 HSV 色彩空間（更適合檢測黑色）
-        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-        
-        # 定義黑色範圍（H 可以是任意值，S 和 V 都很低）
-        # V (明度) < 60 表示暗色
-        # S (飽和度) 可以較寬鬆
-        lower_black = np.array([0, 0, 0])
-        upper_black = np.array([180, 255, 60])
-        
-        # 創建黑色掩碼
-        black_mask = cv2.inRange(hsv, lower_black, upper_black)
-        
-        # 使用形態學操作去除噪點
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        black_mask = cv2.morphologyEx(black_mask, cv2.MORPH_OPEN, kernel)
-        black_mask = cv2.morphologyEx(black_mask, cv2.MORPH_CLOSE, kernel)
-        
-        # 計算黑色像素比例
-        black_pixels = cv2.countNonZero(black_mask)
-        total_pixels = roi.shape[0] * roi.shape[1]
-        black_ratio = black_pixels / total_pixels if total_pixels > 0 else 0
-        
-        # 根據閾值判斷是否有黑點
-        has_black_spots = black_ratio > threshold
-        
-        if debug and has_black_spots:
-            print(f"  [黑點檢測] 黑色像素比例: {black_ratio:.2%} (閾值: {threshold:.2%})")
-        
-        return has_black_spots
-        
-    except Exception as e:
-        logger.warning(f"黑點檢測失敗: {e}")
-        return False
+    reason = inspect_candy(frame, bbox, check_black=True, black_threshold=threshold, check_color=False, debug=debug)
+    return reason == REASON_BLACK_SPOT
 
 
 def detect_color_abnormality(frame: np.ndarray, bbox: list, threshold: float = 0.70, debug: bool = False) -> bool:
@@ -260,59 +221,53 @@ def detect_color_abnormality(frame: np.ndarray, bbox: list, threshold: float = 0
     Returns:
         True 如果顏色異常（不是亮黃色），False 如果顏色正常
     """
-    try:
-        x, y, w, h = bbox
-        
-        # 確保邊界框在畫面範圍內
-        frame_h, frame_w = frame.shape[:2]
-        x1 = max(0, int(x))
-        y1 = max(0, int(y))
-        x2 = min(frame_w, int(x + w))
-        y2 = min(frame_h, int(y + h))
-        
-        if x2 <= x1 or y2 <= y1:
-            return False
-        
-        # 提取糖果區域
-        roi = frame[y1:y2, x1:x2]
-        
-        if roi.size == 0:
-            return False
-        
-        # 轉換為 HSV 色彩空間
-        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-        
-        # 定義亮黃色範圍（放寬條件，包含更多黃色變體）
-        # H (色調): 15-45 黃色及偏橙、偏綠的黃色
-        # S (飽和度): 50-255 允許較淡的黃色
-        # V (明度): 100-255 允許較暗的黃色
-        lower_yellow = np.array([15, 50, 100])
-        upper_yellow = np.array([45, 255, 255])
-        
-        # 創建黃色掩碼
-        yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-        
-        # 使用形態學操作去除噪點
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        yellow_mask = cv2.morphologyEx(yellow_mask, cv2.MORPH_OPEN, kernel)
-        yellow_mask = cv2.morphologyEx(yellow_mask, cv2.MORPH_CLOSE, kernel)
-        
-        # 計算黃色像素比例
-        yellow_pixels = cv2.countNonZero(yellow_mask)
-        total_pixels = roi.shape[0] * roi.shape[1]
-        yellow_ratio = yellow_pixels / total_pixels if total_pixels > 0 else 0
-        
-        # 如果黃色像素比例低於閾值，認為顏色異常
-        is_abnormal = yellow_ratio < threshold
-        
-        if debug:
-            print(f"  [顏色檢測] 黃色像素比例: {yellow_ratio:.2%} (閾值: {threshold:.2%}) - {'異常' if is_abnormal else '正常'}")
-        
-        return is_abnormal
-        
-    except Exception as e:
-        logger.warning(f"顏色檢測失敗: {e}")
-        return False
+    reason = inspect_candy(frame, bbox, check_black=False, check_color=True, color_threshold=threshold, debug=debug)
+    return reason == REASON_COLOR
+
+
+def apply_candy_inspection(
+    cam_ctx: CameraContext,
+    frame: np.ndarray,
+    detections: list[dict],
+    enable_black_spot: bool,
+    black_spot_threshold: float,
+    enable_color: bool,
+    color_threshold: float,
+    hsv_mode: str = 'crop',
+    hsv_region: tuple[int, int, int, int] | None = None,
+) -> None:
+    """
+    額外檢測：只對 NORMAL 進行黑點（優先）與顏色檢測，ABNORMAL 不會被改變
+
+    檢測到異常時直接將 detection 的 label 改為 ABNORMAL，rule 記錄判定的檢測項目。
+    hsv_mode 為 union/band 時整幀只轉換一次 HSV（band 使用 hsv_region）。
+    """
+    if not (enable_black_spot or enable_color):
+        return
+    normals = [det for det in detections if det['label'] == CLASS_NORMAL]
+    if not normals:
+        return
+
+    reasons = inspect_candies(
+        frame,
+        [det['bbox'] for det in normals],
+        check_black=enable_black_spot,
+        black_threshold=black_spot_threshold,
+        check_color=enable_color,
+        color_threshold=color_threshold,
+        mode=hsv_mode,
+        region=hsv_region,
+    )
+    for det, reason in zip(normals, reasons):
+        if reason is None:
+            continue
+        det['label'] = CLASS_ABNORMAL
+        det['rule'] = RULE_BLACK_SPOT if reason == REASON_BLACK_SPOT else RULE_COLOR
+        if cam_ctx.frame_index % 30 == 0:
+            if reason == REASON_BLACK_SPOT:
+                print(f"[{cam_ctx.name}] 黑點檢測: 發現黑點，改判為 ABNORMAL")
+            else:
+                print(f"[{cam_ctx.name}] 顏色檢測: 顏色異常（非亮黃色），改判為 ABNORMAL")
 
 
 def resize_for_display(frame: np.ndarray, target_height: int) -> np.ndarray:
@@ -384,30 +339,12 @@ def run_detection(model, frame, conf_threshold, nms_threshold, model_type='yolov
         # YOLOv8 檢測
         results = model.predict(frame, conf=conf_threshold, iou=nms_threshold, verbose=False)
         
-        classes_list = []
-        scores_list = []
-        boxes_list = []
-        
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # 獲取邊界框 xyxy 格式 (左上角和右下角座標)
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                
-                # 轉換為 xywh 格式 (左上角座標 + 寬高)
-                x = float(x1)
-                y = float(y1)
-                w = float(x2 - x1)
-                h = float(y2 - y1)
-                
-                conf = float(box.conf[0])
-                class_id = int(box.cls[0])
-                
-                classes_list.append([class_id])
-                scores_list.append([conf])
-                boxes_list.append([x, y, w, h])
-        
-        return classes_list, scores_list, boxes_list
+        # 單張畫面只有一個結果，整批轉為 NumPy 陣列（xywh，與 YOLOv4 相同）
+        extracted = [extract_yolov8_result(result) for result in results]
+        if len(extracted) == 1:
+            return extracted[0]
+        classes, scores, boxes = zip(*extracted)
+        return np.concatenate(classes), np.concatenate(scores), np.concatenate(boxes)
     
     else:
         # YOLOv4 檢測（需要灰階圖）
@@ -473,7 +410,18 @@ def setup_focus_trackbars(window_name: str, camera_contexts: list[CameraContext]
         )
 
 
-def create_camera_context(config: configparser.ConfigParser, section: str):
+def create_camera_context(config: configparser.ConfigParser, section: str, cap=None):
+    """
+    依設定檔區塊建立攝影機上下文
+
+    Args:
+        config: 設定檔
+        section: 攝影機區塊名稱
+        cap: 已開啟的影像來源（例如 ReplayCapture）；None 時開啟設定的攝影機並套用曝光與焦距
+
+    Returns:
+        CameraContext；攝影機無法開啟時回傳 None
+    """
     cam_config = config[section]
     cam_index = cam_config.getint('camera_index')
     cam_name = cam_config.get('camera_name')
@@ -500,45 +448,50 @@ def create_camera_context(config: configparser.ConfigParser, section: str):
     kalman_process_noise = cam_config.getfloat('kalman_process_noise', fallback=0.1)
     kalman_measure_noise = cam_config.getfloat('kalman_measure_noise', fallback=0.5)
 
-    cap = cv2.VideoCapture(cam_index, cv2.CAP_DSHOW)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, frame_width)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_height)
-    cap.set(cv2.CAP_PROP_FPS, 60)  # 設定為 60 FPS
+    if cap is None:
+        cap = cv2.VideoCapture(cam_index, cv2.CAP_DSHOW)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, frame_width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_height)
+        cap.set(cv2.CAP_PROP_FPS, 60)  # 設定為 60 FPS
 
-    if not cap.isOpened():
-        print(f"錯誤: 無法開啟攝影機 {cam_index} ({cam_name})")
-        cap.release()
-        return None
+        if not cap.isOpened():
+            print(f"錯誤: 無法開啟攝影機 {cam_index} ({cam_name})")
+            cap.release()
+            return None
     
-    # 驗證實際解析度
-    actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    if actual_width != frame_width or actual_height != frame_height:
-        logger.warning(f"{cam_name}: 請求解析度 {frame_width}x{frame_height}，實際取得 {actual_width}x{actual_height}")
-        logger.info(f"{cam_name}: 攝影機可能不支援請求的解析度，已自動調整")
-
-    # 設定曝光以減少殘影（Motion Blur）
-    try:
-        # 關閉自動曝光
-        cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25)  # 0.25 = 手動模式
-        # 設定較短的曝光時間（值越小 = 快門越快）
-        # -4 到 -13 之間，-7 通常適合快速移動物體
-        exposure_value = config.getint(section, 'exposure_value', fallback=-7)
-        cap.set(cv2.CAP_PROP_EXPOSURE, exposure_value)
-        logger.info(f"{cam_name}: 已設定曝光值為 {exposure_value} (減少殘影)")
-    except Exception as e:
-        logger.warning(f"{cam_name}: 設定曝光失敗（可能不支援）: {e}")
-
-    # 設定初始焦距
-    if use_startup_af:
-        initialize_focus(cap, cam_name, frames=af_frames, delay_sec=af_delay_ms / 1000.0)
-    elif default_focus >= 0:
+        # 驗證實際解析度
+        actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if actual_width != frame_width or actual_height != frame_height:
+            logger.warning(f"{cam_name}: 請求解析度 {frame_width}x{frame_height}，實際取得 {actual_width}x{actual_height}")
+            logger.info(f"{cam_name}: 攝影機可能不支援請求的解析度，已自動調整")
+
+        # 設定曝光以減少殘影（Motion Blur）
         try:
-            cap.set(cv2.CAP_PROP_AUTOFOCUS, 0)
-            cap.set(cv2.CAP_PROP_FOCUS, default_focus)
-            logger.info(f"{cam_name}: 已將初始焦距設為預設值 {default_focus}")
+            # 關閉自動曝光
+            cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25)  # 0.25 = 手動模式
+            # 設定較短的曝光時間（值越小 = 快門越快）
+            # -4 到 -13 之間，-7 通常適合快速移動物體
+            exposure_value = config.getint(section, 'exposure_value', fallback=-7)
+            cap.set(cv2.CAP_PROP_EXPOSURE, exposure_value)
+            logger.info(f"{cam_name}: 已設定曝光值為 {exposure_value} (減少殘影)")
         except Exception as e:
-            logger.warning(f"為 {cam_name} 設定預設焦距失敗: {e}")
+            logger.warning(f"{cam_name}: 設定曝光失敗（可能不支援）: {e}")
+
+        # 設定初始焦距
+        if use_startup_af:
+            initialize_focus(cap, cam_name, frames=af_frames, delay_sec=af_delay_ms / 1000.0)
+        elif default_focus >= 0:
+            try:
+                cap.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+                cap.set(cv2.CAP_PROP_FOCUS, default_focus)
+                logger.info(f"{cam_name}: 已將初始焦距設為預設值 {default_focus}")
+            except Exception as e:
+                logger.warning(f"為 {cam_name} 設定預設焦距失敗: {e}")
+    else:
+        # 外部提供的影像來源（例如離線重播）以實際尺寸為準，不套用曝光與焦距設定
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or frame_width
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or frame_height
 
     # 初始化優化組件
     roi_processor = None
@@ -569,10 +522,50 @@ def create_camera_context(config: configparser.ConfigParser, section: str):
         use_kalman=use_kalman == 1,
         use_adaptive=use_adaptive == 1,
         adaptive_tracker=AdaptiveTracker() if use_adaptive == 1 else None,
+        kalman_tracker=BatchKalmanTracker(kalman_process_noise, kalman_measure_noise) if use_kalman == 1 else None,
+        relay_scheduler=RelayScheduler(cam_name, relay_url),
     )
     return ctx
 
 
+def create_multi_scale_detector(config: configparser.ConfigParser) -> MultiScaleDetector | None:
+    """依 [Detection] use_multi_scale 建立多尺度檢測器（停用時回傳 None）"""
+    if config.getint('Detection', 'use_multi_scale', fallback=0) != 1:
+        return None
+    multi_scale_str = config.get('Detection', 'multi_scale_factors', fallback='0.75,1.0,1.25')
+    multi_scale_factors = [float(x.strip()) for x in multi_scale_str.split(',')]
+    multi_scale_nms = config.get('Detection', 'multi_scale_nms', fallback='hard').strip().lower()
+    soft_nms_sigma = config.getfloat('Detection', 'soft_nms_sigma', fallback=0.5)
+    input_size = config.getint('Detection', 'input_size', fallback=416)
+    detector = MultiScaleDetector(multi_scale_factors, input_size, multi_scale_nms, soft_nms_sigma)
+    logger.info(f"多尺度檢測輸入尺寸: {detector.input_sizes} (NMS: {multi_scale_nms})")
+    return detector
+
+
+def create_band_cropper(cam_ctx: CameraContext, settings: DetectionSettings) -> BandCropProcessor:
+    """
+    建立偵測線帶狀裁切處理器（啟用 ROI 時沿用 ROI 的上下邊界）
+
+    Args:
+        cam_ctx: 攝影機上下文
+        settings: 偵測設定快照
+
+    Returns:
+        BandCropProcessor 實例
+    """
+    y1, y2 = 0, cam_ctx.frame_height
+    if cam_ctx.use_roi and cam_ctx.roi_processor:
+        y1, y2 = cam_ctx.roi_processor.roi_y1, cam_ctx.roi_processor.roi_y2
+    return BandCropProcessor(
+        cam_ctx.frame_width,
+        cam_ctx.frame_height,
+        min_margin=settings.band_crop_margin,
+        track_frames=settings.band_crop_track_frames,
+        y1=y1,
+        y2=y2,
+    )
+
+
 def process_camera_frame(
     cam_ctx: CameraContext,
     model,
@@ -586,9 +579,27 @@ def process_camera_frame(
     model_lock=None,
     model_type='yolov4',
     config=None,
+    inference_service=None,
+    settings: DetectionSettings | None = None,
 ) -> np.ndarray | None:
     cam_ctx.frame_index += 1
-    ret, frame = cam_ctx.cap.read()
+    # 各處理階段耗時記錄到固定區間直方圖（/metrics）
+    metrics = cam_ctx.metrics
+    if metrics is None:
+        metrics = cam_ctx.metrics = camera_metrics(cam_ctx.name)
+    # 追蹤模式啟用時同一組時間點也記錄為 span（停用時 tracing.complete 立即返回）
+    frame_start = stage_start = time.perf_counter()
+    grabber = cam_ctx.grabber
+    if grabber is not None:
+        # 抓取執行緒持續讀取，這裡只取最新一張（中間來不及處理的畫面計為丟棄）
+        ret, raw_handle, capture_ts = grabber.read()
+        # 抓取執行緒重新建立時計數會歸零，只累計增加的部分
+        if grabber.dropped_frames > cam_ctx.dropped_frames:
+            metrics.dropped_frames.inc(grabber.dropped_frames - cam_ctx.dropped_frames)
+        cam_ctx.dropped_frames = grabber.dropped_frames
+    else:
+        ret, raw_handle = cam_ctx.frame_pool.read(cam_ctx.cap)
+        capture_ts = time.monotonic()
     if not ret:
         # 記錄連續失敗次數
         if not hasattr(cam_ctx, 'read_fail_count'):
@@ -612,239 +623,288 @@ def process_camera_frame(
             logger.info(f"{cam_ctx.name} 已恢復正常 (之前失敗 {cam_ctx.read_fail_count} 次)")
         cam_ctx.read_fail_count = 0
     
-    # 保存原始畫面到緩存（供錄影預覽等功能使用）
-    cam_ctx.latest_frame = frame.copy()
+    cam_ctx.last_capture_ts = capture_ts
+    now = time.perf_counter()
+    metrics.observe('capture_wait', now - stage_start)
+    tracing.complete('capture_wait', stage_start, now, cam_ctx.name)
+    metrics.frames.inc()
+
+    # 原始畫面為唯讀的緩衝池畫面，偵測只讀取；標註畫在顯示緩衝區上
+    frame = raw_handle.array
+    stage_start = now
+    display = cam_ctx.display_pool.copy(frame)
+    now = time.perf_counter()
+    drawing_time = now - stage_start
+    tracing.complete('display_copy', stage_start, now, cam_ctx.name)
     
-    # 讀取檢測配置
-    enable_black_spot = False
-    black_spot_threshold = 0.03
-    enable_color = False
-    color_threshold = 0.70
-    if config:
-        try:
-            enable_black_spot = config.getint('Detection', 'enable_black_spot_detection', fallback=1) == 1
-            black_spot_threshold = config.getfloat('Detection', 'black_spot_threshold', fallback=0.03)
-            enable_color = config.getint('Detection', 'enable_color_detection', fallback=1) == 1
-            color_threshold = config.getfloat('Detection', 'color_yellow_threshold', fallback=0.70)
-            # 首次輸出配置（只在第一幀）
-            if cam_ctx.frame_index == 1:
-                logger.info(f"{cam_ctx.name} 額外檢測配置: 黑點={'啟用' if enable_black_spot else '停用'}, 顏色={'啟用' if enable_color else '停用'}")
-        except Exception:
-            pass
-
-    # 提取 ROI（如果啟用）
+    # 偵測設定快照：整幀使用同一份，熱重載時由呼叫端傳入新的快照
+    if settings is None:
+        settings = getattr(cam_ctx, 'config_settings', None)
+        if settings is None:
+            # 未提供設定檔時不做額外檢測
+            settings = (
+                DetectionSettings.from_config(config) if config
+                else DetectionSettings(enable_black_spot=False, enable_color=False)
+            )
+            cam_ctx.config_settings = settings
+    previous_version = getattr(cam_ctx, 'settings_version', None)
+    if previous_version != settings.version:
+        # 設定變更後依新設定重建動態閘門與帶狀裁切
+        if previous_version is None:
+            logger.info(f"{cam_ctx.name} 額外檢測配置: 黑點={'啟用' if settings.enable_black_spot else '停用'}, 顏色={'啟用' if settings.enable_color else '停用'}, HSV={settings.hsv_mode}")
+        else:
+            logger.info(f"{cam_ctx.name} 套用新的偵測設定 (版本 {settings.version})")
+        cam_ctx.motion_gate = None
+        cam_ctx.band_cropper = None
+        cam_ctx.settings_version = settings.version
+
+    # 提取偵測區域：偵測線帶狀裁切優先，其次為固定 ROI
+    # detection_offset 為偵測畫面左上角在原始畫面中的座標，偵測框需加上這個偏移
+    # detection_shape 為實際影像範圍（帶狀裁切時不含 letterbox 補邊），用於可見比例與邊緣檢查
     detection_frame = frame
-    if cam_ctx.use_roi and cam_ctx.roi_processor:
+    detection_offset = (0, 0)
+    detection_shape = frame.shape
+    if settings.use_band_crop:
+        if cam_ctx.band_cropper is None:
+            cam_ctx.band_cropper = create_band_cropper(cam_ctx, settings)
+        detection_frame, detection_offset = cam_ctx.band_cropper.extract(frame, cam_ctx.line_x1, cam_ctx.line_x2)
+        crop_x1, crop_y1, crop_x2, crop_y2 = cam_ctx.band_cropper.last_crop
+        detection_shape = (crop_y2 - crop_y1, crop_x2 - crop_x1) + frame.shape[2:]
+    elif cam_ctx.use_roi and cam_ctx.roi_processor:
         detection_frame = cam_ctx.roi_processor.extract_roi(frame)
+        detection_offset = (cam_ctx.roi_processor.roi_x1, cam_ctx.roi_processor.roi_y1)
+        detection_shape = detection_frame.shape
     
+    # 動態閘門：偵測線附近的帶狀區域沒有變化時略過推論（追蹤物體仍照常累計幀數）
+    run_inference = True
+    if settings.use_motion_gate:
+        if cam_ctx.motion_gate is None:
+            cam_ctx.motion_gate = MotionGate.from_settings(settings)
+        run_inference = cam_ctx.motion_gate.should_infer(frame, cam_ctx.line_x1, cam_ctx.line_x2)
+
     # 執行檢測
-    if multi_scale_detector:
-        # 使用多尺度檢測
-        detections_raw = multi_scale_detector.detect_multi_scale(detection_frame, model, conf_threshold, nms_threshold)
-        detections = []
-        for det in detections_raw:
-            classid = det['classid']
-            score = det['score']
-            cx, cy = det['center']
-            
-            # 如果使用 ROI，轉換座標
-            if cam_ctx.use_roi and cam_ctx.roi_processor:
-                cx, cy = cam_ctx.roi_processor.convert_roi_to_frame_coords(cx, cy)
-            
-            label = class_names[classid]
-            
-            # 額外檢測：只對 NORMAL 進行檢測，ABNORMAL 不會被改變
-            if label == CLASS_NORMAL:
-                # 黑點檢測（優先）
-                if enable_black_spot and detect_black_spots(frame, det['bbox'], threshold=black_spot_threshold, debug=False):
-                    label = CLASS_ABNORMAL
-                    if cam_ctx.frame_index % 30 == 0:
-                        print(f"[{cam_ctx.name}] 黑點檢測: 發現黑點，改判為 ABNORMAL")
-                # 顏色檢測（其次）
-                elif enable_color and detect_color_abnormality(frame, det['bbox'], threshold=color_threshold, debug=False):
-                    label = CLASS_ABNORMAL
-                    if cam_ctx.frame_index % 30 == 0:
-                        print(f"[{cam_ctx.name}] 顏色檢測: 顏色異常（非亮黃色），改判為 ABNORMAL")
-            # 如果模型已判定為 ABNORMAL，則保持不變，不再進行額外檢測
-            
-            detections.append({'center': (cx, cy), 'label': label, 'score': score, 'bbox': det['bbox']})
-    else:
-        # 標準檢測
-        # 使用鎖保護模型檢測，防止多線程衝突
-        if model_lock:
-            with model_lock:
-                classes, scores, boxes = run_detection(model, detection_frame, conf_threshold, nms_threshold, model_type)
-        else:
+    stage_start = time.perf_counter()
+    if not run_inference:
+        metrics.skipped_inferences.inc()
+        classes, scores, boxes = (), (), ()
+    elif multi_scale_detector:
+        # 多尺度檢測：每個尺度各推論一次（切換輸入尺寸需在模型鎖內），結果以陣列 NMS 合併
+        classes, scores, boxes = multi_scale_detector.detect_arrays(
+            detection_frame, model, conf_threshold, nms_threshold, model_type, model_lock
+        )
+    # 批次推論服務會與其他攝影機的畫面合併為一次 predict
+    elif inference_service is not None:
+        classes, scores, boxes = inference_service.infer(cam_ctx.name, detection_frame)
+    # 使用鎖保護模型檢測，防止多線程衝突
+    elif model_lock:
+        lock_start = time.perf_counter()
+        with model_lock:
+            tracing.complete('model_lock_wait', lock_start, time.perf_counter(), cam_ctx.name)
             classes, scores, boxes = run_detection(model, detection_frame, conf_threshold, nms_threshold, model_type)
+    else:
+        classes, scores, boxes = run_detection(model, detection_frame, conf_threshold, nms_threshold, model_type)
+    now = time.perf_counter()
+    if run_inference:
+        metrics.observe('inference', now - stage_start)
+        tracing.complete('inference', stage_start, now, cam_ctx.name)
+
+    stage_start = now
+    filtered, invalid_ids = filter_detections(
+        classes, scores, boxes, detection_shape, len(class_names), settings.detection_filter, detection_offset
+    )
 
-        detections = []
-        frame_height, frame_width = detection_frame.shape[:2]
-        
-        for (classid, score, box) in zip(classes, scores, boxes):
-            classid = int(classid[0] if isinstance(classid, (list, np.ndarray)) else classid)
-            score = float(score[0] if isinstance(score, (list, np.ndarray)) else score)
-            box = box if isinstance(box, (list, np.ndarray)) else box
-            x, y, w, h = box
-            
-            # 過濾不合理的偵測框
-            # 1. 檢查邊界框大小是否合理（糖果應該在 20-400 像素之間）
-            min_size = 20
-            max_size = 400
-            if w < min_size or h < min_size or w > max_size or h > max_size:
-                continue
-            
-            # 2. 檢查長寬比是否合理（糖果應該接近圓形，長寬比在 0.4-2.5 之間）
-            aspect_ratio = w / h if h > 0 else 0
-            if aspect_ratio < 0.4 or aspect_ratio > 2.5:
-                continue
-            
-            # 3. 計算物體在畫面內的可見比例（允許邊緣物體，只要有至少30%可見）
-            # 計算偵測框與畫面的交集
-            x1_visible = max(0, x)
-            y1_visible = max(0, y)
-            x2_visible = min(frame_width, x + w)
-            y2_visible = min(frame_height, y + h)
-            
-            visible_width = max(0, x2_visible - x1_visible)
-            visible_height = max(0, y2_visible - y1_visible)
-            visible_area = visible_width * visible_height
-            total_area = w * h
-            
-            # 如果可見面積小於30%，則跳過（可能是噪點或不完整物體）
-            if total_area > 0:
-                visible_ratio = visible_area / total_area
-                if visible_ratio < 0.3:
-                    continue
-            
-            # 計算中心點
-            cx, cy = int(x + w / 2), int(y + h / 2)
-            
-            # 如果使用 ROI，轉換座標到原始畫面
-            if cam_ctx.use_roi and cam_ctx.roi_processor:
-                # 轉換左上角座標
-                x_frame, y_frame = cam_ctx.roi_processor.convert_roi_to_frame_coords(x, y)
-                # 寬高不變
-                cx, cy = cam_ctx.roi_processor.convert_roi_to_frame_coords(cx, cy)
-                bbox = [int(x_frame), int(y_frame), int(w), int(h)]
-            else:
-                bbox = [int(x), int(y), int(w), int(h)]
-            
-            # 檢查類別 ID 是否在有效範圍內
-            if classid < 0 or classid >= len(class_names):
-                # 跳過不在定義類別範圍內的偵測
-                # 這可能發生在使用預訓練模型（如 COCO）或類別不匹配的模型時
-                if cam_ctx.frame_index % 100 == 0:  # 每 100 幀警告一次，避免日誌過多
-                    print(f"[警告] {cam_ctx.name}: 偵測到類別 ID {classid} 超出範圍 (0-{len(class_names)-1})。")
-                    print(f"       這可能是因為使用了預訓練模型（COCO 有80類）而非糖果專用模型（2類）。")
-                    print(f"       建議切換到 runs/detect/.../weights/best.pt 等訓練好的模型。")
-                continue
-            
-            label = class_names[classid]
-            
-            # 額外檢測：只對 NORMAL 進行檢測，ABNORMAL 不會被改變
-            if label == CLASS_NORMAL:
-                # 黑點檢測（優先）
-                if enable_black_spot and detect_black_spots(frame, bbox, threshold=black_spot_threshold, debug=False):
-                    label = CLASS_ABNORMAL
-                    if cam_ctx.frame_index % 30 == 0:
-                        print(f"[{cam_ctx.name}] 黑點檢測: 發現黑點，改判為 ABNORMAL")
-                # 顏色檢測（其次）
-                elif enable_color and detect_color_abnormality(frame, bbox, threshold=color_threshold, debug=False):
-                    label = CLASS_ABNORMAL
-                    if cam_ctx.frame_index % 30 == 0:
-                        print(f"[{cam_ctx.name}] 顏色檢測: 顏色異常（非亮黃色），改判為 ABNORMAL")
-            # 如果模型已判定為 ABNORMAL，則保持不變，不再進行額外檢測
-            
-            detections.append({'center': (cx, cy), 'label': label, 'score': score, 'bbox': bbox})
+    # 檢查類別 ID 是否在有效範圍內
+    # 這可能發生在使用預訓練模型（如 COCO）或類別不匹配的模型時
+    if len(invalid_ids) and cam_ctx.frame_index % 100 == 0:  # 每 100 幀警告一次，避免日誌過多
+        print(f"[警告] {cam_ctx.name}: 偵測到類別 ID {invalid_ids.tolist()} 超出範圍 (0-{len(class_names)-1})。")
+        print(f"       這可能是因為使用了預訓練模型（COCO 有80類）而非糖果專用模型（2類）。")
+        print(f"       建議切換到 runs/detect/.../weights/best.pt 等訓練好的模型。")
+
+    detections = []
+    # 逐欄轉為 Python 原生型別（結構化陣列的子陣列欄位 tolist() 仍是 ndarray）
+    for classid, score, bbox, center in zip(
+        filtered['classid'].tolist(),
+        filtered['score'].tolist(),
+        filtered['bbox'].tolist(),
+        filtered['center'].tolist(),
+    ):
+        label = class_names[classid]
+        detections.append({
+            'center': tuple(center),
+            'label': label,
+            'score': score,
+            'bbox': bbox,
+            'rule': RULE_MODEL if label == CLASS_ABNORMAL else RULE_NONE,
+        })
+
+    now = time.perf_counter()
+    metrics.observe('postprocess', now - stage_start)
+    tracing.complete('postprocess', stage_start, now, cam_ctx.name, {'detections': len(detections)})
+
+    # 額外檢測：只對 NORMAL 進行黑點與顏色檢測（每顆糖果只轉換一次 HSV）
+    stage_start = now
+    hsv_region = None
+    if settings.hsv_mode == 'band':
+        # 偵測線左右各延伸 hsv_band_margin 像素的帶狀區域
+        hsv_region = (
+            min(cam_ctx.line_x1, cam_ctx.line_x2) - settings.hsv_band_margin,
+            0,
+            max(cam_ctx.line_x1, cam_ctx.line_x2) + settings.hsv_band_margin,
+            frame.shape[0],
+        )
+    apply_candy_inspection(
+        cam_ctx, frame, detections,
+        settings.enable_black_spot, settings.black_spot_threshold, settings.enable_color, settings.color_threshold,
+        settings.hsv_mode, hsv_region,
+    )
+    now = time.perf_counter()
+    if settings.enable_black_spot or settings.enable_color:
+        metrics.observe('color_check', now - stage_start)
+        tracing.complete('color_check', stage_start, now, cam_ctx.name)
     
     # 更新追蹤物體（在繪製之前）
-    remaining = detections[:]
-    for track in cam_ctx.tracking_objects.values():
-        best_det = None
-        best_dist = TRACK_DISTANCE_THRESHOLD_PX
-        for det in remaining:
-            distance = math.hypot(track.center[0] - det['center'][0], track.center[1] - det['center'][1])
-            if distance < best_dist:
-                best_dist = distance
-                best_det = det
-
-        if best_det:
-            track.prev_center = track.center
-            track.center = best_det['center']
-            track.bbox = best_det['bbox']  # 保存邊界框
-            track.score = best_det['score']  # 保存信心分數
-            
-            # 關鍵修復：一旦標記為 abnormal，永遠保持 abnormal
-            if best_det['label'] == CLASS_ABNORMAL or best_det['label'] == 'abnormal':
-                track.seen_abnormal = True
-                track.last_class = CLASS_ABNORMAL
-            elif not track.seen_abnormal:
-                # 只有當從未見過 abnormal 時，才更新為 normal
-                track.last_class = best_det['label']
-            else:
-                # 如果 track.seen_abnormal 已經是 True，強制保持為 abnormal
-                track.last_class = CLASS_ABNORMAL
-            
-            track.missed_frames = 0
-            remaining.remove(best_det)
-        else:
-            track.missed_frames += 1
-        track.age += 1
+    stage_start = now
+    # 追蹤表以欄位陣列保存，所有使用中的列一次取出
+    table = cam_ctx.tracking_objects
+    slots = table.slots()
+    track_ids = table.track_id[slots].tolist()
+    predicted = table.center[slots].astype(np.float64)
+    match_distance = TRACK_DISTANCE_THRESHOLD_PX
+
+    # 卡爾曼濾波：所有追蹤物體一次預測，以預測位置配對（可使用較小的配對距離）
+    kalman = None
+    if cam_ctx.use_kalman:
+        if cam_ctx.kalman_tracker is None:
+            cam_ctx.kalman_tracker = BatchKalmanTracker()
+        kalman = cam_ctx.kalman_tracker
+        if len(kalman) != len(slots):
+            # 追蹤表被外部清除（例如重置計數）或濾波器剛建立時同步
+            kalman.retain(track_ids)
+            for track_id, center in zip(track_ids, table.center[slots].tolist()):
+                if track_id not in kalman:
+                    kalman.add(track_id, center)
+        kalman.predict()
+        kalman_rows = kalman.rows(track_ids)
+        predicted = kalman.positions(kalman_rows)
+        match_distance = settings.kalman_match_distance
+
+    # 網格索引只比對鄰近的追蹤物體與偵測結果，並依距離由近到遠配對
+    det_centers = [det['center'] for det in detections]
+    matches = associate(
+        [tuple(center) for center in predicted.tolist()],
+        det_centers,
+        match_distance,
+    )
+
+    label_ids = {name: idx for idx, name in enumerate(class_names)}
+    det_abnormal = np.array([det['label'] == CLASS_ABNORMAL for det in detections], dtype=bool)
+    det_rules = np.array([det.get('rule', RULE_NONE) for det in detections], dtype=np.uint8)
+    matched_dets = set()
+    matched_rows = None
+    if matches:
+        match_track_idx = np.fromiter((track_idx for track_idx, _ in matches), dtype=np.intp, count=len(matches))
+        match_det_idx = np.fromiter((det_idx for _, det_idx in matches), dtype=np.intp, count=len(matches))
+        matched_dets = set(match_det_idx.tolist())
+        m_slots = slots[match_track_idx]
+        new_centers = np.array([det_centers[det_idx] for det_idx in match_det_idx.tolist()], dtype=np.float64)
+
+        # 配對成功的追蹤物體以測量值一次更新濾波器，位置改用濾波後的估計值
+        if kalman is not None:
+            matched_rows = kalman_rows[match_track_idx]
+            kalman.update(matched_rows, new_centers)
+            new_centers = kalman.positions(matched_rows)
+
+        table.prev_center[m_slots] = table.center[m_slots]
+        table.center[m_slots] = np.rint(new_centers)
+        table.bbox[m_slots] = [detections[det_idx]['bbox'] for det_idx in match_det_idx.tolist()]
+        table.score[m_slots] = [detections[det_idx]['score'] for det_idx in match_det_idx.tolist()]
+        table.max_score[m_slots] = np.maximum(table.max_score[m_slots], table.score[m_slots])
+        table.classid[m_slots] = [label_ids.get(detections[det_idx]['label'], 0) for det_idx in match_det_idx.tolist()]
+        # 關鍵修復：一旦標記為 abnormal，永遠保持 abnormal（flag 只設定不清除）
+        table.set_flag(m_slots[det_abnormal[match_det_idx]], TrackTable.FLAG_SEEN_ABNORMAL)
+        # 判定規則記錄第一次判定 abnormal 的檢測項目
+        table.rule[m_slots] = np.where(table.rule[m_slots] == RULE_NONE, det_rules[match_det_idx], table.rule[m_slots])
+        table.missed[m_slots] = 0
+
+        # 以配對成功的位移估計輸送帶速度（決定帶狀裁切的寬度）
+        if cam_ctx.band_cropper is not None:
+            cam_ctx.band_cropper.update_speed(
+                (table.center[m_slots, 0] - table.prev_center[m_slots, 0]).tolist()
+            )
 
-    for det in remaining:
-        # 創建新追蹤物體，確保 seen_abnormal 和 last_class 一致
-        is_abnormal = (det['label'] == CLASS_ABNORMAL or det['label'] == 'abnormal')
+    unmatched = np.ones(len(slots), dtype=bool)
+    if matches:
+        unmatched[match_track_idx] = False
+    u_slots = slots[unmatched]
+    table.missed[u_slots] += 1
+    # 短暫漏檢（或動態閘門略過推論）時沿預測位置前進，過線判斷仍然有效
+    if kalman is not None:
+        coast = unmatched & (table.missed[slots] <= settings.kalman_max_coast_frames)
+        c_slots = slots[coast]
+        table.prev_center[c_slots] = table.center[c_slots]
+        table.center[c_slots] = np.rint(predicted[coast])
+    table.age[slots] += 1
+
+    # 新追蹤物體以本幀配對成功的追蹤物體速度中位數作為初始速度（同一條輸送帶速度相近）
+    initial_velocity = None
+    if matched_rows is not None:
+        initial_velocity = tuple(np.median(kalman.velocities(matched_rows), axis=0).tolist())
+
+    # 初始化 abnormal 記憶（用於記錄最近被移除的 abnormal track）
+    if not hasattr(cam_ctx, 'recent_abnormals'):
+        # 60 FPS 下保留最近 60 幀內、最多 60 筆記錄；物體移動快，繼承距離擴大到 400 像素
+        cam_ctx.recent_abnormals = RecentAbnormals(radius=400, max_age_frames=60, max_records=60)
+
+    for det_idx, det in enumerate(detections):
+        if det_idx in matched_dets:
+            continue
+        # 創建新追蹤物體
+        is_abnormal = bool(det_abnormal[det_idx])
+        rule = int(det_rules[det_idx])
         
         # 檢查是否在最近 abnormal track 附近（防止快速移動物體丟失後重新檢測為 normal）
-        if not is_abnormal and hasattr(cam_ctx, 'recent_abnormals'):
-            for (old_center, old_frame) in cam_ctx.recent_abnormals:
-                # 60 FPS 下檢查最近 60 幀內的記錄（約1秒）
-                if cam_ctx.frame_index - old_frame > 60:
-                    continue
-                # 計算距離
-                distance = math.hypot(det['center'][0] - old_center[0], det['center'][1] - old_center[1])
-                # 60 FPS 下物體移動更快，擴大到 400 像素
-                if distance < 400:
-                    is_abnormal = True
-                    print(f"[{cam_ctx.name}] 檢測到新物體靠近先前的 abnormal (距離: {distance:.0f}px)，繼承 abnormal 狀態")
-                    break
+        if not is_abnormal and len(cam_ctx.recent_abnormals):
+            distance = cam_ctx.recent_abnormals.find_near(det['center'], cam_ctx.frame_index)
+            if distance is not None:
+                is_abnormal = True
+                rule = RULE_INHERITED
+                print(f"[{cam_ctx.name}] 檢測到新物體靠近先前的 abnormal (距離: {distance:.0f}px)，繼承 abnormal 狀態")
         
-        new_track = TrackState(
-            center=det['center'],
-            prev_center=det['center'],
+        table.add(
+            cam_ctx.track_id,
+            det['center'],
+            det['bbox'],
+            det['score'],
+            label_ids.get(det['label'], 0),
             seen_abnormal=is_abnormal,
-            last_class=CLASS_ABNORMAL if is_abnormal else CLASS_NORMAL,
+            rule=rule,
         )
-        # 保存邊界框和分數到追蹤物體
-        new_track.bbox = det['bbox']
-        new_track.score = det['score']
-        cam_ctx.tracking_objects[cam_ctx.track_id] = new_track
+        if kalman is not None:
+            kalman.add(cam_ctx.track_id, det['center'], initial_velocity)
         cam_ctx.track_id += 1
+
+    slots = table.slots()
+    seen_abnormal = table.has_flag(slots, TrackTable.FLAG_SEEN_ABNORMAL)
+    now = time.perf_counter()
+    tracking_time = now - stage_start
+    tracing.complete('tracking', stage_start, now, cam_ctx.name)
     
     # 繪製標註：只繪製當前有檢測匹配的追蹤物體（避免殘影）
+    stage_start = now
     if draw_annotations:
-        for track_id, track in cam_ctx.tracking_objects.items():
-            # 只繪製當前幀有匹配到檢測的追蹤物體（missed_frames == 0）
-            if track.missed_frames > 0:
-                continue
-                
-            # 使用追蹤物體的 last_class（已經過 abnormal 保護）
-            label = track.last_class
-            score = getattr(track, 'score', 0.0)
-            bbox = getattr(track, 'bbox', None)
-            
-            if bbox is None:
-                continue
-                
-            classid = class_names.index(label) if label in class_names else 0
+        visible = table.missed[slots] == 0
+        for slot, abnormal in zip(slots[visible].tolist(), seen_abnormal[visible].tolist()):
+            # 已判定為 abnormal 的追蹤物體一律以 abnormal 顯示
+            label = CLASS_ABNORMAL if abnormal else class_names[table.classid[slot]]
+            classid = label_ids.get(label, 0)
             color = colors[classid % len(colors)]
-            text_label = f"{label}: {score:.2f}"
+            text_label = f"{label}: {table.score[slot]:.2f}"
             
             # 繪製邊界框
-            x, y, w, h = bbox
-            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+            x, y, w, h = table.bbox[slot].tolist()
+            cv2.rectangle(display, (x, y), (x + w, y + h), color, 2)
             cv2.putText(
-                frame,
+                display,
                 text_label,
                 (x, max(20, y - 10)),
                 cv2.FONT_HERSHEY_SIMPLEX,
@@ -854,11 +914,11 @@ def process_camera_frame(
             )
             
             # 繪製追蹤點和 ID
-            pt = track.center
-            cv2.circle(frame, pt, 5, color, -1)
+            pt = tuple(table.center[slot].tolist())
+            cv2.circle(display, pt, 5, color, -1)
             cv2.putText(
-                frame,
-                str(track_id),
+                display,
+                str(table.track_id[slot]),
                 (pt[0], pt[1] - 7),
                 cv2.FONT_HERSHEY_SIMPLEX,
                 0.5,
@@ -866,70 +926,102 @@ def process_camera_frame(
                 2,
             )
 
-    line_mid = (cam_ctx.line_x1 + cam_ctx.line_x2) // 2
-    to_remove = []
-    
-    # 初始化 abnormal 記憶列表（用於記錄最近被移除的 abnormal track）
-    if not hasattr(cam_ctx, 'recent_abnormals'):
-        cam_ctx.recent_abnormals = []  # 格式: [(center, frame_index), ...]
-    
-    for track_id, track in cam_ctx.tracking_objects.items():
-        if track.missed_frames > MAX_MISSED_FRAMES:
-            # 如果是 abnormal track，記錄它的最後位置和時間
-            if track.seen_abnormal:
-                cam_ctx.recent_abnormals.append((track.center, cam_ctx.frame_index))
-                # 60 FPS 下保留最近 60 個 abnormal records（約 1 秒內的記錄）
-                if len(cam_ctx.recent_abnormals) > 60:
-                    cam_ctx.recent_abnormals.pop(0)
-            to_remove.append(track_id)
-            continue
+    now = time.perf_counter()
+    drawing_time += now - stage_start
+    tracing.complete('drawing', stage_start, now, cam_ctx.name)
 
-        prev_x = track.prev_center[0]
-        curr_x = track.center[0]
-        # 檢查是否真的穿越偵測線（前一幀在線的一側，當前幀在另一側）
-        crossed = (prev_x < line_mid <= curr_x) or (prev_x > line_mid >= curr_x)
-        
-        # 只有在真正穿越偵測線時才計數，移除靜止物體誤計數的問題
-        if not track.counted and crossed:
-            track.counted = True
-            cam_ctx.total_num += 1
-            # 關鍵修復：使用 seen_abnormal 來判斷，而不是 last_class
-            if track.seen_abnormal:
-                cam_ctx.abnormal_num += 1
-                if not track.triggered:
-                    track.triggered = True
-                    # 檢查是否暫停噴氣
-                    if not getattr(cam_ctx, 'relay_paused', False):
-                        threading.Thread(
-                            target=trigger_relay,
-                            args=(cam_ctx.relay_url, cam_ctx.relay_delay_ms, cam_ctx.relay_duration_ms),
-                            daemon=True,
-                        ).start()
-                    else:
-                        print(f"[{cam_ctx.name}] 檢測到異常但噴氣已暫停，略過觸發")
-            else:
-                cam_ctx.normal_num += 1
+    # 過期：如果是 abnormal track，記錄它的最後位置和時間
+    stage_start = now
+    expired = table.missed[slots] > MAX_MISSED_FRAMES
+    for center in table.center[slots[expired & seen_abnormal]].tolist():
+        cam_ctx.recent_abnormals.add(tuple(center), cam_ctx.frame_index)
 
-        if not (0 <= track.center[0] <= cam_ctx.frame_width and 0 <= track.center[1] <= cam_ctx.frame_height):
-            track.missed_frames += 1
+    # 檢查是否真的穿越偵測線（前一幀在線的一側，當前幀在另一側），移除靜止物體誤計數的問題
+    line_mid = (cam_ctx.line_x1 + cam_ctx.line_x2) // 2
+    prev_x = table.prev_center[slots, 0]
+    curr_x = table.center[slots, 0]
+    crossed = ((prev_x < line_mid) & (line_mid <= curr_x)) | ((prev_x > line_mid) & (line_mid >= curr_x))
+    crossed &= ~expired & ~table.has_flag(slots, TrackTable.FLAG_COUNTED)
+    if crossed.any():
+        table.set_flag(slots[crossed], TrackTable.FLAG_COUNTED)
+        # 關鍵修復：使用 seen_abnormal 來判斷，而不是 last_class
+        crossed_abnormal = crossed & seen_abnormal
+        cam_ctx.total_num += int(np.count_nonzero(crossed))
+        cam_ctx.abnormal_num += int(np.count_nonzero(crossed_abnormal))
+        cam_ctx.normal_num += int(np.count_nonzero(crossed & ~seen_abnormal))
+
+        to_trigger = crossed_abnormal & ~table.has_flag(slots, TrackTable.FLAG_TRIGGERED)
+        table.set_flag(slots[to_trigger], TrackTable.FLAG_TRIGGERED)
+        relay_fired = np.zeros(len(slots), dtype=bool)
+        for i in np.flatnonzero(to_trigger).tolist():
+            # 檢查是否暫停噴氣
+            if getattr(cam_ctx, 'relay_paused', False):
+                print(f"[{cam_ctx.name}] 檢測到異常但噴氣已暫停，略過觸發")
+            elif cam_ctx.relay_scheduler is not None:
+                # 延遲從畫面擷取時間起算，扣除抓取排隊與推論已花掉的時間
+                relay_fired[i] = cam_ctx.relay_scheduler.schedule(
+                    cam_ctx.last_capture_ts or time.monotonic(),
+                    cam_ctx.relay_delay_ms,
+                    cam_ctx.relay_duration_ms,
+                    cam_ctx.relay_url,
+                ) is not None
+            else:
+                threading.Thread(
+                    target=trigger_relay,
+                    args=(cam_ctx.relay_url, cam_ctx.relay_delay_ms, cam_ctx.relay_duration_ms),
+                    daemon=True,
+                ).start()
+                relay_fired[i] = bool(cam_ctx.relay_url)
+
+        # 事件記錄：只排入佇列，由背景執行緒批次寫入
+        if cam_ctx.event_log is not None:
+            c_slots = slots[crossed]
+            capture_age = time.monotonic() - cam_ctx.last_capture_ts if cam_ctx.last_capture_ts else 0.0
+            cam_ctx.event_log.record(
+                cam_ctx.name,
+                table.track_id[c_slots],
+                table.max_score[c_slots],
+                [CLASS_ABNORMAL if abnormal else class_names[classid]
+                 for abnormal, classid in zip(seen_abnormal[crossed].tolist(), table.classid[c_slots].tolist())],
+                np.where(seen_abnormal[crossed], table.rule[c_slots], RULE_NONE),
+                relay_fired[crossed],
+                ts=time.time() - capture_age,
+            )
 
-    for track_id in to_remove:
-        cam_ctx.tracking_objects.pop(track_id, None)
+    # 離開畫面的追蹤物體加速過期
+    cx = table.center[slots, 0]
+    cy = table.center[slots, 1]
+    outside = ~expired & ~((0 <= cx) & (cx <= cam_ctx.frame_width) & (0 <= cy) & (cy <= cam_ctx.frame_height))
+    table.missed[slots[outside]] += 1
+
+    if expired.any():
+        if kalman is not None:
+            for track_id in table.track_id[slots[expired]].tolist():
+                kalman.remove(track_id)
+        table.remove(slots[expired])
+    now = time.perf_counter()
+    metrics.observe('tracking', tracking_time + now - stage_start)
+    tracing.complete('counting', stage_start, now, cam_ctx.name)
 
     # 繪製偵測線
-    cv2.line(frame, (cam_ctx.line_x1, 0), (cam_ctx.line_x1, cam_ctx.frame_height), (200, 100, 0), 2)
-    cv2.line(frame, (cam_ctx.line_x2, 0), (cam_ctx.line_x2, cam_ctx.frame_height), (200, 100, 0), 2)
-
-    cv2.putText(frame, cam_ctx.name, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (255, 255, 255), 2)
-    cv2.putText(frame, f'Time: {elapsed_time:.1f}s', (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
-    cv2.putText(frame, f'Total: {cam_ctx.total_num}', (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
-    cv2.putText(frame, f'Normal: {cam_ctx.normal_num}', (20, 160), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
-    cv2.putText(frame, f'Abnormal: {cam_ctx.abnormal_num}', (20, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 200), 2)
-
-    # 保存處理後的畫面到緩存
-    cam_ctx.latest_processed_frame = frame.copy()
+    stage_start = now
+    cv2.line(display, (cam_ctx.line_x1, 0), (cam_ctx.line_x1, cam_ctx.frame_height), (200, 100, 0), 2)
+    cv2.line(display, (cam_ctx.line_x2, 0), (cam_ctx.line_x2, cam_ctx.frame_height), (200, 100, 0), 2)
+
+    cv2.putText(display, cam_ctx.name, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (255, 255, 255), 2)
+    cv2.putText(display, f'Time: {elapsed_time:.1f}s', (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
+    cv2.putText(display, f'Total: {cam_ctx.total_num}', (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
+    cv2.putText(display, f'Normal: {cam_ctx.normal_num}', (20, 160), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 200, 0), 2)
+    cv2.putText(display, f'Abnormal: {cam_ctx.abnormal_num}', (20, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 200), 2)
+    now = time.perf_counter()
+    metrics.observe('drawing', drawing_time + now - stage_start)
+    tracing.complete('drawing', stage_start, now, cam_ctx.name)
+    tracing.complete('frame', frame_start, now, cam_ctx.name, {'frame_index': cam_ctx.frame_index})
+
+    # 保存畫面到緩存（供串流、錄影預覽等功能以引用共用，不另外複製）
+    cam_ctx.set_latest_frames(raw_handle, cam_ctx.display_pool.wrap(display))
     
-    return frame
+    return display
 
 def main(camera_sections: list[str]) -> None:
     """主偵測流程，可同時處理多個攝影機"""
@@ -939,11 +1031,6 @@ def main(camera_sections: list[str]) -> None:
     display_height = config.getint('Display', 'target_height', fallback=DEFAULT_DISPLAY_HEIGHT)
     max_display_width = config.getint('Display', 'max_width', fallback=0)
 
-    # 優化設置
-    use_multi_scale = config.getint('Detection', 'use_multi_scale', fallback=0) == 1
-    multi_scale_str = config.get('Detection', 'multi_scale_factors', fallback='0.75,1.0,1.25')
-    multi_scale_factors = [float(x.strip()) for x in multi_scale_str.split(',')]
-    
     # 獲取模型類型
     model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
     
@@ -951,11 +1038,22 @@ def main(camera_sections: list[str]) -> None:
     colors = [(0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 255, 0)]
     
     # 初始化多尺度檢測器
-    multi_scale_detector = MultiScaleDetector(multi_scale_factors) if use_multi_scale else None
+    multi_scale_detector = create_multi_scale_detector(config)
     
+    # 偵測設定快照（整個執行期間共用，避免每幀查詢 configparser）
+    settings = DetectionSettings.from_config(config)
+
     # 初始化性能監控
     perf_monitor = PerformanceMonitor(window_size=30)
 
+    # 追蹤模式（[Tracing] enabled=1 時結束後將紀錄寫到 logs/trace-*.json）
+    tracing.configure(config)
+
+    # 糖果事件記錄（每顆過線計數的糖果一筆）
+    event_log = EventLog.from_config(config)
+    if event_log is not None:
+        event_log.start()
+
     camera_contexts = []
     for section in camera_sections:
         if section not in config:
@@ -963,15 +1061,21 @@ def main(camera_sections: list[str]) -> None:
             continue
         cam_ctx = create_camera_context(config, section)
         if cam_ctx:
+            cam_ctx.event_log = event_log
             camera_contexts.append(cam_ctx)
 
     if not camera_contexts:
         print("沒有可用攝影機，程式結束。")
+        if event_log is not None:
+            event_log.stop()
         return
 
     window_name = 'Candy Monitor' if len(camera_contexts) > 1 else camera_contexts[0].name
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
     setup_focus_trackbars(window_name, camera_contexts)
+
+    # 每個攝影機一個抓取執行緒，偵測迴圈永遠處理最新畫面
+    frame_reader = MultiThreadedFrameReader(camera_contexts, CAPTURE_RING_BUFFER_SIZE).start()
     start_time = time.time()
 
     try:
@@ -992,6 +1096,7 @@ def main(camera_sections: list[str]) -> None:
                     multi_scale_detector=multi_scale_detector,
                     model_type=model_type,
                     config=config,
+                    settings=settings,
                 )
                 if frame is not None:
                     processed_frames.append(frame)
@@ -1018,8 +1123,15 @@ def main(camera_sections: list[str]) -> None:
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
     finally:
+        frame_reader.stop()
         for cam_ctx in camera_contexts:
             cam_ctx.release()
+        if event_log is not None:
+            event_log.stop()
+        if tracing.is_enabled():
+            trace_path = Path(LOGS_DIR) / f"trace-{time.strftime('%Y%m%d_%H%M%S')}.json"
+            count = tracing.dump(trace_path)
+            print(f"追蹤紀錄已寫入 {trace_path}（{count} 筆，可用 chrome://tracing 或 Perfetto 開啟）")
         cv2.destroyAllWindows()
         print("所有攝影機已關閉。")
 
@@ -30,6 +30,8 @@ class VideoRecorder:
         # 共享攝影機模式
         self.shared_cap = None  # 從 camera_contexts 共享的攝影機
         self.own_cap = None     # 獨立模式下自己開啟的攝影機
+        self.preview_hub = None  # 共享模式下的預覽廣播器
+        self.frame_source = None  # 共享模式下的抓取執行緒（FrameGrabber）
         
         # 錄影狀態
         self.is_recording = False
@@ -350,9 +352,30 @@ class VideoRecorder:
             'message': '錄影已開始'
         }
 
+    def set_frame_source(self, grabber):
+        """設定共享抓取執行緒，錄影時從其環形緩衝區取畫面而非直接讀取攝影機"""
+        self.frame_source = grabber
+
     def _recording_loop(self):
         """錄影迴圈"""
+        last_seq = 0
         while not self._stop_event.is_set() and self.is_recording:
+            grabber = self.frame_source
+            if grabber is not None and not grabber.stopped:
+                # 共享模式：每輪寫入抓取執行緒緩衝區內最新且尚未寫過的畫面（約 30 FPS）
+                new_frames = grabber.read_since(last_seq)
+                try:
+                    if new_frames and self.writer is not None:
+                        last_seq, _, handle = new_frames[-1]
+                        self.writer.write(handle.array)
+                        self.frame_count += 1
+                finally:
+                    # 緩衝區畫面以引用共用，寫完即釋放
+                    for _, _, handle in new_frames:
+                        handle.release()
+                time.sleep(0.033)
+                continue
+
             cap = self._get_cap()
             if cap is None:
                 break
@@ -417,73 +440,61 @@ class VideoRecorder:
             'focus': self.get_focus()
         }
 
+    def set_preview_hub(self, hub):
+        """設定共享預覽廣播器（由偵測系統提供原始畫面並統一編碼）"""
+        self.preview_hub = hub
+        if hub is not None:
+            hub.annotate = self._draw_preview_overlay
+
+    def _draw_preview_overlay(self, frame):
+        """在預覽畫面上繪製錄影狀態與資訊覆蓋層"""
+        # 加入錄影狀態提示
+        if self.is_recording:
+            cv2.circle(frame, (30, 30), 15, (0, 0, 255), -1)
+            duration = time.time() - self.start_time if self.start_time else 0
+            text = f"REC {int(duration)}s"
+            cv2.putText(frame, text, (55, 38), cv2.FONT_HERSHEY_SIMPLEX, 
+                       0.8, (0, 0, 255), 2)
+        
+        # 焦距模式
+        focus_text = f"AF" if self.auto_focus else f"MF:{self.focus_value}"
+        cv2.putText(frame, focus_text, (10, frame.shape[0] - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        # 解析度資訊
+        res_text = f"{frame.shape[1]}x{frame.shape[0]}"
+        cv2.putText(frame, res_text, (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
     def generate_preview_stream(self):
-        """產生預覽串流 - 使用共享攝影機的緩存畫面"""
+        """產生預覽串流 - 共享模式下訂閱偵測系統的預覽廣播器"""
         self.is_previewing = True
         
-        # 檢查是否有共享攝影機
-        if self.shared_cap is None:
-            # 沒有共享攝影機，嘗試開啟獨立攝影機
-            if self.open_own_camera():
-                cap = self.own_cap
-                print(f"[錄影器 {self.camera_index}] 使用獨立攝影機模式")
-            else:
-                # 無法開啟攝影機，產生錯誤畫面
-                while self.is_previewing:
-                    error_frame = self._create_error_frame("無法連接攝影機\n請確認主系統已啟動")
-                    ret, buffer = cv2.imencode('.jpg', error_frame)
-                    if ret:
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-                    time.sleep(0.5)
-                return
+        # 共享模式：所有預覽客戶端共用廣播器編碼好的同一份 JPEG
+        if self.preview_hub is not None:
+            print(f"[錄影器 {self.camera_index}] 使用共享攝影機模式（訂閱預覽廣播器）")
+            yield from self.preview_hub.subscribe(lambda: self.is_previewing)
+            return
         
-        print(f"[錄影器 {self.camera_index}] 使用共享攝影機模式（從緩存讀取）")
+        # 沒有共享畫面來源，嘗試開啟獨立攝影機
+        if not self.open_own_camera() or self.own_cap is None:
+            # 無法開啟攝影機，產生錯誤畫面
+            while self.is_previewing:
+                error_frame = self._create_error_frame("無法連接攝影機\n請確認主系統已啟動")
+                ret, buffer = cv2.imencode('.jpg', error_frame)
+                if ret:
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+                time.sleep(0.5)
+            return
         
-        # 開始串流 - 從共享攝影機的緩存中讀取
-        # 開始串流 - 從共享攝影機的緩存中讀取
+        print(f"[錄影器 {self.camera_index}] 使用獨立攝影機模式")
+        frame = None
         while self.is_previewing:
-            frame = None
-            
-            # 優先從共享攝影機的緩存中取得畫面
-            if self.shared_cap is not None:
-                # 從 camera_contexts 取得緩存的畫面
-                try:
-                    from web_app import camera_contexts
-                    if self.camera_index < len(camera_contexts):
-                        cam_ctx = camera_contexts[self.camera_index]
-                        # 使用緩存的原始畫面（未處理的畫面）
-                        if cam_ctx.latest_frame is not None:
-                            frame = cam_ctx.latest_frame.copy()
-                except Exception as e:
-                    print(f"[錄影器 {self.camera_index}] 無法從緩存取得畫面: {e}")
-            
-            # 如果沒有緩存畫面，使用獨立攝影機讀取
-            if frame is None and self.own_cap is not None:
-                ret, frame = self.own_cap.read()
-                if not ret:
-                    frame = None
-            
-            if frame is not None:
-                # 加入錄影狀態提示
-                if self.is_recording:
-                    cv2.circle(frame, (30, 30), 15, (0, 0, 255), -1)
-                    duration = time.time() - self.start_time if self.start_time else 0
-                    text = f"REC {int(duration)}s"
-                    cv2.putText(frame, text, (55, 38), cv2.FONT_HERSHEY_SIMPLEX, 
-                               0.8, (0, 0, 255), 2)
-                
-                # 顯示資訊覆蓋層
-                # 焦距模式
-                focus_text = f"AF" if self.auto_focus else f"MF:{self.focus_value}"
-                cv2.putText(frame, focus_text, (10, frame.shape[0] - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                
-                # 解析度資訊
-                res_text = f"{frame.shape[1]}x{frame.shape[0]}"
-                cv2.putText(frame, res_text, (10, 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
+            # 重複使用同一個畫面陣列，不逐幀配置新記憶體
+            ret, frame = self.own_cap.read(image=frame) if frame is not None else self.own_cap.read()
+            if ret:
+                self._draw_preview_overlay(frame)
                 # 使用更高的 JPEG 品質以獲得更清晰的預覽
                 ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
                 if ret:
@@ -9,10 +9,10 @@ import cv2
 import time
 import threading
 import json
-import sqlite3
 import io
 import csv
-from datetime import datetime, timedelta
+import zlib
+from datetime import datetime
 from pathlib import Path
 import numpy as np
 import subprocess
@@ -24,10 +24,12 @@ import send2trash
 _project_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(_project_root))
 
-from candy_detector.config import ConfigManager
+from candy_detector.config import ConfigManager, DetectionSettingsHolder
 from candy_detector.models import CameraContext, TrackState
+from candy_detector.streaming import FrameBroadcaster
 from candy_detector.constants import (
     PROJECT_ROOT,
+    CAPTURE_RING_BUFFER_SIZE,
     TRACK_DISTANCE_THRESHOLD_PX,
     MAX_MISSED_FRAMES,
     CLASS_NORMAL,
@@ -39,7 +41,14 @@ progress_tracker = {}
 from candy_detector.logger import get_logger, setup_logger, APP_LOG_FILE
 from src.video_recorder import VideoRecorder, get_recorder, cleanup_all as cleanup_recorders
 from src.run_detector import trigger_relay
+from candy_detector.relay import RelayScheduler
+from candy_detector.inference import InferenceService
+from candy_detector.events import RULE_NAMES, EventLog
+from candy_detector import tracing
+from candy_detector.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS_REGISTRY, camera_metrics
+from candy_detector.storage import RESOLUTIONS, DetectionStore, history_query, history_record, pick_resolution
 import src.yolov8_trainer as trainer
+from utils.performance_optimizer import MultiThreadedFrameReader
 
 # 初始化 Flask（指定模板和靜態檔案路徑）
 app = Flask(
@@ -79,63 +88,54 @@ db_path = Path(PROJECT_ROOT) / "detection_data.db"
 lock = threading.Lock()
 model_lock = threading.Lock()  # 模型檢測鎖，防止多線程衝突
 is_running = False
+frame_reader = None  # 攝影機抓取執行緒管理器
+inference_service = None  # YOLOv8 跨攝影機批次推論服務
+settings_holder = None  # 偵測設定快照（/api/config 或設定檔變更時整個替換）
+detection_store = None  # SQLite 寫入執行緒與唯讀連線池
+event_log = None  # 糖果事件記錄（[EventLog] enabled=0 時保持 None）
 current_model_path = None  # 當前使用的模型路徑
 current_custom_images_path = None  # 當前自定義圖片路徑
 
 
-def init_database():
-    """初始化 SQLite 資料庫與索引"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            camera_name TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            total_count INTEGER DEFAULT 0,
-            normal_count INTEGER DEFAULT 0,
-            abnormal_count INTEGER DEFAULT 0
-        )
-        """
-    )
+def get_store():
+    """取得（必要時建立並啟動）偵測記錄儲存"""
+    global detection_store, config_manager
+    with lock:
+        if detection_store is None:
+            if config_manager is None:
+                config_manager = ConfigManager()
+            detection_store = DetectionStore(
+                db_path,
+                batch_size=config_manager.getint('Database', 'batch_size', fallback=500),
+                flush_interval=config_manager.getint('Database', 'flush_interval_ms', fallback=500) / 1000.0,
+                read_pool_size=config_manager.getint('Database', 'read_pool_size', fallback=4),
+            )
+        return detection_store.start()
 
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS defect_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            camera_name TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            image_path TEXT,
-            confidence REAL
-        )
-        """
-    )
 
-    # 建立查詢加速索引（若不存在）
-    try:
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections(timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_detections_cam ON detections(camera_name)")
-    except Exception as e:
-        logger.warning(f"建立索引失敗（可忽略）: {e}")
+def get_event_log():
+    """取得（必要時建立並啟動）糖果事件記錄；停用時回傳 None"""
+    global event_log, config_manager
+    with lock:
+        if event_log is None:
+            if config_manager is None:
+                config_manager = ConfigManager()
+            event_log = EventLog.from_config(config_manager)
+            if event_log is None:
+                return None
+        return event_log.start()
+
 
-    conn.commit()
-    conn.close()
+def init_database():
+    """初始化 SQLite 資料庫與索引（WAL 模式，啟動寫入執行緒）"""
+    get_store()
     logger.info("資料庫初始化完成（含索引）")
 
 
 def save_detection_record(camera_name, total, normal, abnormal):
-    """儲存偵測記錄到資料庫"""
+    """排入偵測記錄（由寫入執行緒批次寫入，不阻塞偵測執行緒）"""
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO detections (camera_name, total_count, normal_count, abnormal_count) VALUES (?, ?, ?, ?)",
-            (camera_name, total, normal, abnormal)
-        )
-        conn.commit()
-        conn.close()
+        get_store().save_detection(camera_name, total, normal, abnormal)
     except Exception as e:
         logger.error(f"儲存偵測記錄失敗: {e}")
 
@@ -209,71 +209,177 @@ def initialize_cameras(camera_sections):
                 logger.warning(f"應用焦距設定失敗: {e}")
 
 
-def generate_frames(camera_index=0):
-    """產生影像串流"""
-    global camera_contexts, model, class_names, is_running
+def get_settings_holder():
+    """取得（必要時建立）偵測設定持有者"""
+    global settings_holder, config_manager
+    with lock:
+        if settings_holder is None:
+            if config_manager is None:
+                config_manager = ConfigManager()
+            settings_holder = DetectionSettingsHolder(config_manager)
+            settings_holder.add_listener(apply_detection_settings)
+        return settings_holder
 
-    if camera_index >= len(camera_contexts):
-        return
 
-    cam_ctx = camera_contexts[camera_index]
+def apply_detection_settings(settings):
+    """設定重新載入後更新不經過偵測執行緒的元件"""
+    service = inference_service
+    if service is not None:
+        service.conf_threshold = settings.confidence_threshold
+        service.nms_threshold = settings.nms_threshold
+
+
+def detection_worker(cam_ctx, stop_event):
+    """單一攝影機的偵測執行緒：讀取畫面、偵測、計數、觸發繼電器，並將結果發布到共享槽"""
     config = config_manager.config
-    conf_threshold = config.getfloat('Detection', 'confidence_threshold')
-    nms_threshold = config.getfloat('Detection', 'nms_threshold')
+    holder = get_settings_holder()
     model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
+    # 顏色順序：abnormal=紅色, normal=綠色（對應 classes.txt 的順序）
+    colors = [(0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 0)]
 
     from run_detector import process_camera_frame
     start_time = time.time()
+    last_record_time = start_time
+    last_frame_time = None
+    fps = 0.0
+
+    logger.info(f"{cam_ctx.name} 偵測執行緒已啟動")
+    while not stop_event.is_set():
+        # 暫停期間（例如切換模型）不讀取攝影機
+        if not is_running or model is None or cam_ctx.cap is None:
+            time.sleep(0.05)
+            continue
 
-    while is_running:
         now = time.time()
         elapsed_time = now - start_time
-        # 顏色順序：abnormal=紅色, normal=綠色（對應 classes.txt 的順序）
-        colors = [(0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 0)]
 
-        # �p�G�b暫�ժ�j��?�A��?�N��ܪ���?�ߧY
+        # 暫時隱藏標註框（-1 代表持續隱藏，直到再次切換）
         hide_boxes = False
         hide_until = getattr(cam_ctx, 'hide_boxes_until', 0)
         if hide_until:
             if hide_until < 0:
-                hide_boxes = True  # -1 代表持續隱藏，直到再次切換
+                hide_boxes = True
             else:
                 hide_boxes = now < hide_until
                 if not hide_boxes:
                     cam_ctx.hide_boxes_until = 0
 
-        frame = process_camera_frame(
-            cam_ctx,
-            model,
-            class_names,
-            colors,
-            conf_threshold,
-            nms_threshold,
-            elapsed_time,
-            draw_annotations=not hide_boxes,
-            model_lock=model_lock,
-            model_type=model_type,
-            config=config,
-        )
+        # 每幀取一次設定快照，重新載入後下一幀即生效
+        settings = holder.current
+        try:
+            frame = process_camera_frame(
+                cam_ctx,
+                model,
+                class_names,
+                colors,
+                settings.confidence_threshold,
+                settings.nms_threshold,
+                elapsed_time,
+                draw_annotations=not hide_boxes,
+                model_lock=model_lock,
+                model_type=model_type,
+                config=config,
+                inference_service=inference_service,
+                settings=settings,
+            )
+        except Exception as e:
+            logger.error(f"{cam_ctx.name} 偵測處理失敗: {e}", exc_info=True)
+            time.sleep(0.1)
+            continue
 
-        if frame is not None:
-            # 每 10 秒儲存一次記錄
-            if int(elapsed_time) % 10 == 0 and cam_ctx.frame_index % 300 == 0:
-                save_detection_record(
-                    cam_ctx.name,
-                    cam_ctx.total_num,
-                    cam_ctx.normal_num,
-                    cam_ctx.abnormal_num
-                )
+        if frame is None:
+            # 讀取失敗時稍作等待，避免空轉
+            time.sleep(0.01)
+            continue
+
+        frame_time = time.time()
+        if last_frame_time is not None:
+            instant_fps = 1.0 / max(frame_time - last_frame_time, 1e-6)
+            fps = instant_fps if fps == 0.0 else fps * 0.9 + instant_fps * 0.1
+        last_frame_time = frame_time
+
+        stats = cam_ctx.get_stats()
+        stats['fps'] = round(fps, 1)
+        stats['frame_index'] = cam_ctx.frame_index
+        # 共享槽取得兩張畫面的引用，串流與錄影預覽直接讀取，不複製畫面
+        cam_ctx.frame_slot.publish(cam_ctx.latest_processed_frame, raw_frame=cam_ctx.latest_frame, stats=stats)
+
+        # 每 10 秒儲存一次記錄
+        if frame_time - last_record_time >= 10:
+            last_record_time = frame_time
+            save_detection_record(
+                cam_ctx.name,
+                cam_ctx.total_num,
+                cam_ctx.normal_num,
+                cam_ctx.abnormal_num
+            )
 
-            # 編碼為 JPEG
-            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            if ret:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    logger.info(f"{cam_ctx.name} 偵測執行緒已停止")
 
-        time.sleep(0.016)  # 約 60 FPS
+
+def start_detection_worker(cam_ctx):
+    """為攝影機啟動偵測執行緒（已在執行則略過）"""
+    thread = cam_ctx.detection_thread
+    if thread is not None and thread.is_alive():
+        return
+
+    cam_ctx.event_log = get_event_log()
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=detection_worker,
+        args=(cam_ctx, stop_event),
+        name=f"detect-{cam_ctx.name}",
+        daemon=True,
+    )
+    cam_ctx.detection_stop = stop_event
+    cam_ctx.detection_thread = thread
+    thread.start()
+
+
+def stop_detection_worker(cam_ctx, timeout: float = 2.0):
+    """停止攝影機的偵測執行緒並清除共享畫面"""
+    if cam_ctx.detection_stop is not None:
+        cam_ctx.detection_stop.set()
+    thread = cam_ctx.detection_thread
+    if thread is not None and thread is not threading.current_thread():
+        thread.join(timeout=timeout)
+    cam_ctx.detection_thread = None
+    cam_ctx.detection_stop = None
+    cam_ctx.frame_slot.clear()
+
+
+def get_stream_hubs(cam_ctx):
+    """取得（必要時建立）攝影機的串流與錄影預覽廣播器"""
+    with lock:
+        if cam_ctx.stream_hub is None or cam_ctx.preview_hub is None:
+            stream_config = config_manager.get_stream_config()
+            metrics = camera_metrics(cam_ctx.name)
+            cam_ctx.stream_hub = FrameBroadcaster(
+                cam_ctx.frame_slot,
+                jpeg_quality=stream_config['jpeg_quality'],
+                max_width=stream_config['max_width'],
+                encode_histogram=metrics.stage('jpeg_encode'),
+                name=f"{cam_ctx.name}/stream",
+            )
+            cam_ctx.preview_hub = FrameBroadcaster(
+                cam_ctx.frame_slot,
+                raw=True,
+                jpeg_quality=stream_config['preview_jpeg_quality'],
+                max_width=stream_config['preview_max_width'],
+                encode_histogram=metrics.stage('preview_jpeg_encode'),
+                name=f"{cam_ctx.name}/preview",
+            )
+        return cam_ctx.stream_hub, cam_ctx.preview_hub
+
+
+def generate_frames(camera_index=0):
+    """產生影像串流（訂閱廣播器，每個畫面只編碼一次並分送給所有觀看者）"""
+    if camera_index >= len(camera_contexts):
+        return
+
+    cam_ctx = camera_contexts[camera_index]
+    stream_hub, _ = get_stream_hubs(cam_ctx)
+    yield from stream_hub.subscribe(lambda: is_running and cam_ctx in camera_contexts)
 
 
 @app.route('/')
@@ -314,12 +420,15 @@ def get_stats():
     with lock:
         stats = []
         for cam_ctx in camera_contexts:
+            slot_stats = cam_ctx.frame_slot.latest_stats()
             stats.append({
                 'name': cam_ctx.name,
                 'total': cam_ctx.total_num,
                 'normal': cam_ctx.normal_num,
                 'abnormal': cam_ctx.abnormal_num,
-                'defect_rate': round(cam_ctx.abnormal_num / cam_ctx.total_num * 100, 2) if cam_ctx.total_num > 0 else 0
+                'defect_rate': round(cam_ctx.abnormal_num / cam_ctx.total_num * 100, 2) if cam_ctx.total_num > 0 else 0,
+                'fps': slot_stats.get('fps', 0),
+                'relay': cam_ctx.relay_scheduler.get_stats() if cam_ctx.relay_scheduler is not None else {},
             })
         return jsonify(stats)
 
@@ -425,8 +534,7 @@ def switch_model():
                  if Path(cfg_candidate).exists():
                      config_manager.config.set('Paths', 'cfg', cfg_candidate)
             
-            with open('config.ini', 'w', encoding='utf-8') as f:
-                config_manager.config.write(f)
+            config_manager.save()
         except Exception as e:
             logger.warning(f"更新設定檔失敗 (但仍會嘗試切換模型): {e}")
         
@@ -466,10 +574,9 @@ def switch_model():
 def healthz():
     """存活檢查：程序可回應即為健康"""
     try:
-        # 簡單的資料庫探活（不失敗即可）
-        conn = sqlite3.connect(db_path)
-        conn.execute("SELECT 1")
-        conn.close()
+        # 簡單的資料庫探活（不失敗即可）；連線池忙碌時很快回報 degraded，不讓探針卡住
+        with get_store().reader(timeout=1.0) as conn:
+            conn.execute("SELECT 1")
     except Exception as e:
         return jsonify({'status': 'degraded', 'error': str(e)}), 200
 
@@ -483,6 +590,7 @@ def readyz():
         {
             'name': getattr(c, 'name', f'Camera#{i}'),
             'opened': bool(c.cap is not None and getattr(c.cap, 'isOpened', lambda: False)()),
+            'worker_alive': bool(c.detection_thread is not None and c.detection_thread.is_alive()),
             'total': getattr(c, 'total_num', 0),
         }
         for i, c in enumerate(camera_contexts)
@@ -494,83 +602,95 @@ def readyz():
         'model_loaded': model is not None,
         'cameras': cams,
         'is_running': is_running,
+        'batch_inference': inference_service.get_stats() if inference_service is not None else None,
+        'database': detection_store.get_stats() if detection_store is not None else None,
+        'event_log': event_log.get_stats() if event_log is not None else None,
+        # 各階段耗時摘要（毫秒）；完整直方圖見 /metrics
+        'timings': {c.name: c.metrics.summary() for c in camera_contexts if c.metrics is not None},
     }
     return (jsonify(status), 200) if ready else (jsonify(status), 503)
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指標：各攝影機每個處理階段的耗時直方圖、噴氣延遲誤差、丟棄畫面與略過推論次數"""
+    return Response(METRICS_REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/trace', methods=['GET'])
+def export_trace():
+    """
+    下載最近 N 秒的追蹤紀錄（Chrome trace JSON，可用 chrome://tracing 或 ui.perfetto.dev 開啟）
+
+    參數：seconds（預設 10，0 表示緩衝區內全部）
+    """
+    seconds = request.args.get('seconds', default=10.0, type=float)
+    trace = tracing.export(seconds)
+    filename = f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    return Response(
+        json.dumps(trace, ensure_ascii=False),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route('/api/trace', methods=['POST'])
+def set_trace():
+    """
+    啟用或停用追蹤模式
+
+    請求 JSON：{"enabled": true, "buffer_size": 20000, "clear": false}
+    回傳目前的追蹤狀態
+    """
+    data = request.json or {}
+    if data.get('clear'):
+        tracing.clear()
+    if 'enabled' in data:
+        if data['enabled']:
+            tracing.enable(data.get('buffer_size'))
+        else:
+            tracing.disable()
+    stats = tracing.get_stats()
+    logger.info(f"追蹤模式: {'啟用' if stats['enabled'] else '停用'}（每條執行緒 {stats['buffer_size']} 筆）")
+    return jsonify(stats)
+
+
 @app.route('/api/history')
 def get_history():
-    """取得歷史記錄（支援無限追溯）"""
+    """
+    取得歷史記錄（支援無限追溯）
+
+    參數：hours（0 表示全部）、camera、resolution（raw/minute/hour/day/auto，預設 raw）、
+    per_page、cursor（上一頁回傳的 next_cursor）。長時間範圍改查彙總表，
+    分頁以時間游標定位，不使用 OFFSET，翻到很後面的頁也一樣快。
+    """
     try:
         hours = request.args.get('hours', default=24, type=int)
         camera = request.args.get('camera', default='', type=str)
-        page = request.args.get('page', default=1, type=int)
+        resolution = request.args.get('resolution', default='raw', type=str).lower()
+        cursor = request.args.get('cursor', default='', type=str) or None
         per_page = request.args.get('per_page', default=500, type=int)
-        
-        # 限制每頁最多 5000 筆
-        per_page = min(per_page, 5000)
-        offset = (page - 1) * per_page
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # 根據時間範圍構建查詢
-        if hours > 0:
-            # 有時間限制
-            query = (
-                "SELECT camera_name, timestamp, total_count, normal_count, abnormal_count "
-                "FROM detections WHERE timestamp >= datetime('now', ?)"
-            )
-            params = [f"-{int(hours)} hours"]
-        else:
-            # 全部記錄（無時間限制）
-            query = (
-                "SELECT camera_name, timestamp, total_count, normal_count, abnormal_count "
-                "FROM detections WHERE 1=1"
-            )
-            params = []
-
-        if camera:
-            query += " AND camera_name = ?"
-            params.append(camera)
 
-        # 計算總筆數
-        count_query = query.replace(
-            "SELECT camera_name, timestamp, total_count, normal_count, abnormal_count",
-            "SELECT COUNT(*)"
+        # 限制每頁最多 5000 筆
+        per_page = max(1, min(per_page, 5000))
+        if resolution == 'auto':
+            resolution = pick_resolution(hours)
+        if resolution not in RESOLUTIONS:
+            return jsonify({'error': f'resolution 必須為 auto 或 {"/".join(RESOLUTIONS)}'}), 400
+
+        # 唯讀連線（WAL 模式下不阻塞寫入執行緒）；總筆數只在第一頁計算
+        result = get_store().query_history(
+            resolution, hours, camera, cursor, per_page, with_total=cursor is None
         )
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()[0]
-
-        # 分頁查詢
-        query += f" ORDER BY timestamp DESC LIMIT {per_page} OFFSET {offset}"
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
-
-        history = []
-        for row in rows:
-            # 將 UTC 時間轉換為台北時間 (UTC+8)
-            utc_time = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S')
-            taipei_time = utc_time + timedelta(hours=8)
-            
-            history.append({
-                'camera': row[0],
-                'timestamp': taipei_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'total': row[2],
-                'normal': row[3],
-                'abnormal': row[4],
-                'defect_rate': round(row[4] / row[2] * 100, 2) if row[2] > 0 else 0
-            })
 
         return jsonify({
-            'data': history,
+            'data': result['data'],
             'pagination': {
-                'page': page,
                 'per_page': per_page,
-                'total': total_count,
-                'total_pages': (total_count + per_page - 1) // per_page if per_page > 0 else 0
+                'resolution': resolution,
+                'total': result['total'],
+                'next_cursor': result['next_cursor'],
+                'has_more': result['next_cursor'] is not None,
             }
         })
     except Exception as e:
@@ -578,71 +698,138 @@ def get_history():
         return jsonify({'error': str(e)}), 500
 
 
+def stream_history_csv(query, params, resolution, compress=False, chunk_size=2000):
+    """
+    逐批產生 CSV 內容（fetchmany 分批讀取，記憶體用量與匯出筆數無關）
+
+    Args:
+        query: history_query 產生的查詢
+        params: 查詢參數
+        resolution: 解析度（決定欄位）
+        compress: 是否以 gzip 串流壓縮
+        chunk_size: 每批筆數
+
+    Yields:
+        CSV（或 gzip）位元組
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 為 gzip 格式
+
+    def take():
+        data = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+        return compressor.compress(data) if compressor is not None else data
+
+    header = ["camera", "timestamp", "total", "normal", "abnormal", "defect_rate(%)"]
+    if resolution != 'raw':
+        header += ["samples", "delta_total", "delta_normal", "delta_abnormal", "delta_defect_rate(%)"]
+    writer.writerow(header)
+    yield take()
+
+    exported = 0
+    try:
+        for rows in get_store().iter_query(query, params, chunk_size):
+            for row in rows:
+                writer.writerow(history_record(row, resolution).values())
+            exported += len(rows)
+            chunk = take()
+            if chunk:
+                yield chunk
+    except Exception as e:
+        # 回應已開始傳送，無法再改為錯誤狀態碼；重新拋出讓分塊傳輸中斷，下載端會看到失敗而不是完整的檔案
+        logger.error(f"匯出歷史記錄中斷（已匯出 {exported} 筆）: {e}")
+        raise
+    # 只有正常結束才送出 gzip 結尾
+    if compressor is not None:
+        yield compressor.flush()
+
+
 @app.route('/api/history/export')
 def export_history_csv():
-    """匯出歷史記錄為 CSV（支援 hours / camera 過濾；hours=0 表示全部）"""
+    """
+    以串流匯出歷史記錄為 CSV（支援 hours / camera / resolution 過濾；hours=0 表示全部）
+
+    不限制筆數，邊查詢邊傳送；gzip=1 時以 gzip 壓縮並下載為 .csv.gz。
+    """
     try:
         hours = request.args.get('hours', default=24, type=int)
         camera = request.args.get('camera', default='', type=str)
+        resolution = request.args.get('resolution', default='raw', type=str).lower()
+        compress = request.args.get('gzip', default='0', type=str).lower() in ('1', 'true', 'yes')
+        if resolution == 'auto':
+            resolution = pick_resolution(hours)
+        if resolution not in RESOLUTIONS:
+            return jsonify({'error': f'resolution 必須為 auto 或 {"/".join(RESOLUTIONS)}'}), 400
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        if hours > 0:
-            query = (
-                "SELECT camera_name, timestamp, total_count, normal_count, abnormal_count "
-                "FROM detections WHERE timestamp >= datetime('now', ?)"
-            )
-            params = [f"-{int(hours)} hours"]
-        else:
-            query = (
-                "SELECT camera_name, timestamp, total_count, normal_count, abnormal_count "
-                "FROM detections WHERE 1=1"
-            )
-            params = []
-
-        if camera:
-            query += " AND camera_name = ?"
-            params.append(camera)
-
-        query += " ORDER BY timestamp DESC LIMIT 100000"
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
-
-        # 產生 CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["camera", "timestamp", "total", "normal", "abnormal", "defect_rate(%)"])
-        for cam, ts, total, normal, abnormal in rows:
-            # 將 UTC 時間轉換為台北時間 (UTC+8)
-            utc_time = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
-            taipei_time = utc_time + timedelta(hours=8)
-            taipei_time_str = taipei_time.strftime('%Y-%m-%d %H:%M:%S')
-            
-            defect_rate = round(abnormal / total * 100, 2) if total else 0
-            writer.writerow([cam, taipei_time_str, total, normal, abnormal, defect_rate])
-
-        csv_data = output.getvalue()
-        output.close()
+        # 與 /api/history 相同的查詢（台北時間由 SQL 轉換）
+        query, params = history_query(resolution, hours, camera)
 
         filename = f"history_{hours if hours > 0 else 'all'}h"
+        if resolution != 'raw':
+            filename += f"_{resolution}"
         if camera:
             safe_cam = str(Path(camera).name)
             filename += f"_{safe_cam}"
         filename += f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        if compress:
+            filename += '.gz'
 
         return Response(
-            csv_data,
-            mimetype='text/csv; charset=utf-8',
-            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            stream_history_csv(query, params, resolution, compress),
+            mimetype='application/gzip' if compress else 'text/csv',
+            headers={
+                'Content-Disposition': f'attachment; filename="{filename}"',
+                'X-Accel-Buffering': 'no',
+            }
         )
     except Exception as e:
         logger.error(f"匯出歷史記錄失敗: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/events')
+def get_events():
+    """
+    查詢糖果事件記錄（每顆過線計數的糖果一筆）
+
+    參數：date（YYYY-MM-DD，預設今天）、camera、rule（none/model/black_spot/color/inherited）、
+    label、since（最後一筆 ts，只取更新的事件）、limit（預設 1000，最多 10000）。
+    分頁時以上次回傳的 next_since 與 next_skip 作為 since 與 skip（同一時間的多筆事件不會漏掉）。
+    寫入執行緒每隔 flush_interval_ms 寫入一次，最新的事件可能延遲約一秒才查得到。
+    """
+    log = get_event_log()
+    if log is None:
+        return jsonify({'error': '事件記錄未啟用（config.ini [EventLog] enabled=0）'}), 404
+    try:
+        limit = max(1, min(request.args.get('limit', default=1000, type=int), 10000))
+        result = log.query(
+            day=request.args.get('date', default=None, type=str),
+            camera=request.args.get('camera', default='', type=str),
+            rule=request.args.get('rule', default='', type=str).lower(),
+            label=request.args.get('label', default='', type=str),
+            since=request.args.get('since', default=None, type=float),
+            limit=limit,
+            skip=request.args.get('skip', default=None, type=int),
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"查詢事件記錄失敗: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/events/days')
+def get_event_days():
+    """列出有事件記錄的日期與判定規則名稱"""
+    log = get_event_log()
+    if log is None:
+        return jsonify({'error': '事件記錄未啟用（config.ini [EventLog] enabled=0）'}), 404
+    return jsonify({'days': log.days(), 'rules': list(RULE_NAMES)})
+
+
 @app.route('/api/history/cleanup', methods=['POST'])
 def cleanup_history():
     """清理早於指定天數的歷史資料。
@@ -657,25 +844,30 @@ def cleanup_history():
         if days <= 0:
             days = _get_retention_days(30)
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # 預估刪除筆數
-        cursor.execute("SELECT COUNT(*) FROM detections WHERE timestamp < datetime('now', ?)", [f"-{days} days"])
-        estimated = cursor.fetchone()[0]
+        def delete_old(conn):
+            # 預估刪除筆數
+            cursor = conn.execute("SELECT COUNT(*) FROM detections WHERE timestamp < datetime('now', ?)", [f"-{days} days"])
+            estimated = cursor.fetchone()[0]
+            cursor = conn.execute("DELETE FROM detections WHERE timestamp < datetime('now', ?)", [f"-{days} days"])
+            deleted = cursor.rowcount if cursor.rowcount is not None else estimated
+            # 每分鐘彙總與原始記錄同樣保留天數；每小時、每日彙總很小，保留供長期趨勢使用
+            conn.execute(
+                "DELETE FROM detections_minute WHERE bucket < strftime('%Y-%m-%d %H:%M:00', 'now', '+8 hours', ?)",
+                [f"-{days} days"],
+            )
+            return estimated, deleted
 
-        cursor.execute("DELETE FROM detections WHERE timestamp < datetime('now', ?)", [f"-{days} days"])
-        deleted = cursor.rowcount if cursor.rowcount is not None else estimated
-        conn.commit()
+        # 刪除交給寫入執行緒，與批次寫入依序執行
+        store = get_store()
+        estimated, deleted = store.submit(delete_old).result(timeout=60)
 
         # 可選執行 VACUUM（注意：會鎖表一段時間）
         if bool(data.get('vacuum', False)):
             try:
-                cursor.execute("VACUUM")
+                store.submit(lambda conn: conn.execute("VACUUM"), transaction=False).result(timeout=600)
             except Exception as ve:
                 logger.warning(f"執行 VACUUM 失敗（可忽略）: {ve}")
 
-        conn.close()
         logger.info(f"歷史清理完成：早於 {days} 天，刪除 {deleted} 筆（估計 {estimated}）")
         return jsonify({
             'success': True,
@@ -718,8 +910,7 @@ def set_camera_focus(camera_index):
                 section_name = f"Camera{camera_index + 1}"
                 if config_manager.config.has_section(section_name):
                     config_manager.config.set(section_name, 'default_focus', str(focus))
-                    with open('config.ini', 'w', encoding='utf-8') as f:
-                        config_manager.config.write(f)
+                    config_manager.save()
                     logger.info(f"已將 {cam_ctx.name} 的預設焦距儲存為: {focus}")
                 else:
                     logger.warning(f"找不到設定區塊 {section_name}，無法儲存焦距")
@@ -763,8 +954,7 @@ def set_camera_exposure(camera_index):
                 section_name = f"Camera{camera_index + 1}"
                 if config_manager.config.has_section(section_name):
                     config_manager.config.set(section_name, 'exposure_value', str(exposure))
-                    with open('config.ini', 'w', encoding='utf-8') as f:
-                        config_manager.config.write(f)
+                    config_manager.save()
                     logger.info(f"已將 {cam_ctx.name} 的預設曝光值儲存為: {exposure}")
                 else:
                     logger.warning(f"找不到設定區塊 {section_name}，無法儲存曝光值")
@@ -797,8 +987,7 @@ def set_camera_delay(camera_index):
             section_name = f"Camera{camera_index + 1}"
             if config_manager.config.has_section(section_name):
                 config_manager.config.set(section_name, 'relay_delay_ms', str(delay_ms))
-                with open('config.ini', 'w', encoding='utf-8') as f:
-                    config_manager.config.write(f)
+                config_manager.save()
                 logger.info(f"已將 {cam_ctx.name} 的噴氣延遲保存為: {delay_ms}ms")
             else:
                 logger.warning(f"找不到設定區塊 {section_name}，無法保存延遲時間")
@@ -833,8 +1022,7 @@ def set_camera_duration(camera_index):
             section_name = f"Camera{camera_index + 1}"
             if config_manager.config.has_section(section_name):
                 config_manager.config.set(section_name, 'relay_duration_ms', str(duration_ms))
-                with open('config.ini', 'w', encoding='utf-8') as f:
-                    config_manager.config.write(f)
+                config_manager.save()
                 logger.info(f"已將 {cam_ctx.name} 的噴氣持續時間保存為: {duration_ms}ms")
             else:
                 logger.warning(f"找不到設定區塊 {section_name}，無法保存持續時間")
@@ -866,10 +1054,11 @@ def manage_config():
                     config_manager.config.set(section, key, str(value))
 
             # 儲存到檔案
-            with open('config.ini', 'w', encoding='utf-8') as f:
-                config_manager.config.write(f)
+            config_manager.save()
 
-            return jsonify({'success': True})
+            # 執行中的偵測執行緒從下一幀起使用新設定
+            settings = get_settings_holder().reload()
+            return jsonify({'success': True, 'settings_version': settings.version})
         except Exception as e:
             logger.error(f"更新設定失敗: {e}")
             return jsonify({'error': str(e)}), 500
@@ -978,20 +1167,27 @@ def add_camera():
         
         from run_detector import CameraContext
         
+        relay_url = config_manager.get(new_name, 'relay_url', fallback='') if config_manager else ''
+
         # 建立新的攝影機上下文
         new_cam = CameraContext(
             name=new_name,
             index=camera_index,
             frame_width=frame_width,
             frame_height=frame_height,
-            relay_url=config_manager.get(new_name, 'relay_url', fallback='') if config_manager else '',
+            relay_url=relay_url,
             line_x1=int(frame_width * 0.45),
             line_x2=int(frame_width * 0.55),
             cap=cap,
-            relay_delay_ms=config_manager.get(new_name, 'relay_delay_ms', fallback=1600) if config_manager else 1600
+            relay_delay_ms=config_manager.get(new_name, 'relay_delay_ms', fallback=1600) if config_manager else 1600,
+            relay_scheduler=RelayScheduler(new_name, relay_url),
         )
         
         camera_contexts.append(new_cam)
+        if is_running:
+            if frame_reader is not None:
+                frame_reader.add(new_cam)
+            start_detection_worker(new_cam)
         
         logger.info(f"已新增攝影機 {new_name} (Index: {camera_index})")
         return jsonify({
@@ -1018,10 +1214,16 @@ def remove_camera(array_index):
         
         logger.info(f"正在移除攝影機: {name} (List Index: {array_index})")
         
-        # 1. 釋放資源
+        # 1. 停止偵測與抓取執行緒並釋放資源
+        stop_detection_worker(cam_ctx)
+        if frame_reader is not None:
+            frame_reader.remove(cam_ctx)
         if cam_ctx.cap is not None:
             cam_ctx.cap.release()
             cam_ctx.cap = None
+        if cam_ctx.relay_scheduler is not None:
+            cam_ctx.relay_scheduler.stop()
+            cam_ctx.relay_scheduler = None
             
         # 2. 從列表中移除
         camera_contexts.pop(array_index)
@@ -1149,8 +1351,7 @@ def switch_camera_source(camera_index):
         if config_manager.config.has_section(section_name):
             config_manager.config.set(section_name, 'camera_index', str(source_index))
             try:
-                with open('config.ini', 'w', encoding='utf-8') as f:
-                    config_manager.config.write(f)
+                config_manager.save()
                 logger.info(f"已更新設定檔 {section_name}.camera_index = {source_index}")
             except Exception as e:
                 logger.warning(f"更新設定檔失敗: {e}")
@@ -1238,11 +1439,14 @@ def test_spray(camera_index):
 
     delay_ms = max(0, int(getattr(cam_ctx, 'relay_delay_ms', 0)))
     duration_ms = max(0, int(getattr(cam_ctx, 'relay_duration_ms', 50)))
-    threading.Thread(
-        target=trigger_relay,
-        args=(cam_ctx.relay_url, delay_ms, duration_ms),
-        daemon=True,
-    ).start()
+    if cam_ctx.relay_scheduler is not None:
+        cam_ctx.relay_scheduler.schedule(time.monotonic(), delay_ms, duration_ms, cam_ctx.relay_url)
+    else:
+        threading.Thread(
+            target=trigger_relay,
+            args=(cam_ctx.relay_url, delay_ms, duration_ms),
+            daemon=True,
+        ).start()
 
     return jsonify({
         'success': True,
@@ -1402,8 +1606,7 @@ def change_model():
             config_manager.config.set('Paths', 'cfg', cfg)
         
         # 儲存配置
-        with open('config.ini', 'w', encoding='utf-8') as f:
-            config_manager.config.write(f)
+        config_manager.save()
         
         # 重新載入模型
         if model_type == 'yolov8':
@@ -1570,6 +1773,9 @@ def start_recording(camera_index):
     """開始錄影"""
     try:
         recorder = get_recorder(camera_index)
+        if camera_index < len(camera_contexts):
+            # 與偵測共用抓取執行緒的畫面，避免兩邊同時 cap.read() 互搶畫面
+            recorder.set_frame_source(camera_contexts[camera_index].grabber)
         # 安全取得 filename 和 codec，處理空 body 情況
         filename = None
         codec = None
@@ -1625,6 +1831,8 @@ def recorder_preview(camera_index):
         # 強制從偵測系統奪取共享攝影機
         if camera_index < len(camera_contexts):
             cam_ctx = camera_contexts[camera_index]
+            _, preview_hub = get_stream_hubs(cam_ctx)
+            recorder.set_preview_hub(preview_hub)
             if cam_ctx.cap is not None and cam_ctx.cap.isOpened():
                 recorder.set_shared_camera(cam_ctx.cap)
                 logger.info(f"錄影器 {camera_index}: 已連接共享攝影機")
@@ -3372,20 +3580,71 @@ def stop_blower():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def count_active_workers() -> int:
+    """目前正在執行的偵測執行緒數量（批次推論據此判斷畫面是否到齊）"""
+    return sum(
+        1 for cam_ctx in camera_contexts
+        if cam_ctx.detection_thread is not None and cam_ctx.detection_thread.is_alive()
+    )
+
+
+def start_inference_service():
+    """YOLOv8 且啟用批次推論時建立批次推論服務"""
+    global inference_service
+    config = config_manager.config
+    model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
+    if inference_service is not None or model_type != 'yolov8':
+        return
+    if config.getint('Detection', 'batch_inference', fallback=1) != 1:
+        return
+
+    settings = get_settings_holder().current
+    inference_service = InferenceService(
+        get_model=lambda: model,
+        model_lock=model_lock,
+        conf_threshold=settings.confidence_threshold,
+        nms_threshold=settings.nms_threshold,
+        max_wait_ms=config.getfloat('Detection', 'batch_max_wait_ms', fallback=8),
+        expected_requests=count_active_workers,
+    ).start()
+    logger.info("已啟用 YOLOv8 批次推論")
+
+
 def start_detection():
     """啟動偵測系統"""
-    global is_running
+    global is_running, frame_reader
     is_running = True
+    if frame_reader is None:
+        frame_reader = MultiThreadedFrameReader(camera_contexts, CAPTURE_RING_BUFFER_SIZE).start()
+    # 監看設定檔，手動修改 config.ini 也會即時套用
+    get_settings_holder().start_watch()
+    tracing.configure(config_manager)
+    start_inference_service()
+    for cam_ctx in camera_contexts:
+        start_detection_worker(cam_ctx)
     logger.info("偵測系統已啟動")
 
 
 def stop_detection():
     """停止偵測系統"""
-    global is_running, camera_contexts
+    global is_running, camera_contexts, frame_reader, inference_service
     is_running = False
 
+    for cam_ctx in camera_contexts:
+        stop_detection_worker(cam_ctx)
+    if inference_service is not None:
+        inference_service.stop()
+        inference_service = None
+    if frame_reader is not None:
+        frame_reader.stop()
+        frame_reader = None
     for cam_ctx in camera_contexts:
         cam_ctx.release()
+    if detection_store is not None:
+        # 寫完佇列中的記錄，避免關閉時遺失最後幾筆
+        detection_store.flush()
+    if event_log is not None:
+        event_log.flush()
 
     camera_contexts.clear()
     cleanup_recorders()  # 清理錄影器
@@ -3427,5 +3686,9 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
     finally:
         stop_detection()
+        if detection_store is not None:
+            detection_store.stop()
+        if event_log is not None:
+            event_log.stop()
 
 
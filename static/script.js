@@ -506,57 +506,61 @@ async function loadDefectRateTrend() {
     }
 }
 
-// 歷史記錄分頁狀態
+// 歷史記錄分頁狀態（時間游標分頁：cursors[i] 為第 i+1 頁的游標，第一頁為 null）
 let historyState = {
     currentPage: 1,
-    totalPages: 0,
+    cursors: [null],
+    nextCursor: null,
     totalRecords: 0,
+    resolution: 'raw',
     isLoading: false
 };
 
+// 目前的查詢條件
+function historyQuery() {
+    const hours = document.getElementById('historyHours').value;
+    const camera = document.getElementById('historyCamera').value;
+    const resolution = document.getElementById('historyResolution').value;
+    return `hours=${hours}&resolution=${resolution}${camera ? '&camera=' + encodeURIComponent(camera) : ''}`;
+}
+
 // 載入歷史記錄
 async function loadHistory(page = 1) {
     if (historyState.isLoading) return;
     historyState.isLoading = true;
 
     try {
-        const hours = document.getElementById('historyHours').value;
-        const camera = document.getElementById('historyCamera').value;
         const perPage = 500;  // 每頁筆數
 
-        const url = `/api/history?hours=${hours}&page=${page}&per_page=${perPage}${camera ? '&camera=' + camera : ''}`;
+        // 第一頁重新開始；其他頁使用已記錄的游標
+        if (page === 1) {
+            historyState.cursors = [null];
+        }
+        const cursor = historyState.cursors[page - 1];
+        const url = `/api/history?${historyQuery()}&per_page=${perPage}${cursor ? '&cursor=' + encodeURIComponent(cursor) : ''}`;
         const response = await fetch(url);
         const result = await response.json();
 
         const tbody = document.getElementById('historyTableBody');
-
-        // 第一頁時清空表格
-        if (page === 1) {
-            tbody.innerHTML = '';
-        }
+        tbody.innerHTML = '';
 
         // 處理資料（支援新舊格式）
         const history = result.data || result;
         const pagination = result.pagination;
 
-        history.forEach(record => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${new Date(record.timestamp).toLocaleString('zh-TW')}</td>
-                <td>${record.camera}</td>
-                <td>${record.total}</td>
-                <td>${record.normal}</td>
-                <td>${record.abnormal}</td>
-                <td>${record.defect_rate}%</td>
-            `;
-            tbody.appendChild(row);
-        });
+        appendHistoryRows(history);
 
-        // 更新分頁狀態
+        // 更新分頁狀態（總筆數只在第一頁回傳）
         if (pagination) {
-            historyState.currentPage = pagination.page;
-            historyState.totalPages = pagination.total_pages;
-            historyState.totalRecords = pagination.total;
+            historyState.currentPage = page;
+            historyState.nextCursor = pagination.next_cursor;
+            historyState.resolution = pagination.resolution;
+            if (pagination.next_cursor) {
+                historyState.cursors[page] = pagination.next_cursor;
+            }
+            if (pagination.total !== null && pagination.total !== undefined) {
+                historyState.totalRecords = pagination.total;
+            }
             updatePaginationUI();
         }
 
@@ -579,15 +583,16 @@ function updatePaginationUI() {
         container.parentNode.insertBefore(paginationDiv, container.nextSibling);
     }
 
-    const { currentPage, totalPages, totalRecords } = historyState;
+    const { currentPage, nextCursor, totalRecords, resolution } = historyState;
+    const totalPages = Math.max(1, Math.ceil(totalRecords / 500));
+    const resolutionLabels = { raw: '原始記錄', minute: '每分鐘', hour: '每小時', day: '每日' };
 
     paginationDiv.innerHTML = `
-        <span class="pagination-info">共 ${totalRecords} 筆記錄，第 ${currentPage} / ${totalPages} 頁</span>
+        <span class="pagination-info">共 ${totalRecords} 筆${resolutionLabels[resolution] || ''}記錄，第 ${currentPage} / ${totalPages} 頁</span>
         <div class="pagination-buttons">
             <button onclick="loadHistory(1)" ${currentPage <= 1 ? 'disabled' : ''}>⏮️ 首頁</button>
             <button onclick="loadHistory(${currentPage - 1})" ${currentPage <= 1 ? 'disabled' : ''}>◀️ 上一頁</button>
-            <button onclick="loadHistory(${currentPage + 1})" ${currentPage >= totalPages ? 'disabled' : ''}>下一頁 ▶️</button>
-            <button onclick="loadHistory(${totalPages})" ${currentPage >= totalPages ? 'disabled' : ''}>末頁 ⏭️</button>
+            <button onclick="loadHistory(${currentPage + 1})" ${!nextCursor ? 'disabled' : ''}>下一頁 ▶️</button>
             <button onclick="loadAllHistory()" class="btn-load-all" ${totalRecords <= 500 ? 'disabled' : ''}>📥 載入全部</button>
         </div>
     `;
@@ -608,29 +613,20 @@ async function loadAllHistory() {
     tbody.innerHTML = '<tr><td colspan="6" style="text-align:center;">正在載入全部記錄...</td></tr>';
 
     try {
-        const hours = document.getElementById('historyHours').value;
-        const camera = document.getElementById('historyCamera').value;
-
-        // 使用較大的 per_page 來減少請求次數
-        const url = `/api/history?hours=${hours}&page=1&per_page=5000${camera ? '&camera=' + camera : ''}`;
-        const response = await fetch(url);
-        const result = await response.json();
-
-        const pagination = result.pagination;
-        const totalPages = pagination.total_pages;
-
-        tbody.innerHTML = '';
-
-        // 處理第一批資料
-        appendHistoryRows(result.data);
-
-        // 載入剩餘頁面
-        for (let page = 2; page <= totalPages; page++) {
-            const pageUrl = `/api/history?hours=${hours}&page=${page}&per_page=5000${camera ? '&camera=' + camera : ''}`;
+        // 使用較大的 per_page 來減少請求次數，依 next_cursor 逐頁取得
+        let cursor = null;
+        let first = true;
+        do {
+            const pageUrl = `/api/history?${historyQuery()}&per_page=5000${cursor ? '&cursor=' + encodeURIComponent(cursor) : ''}`;
             const pageResponse = await fetch(pageUrl);
             const pageResult = await pageResponse.json();
+            if (first) {
+                tbody.innerHTML = '';
+                first = false;
+            }
             appendHistoryRows(pageResult.data);
-        }
+            cursor = pageResult.pagination.next_cursor;
+        } while (cursor);
 
         // 更新 UI 顯示已載入全部
         let paginationDiv = document.getElementById('historyPagination');
@@ -666,34 +662,16 @@ function appendHistoryRows(history) {
 // 匯出 CSV
 async function exportHistory() {
     try {
-        const hours = document.getElementById('historyHours').value;
-        const camera = document.getElementById('historyCamera').value;
-
-        const url = `/api/history/export?hours=${encodeURIComponent(hours)}${camera ? `&camera=${encodeURIComponent(camera)}` : ''}`;
-
-        const res = await fetch(url);
-        if (!res.ok) {
-            throw new Error(`匯出失敗 (HTTP ${res.status})`);
-        }
-
-        const blob = await res.blob();
-
-        // 從 Content-Disposition 取得檔名
-        const disposition = res.headers.get('Content-Disposition') || '';
-        let filename = 'history.csv';
-        const match = /filename\*=UTF-8''([^;]+)|filename="?([^";]+)"?/i.exec(disposition);
-        if (match) {
-            filename = decodeURIComponent(match[1] || match[2]);
-        }
+        const gzip = document.getElementById('historyGzip').checked;
+        const url = `/api/history/export?${historyQuery()}${gzip ? '&gzip=1' : ''}`;
 
+        // 由瀏覽器直接下載串流回應（檔名取自 Content-Disposition），不在頁面中暫存整個檔案
         const link = document.createElement('a');
-        const href = URL.createObjectURL(blob);
-        link.href = href;
-        link.download = filename;
+        link.href = url;
+        link.download = '';
         document.body.appendChild(link);
         link.click();
         document.body.removeChild(link);
-        URL.revokeObjectURL(href);
     } catch (error) {
         console.error('匯出 CSV 失敗:', error);
         alert('匯出失敗：' + (error.message || error));
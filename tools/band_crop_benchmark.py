@@ -0,0 +1,201 @@
+"""
+偵測線帶狀裁切基準測試
+以錄好的輸送帶影片比較整張畫面推論與帶狀裁切推論的 FPS 與召回率
+
+使用方法:
+    python tools/band_crop_benchmark.py --video belt.mp4 --section Camera1
+"""
+import sys
+import time
+import configparser
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / 'src'))
+
+from candy_detector.models import CameraContext
+from candy_detector.optimization import BandCropProcessor
+from candy_detector.postprocess import DetectionFilter, box_iou, filter_detections
+from run_detector import load_yolo_model, process_camera_frame, run_detection
+
+
+def load_config(config_file):
+    """讀取設定檔"""
+    config = configparser.ConfigParser()
+    config.read(PROJECT_ROOT / config_file, encoding='utf-8')
+    return config
+
+
+def match_detections(reference, candidates, iou_threshold):
+    """
+    以 IoU 貪婪配對參考偵測與候選偵測
+
+    Returns:
+        配對成功的參考偵測數
+    """
+    if not len(reference) or not len(candidates):
+        return 0
+    used = np.zeros(len(candidates), dtype=bool)
+    matched = 0
+    for box in reference['bbox'].astype(np.float64):
+        iou = box_iou(box, candidates['bbox'].astype(np.float64))
+        iou[used] = 0.0
+        best = int(np.argmax(iou))
+        if iou[best] >= iou_threshold:
+            used[best] = True
+            matched += 1
+    return matched
+
+
+def benchmark_detection(video, model, class_names, config, section, frames, iou_threshold):
+    """
+    逐幀比較兩種模式的推論時間與偵測結果
+
+    整張畫面的偵測結果中，中心點落在帶狀區域內的視為參考答案，
+    帶狀裁切找到的比例即為召回率（帶狀區域外的偵測不影響計數）。
+    """
+    conf = config.getfloat('Detection', 'confidence_threshold')
+    nms = config.getfloat('Detection', 'nms_threshold')
+    model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
+    line_x1 = config.getint(section, 'detection_line_x1')
+    line_x2 = config.getint(section, 'detection_line_x2')
+    det_filter = DetectionFilter.from_config(config)
+
+    cap = cv2.VideoCapture(str(video))
+    ok, frame = cap.read()
+    if not ok:
+        raise RuntimeError(f"無法讀取影片: {video}")
+    frame_h, frame_w = frame.shape[:2]
+    cropper = BandCropProcessor(
+        frame_w,
+        frame_h,
+        min_margin=config.getint('Detection', 'band_crop_margin', fallback=200),
+        track_frames=config.getint('Detection', 'band_crop_track_frames', fallback=6),
+    )
+
+    full_ms, band_ms = [], []
+    reference_total = matched_total = band_total = 0
+    count = 0
+    while ok and count < frames:
+        start = time.perf_counter()
+        classes, scores, boxes = run_detection(model, frame, conf, nms, model_type)
+        full, _ = filter_detections(classes, scores, boxes, frame.shape, len(class_names), det_filter)
+        full_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        band_frame, offset = cropper.extract(frame, line_x1, line_x2)
+        # 與 process_camera_frame 相同，以實際帶狀區域（不含 letterbox 補邊）的大小過濾
+        x1, y1, x2, y2 = cropper.last_crop
+        band_shape = (y2 - y1, x2 - x1) + frame.shape[2:]
+        classes, scores, boxes = run_detection(model, band_frame, conf, nms, model_type)
+        band, _ = filter_detections(classes, scores, boxes, band_shape, len(class_names), det_filter, offset)
+        band_ms.append((time.perf_counter() - start) * 1000)
+
+        reference = full[(full['center'][:, 0] >= x1) & (full['center'][:, 0] < x2)]
+        reference_total += len(reference)
+        band_total += len(band)
+        matched_total += match_detections(reference, band, iou_threshold)
+
+        count += 1
+        ok, frame = cap.read()
+    cap.release()
+
+    return {
+        'frames': count,
+        'full_ms': float(np.mean(full_ms)) if full_ms else 0.0,
+        'band_ms': float(np.mean(band_ms)) if band_ms else 0.0,
+        'reference': reference_total,
+        'band_detections': band_total,
+        'recall': matched_total / reference_total if reference_total else 1.0,
+    }
+
+
+def benchmark_pipeline(video, model, class_names, config, section, frames, use_band_crop):
+    """以完整偵測流程跑一次影片，回傳 FPS 與計數"""
+    run_config = configparser.ConfigParser()
+    run_config.read_dict(config)
+    run_config.set('Detection', 'use_band_crop', '1' if use_band_crop else '0')
+    # 動態閘門會讓兩種模式略過的畫面不同，基準測試時關閉
+    run_config.set('Detection', 'use_motion_gate', '0')
+
+    cap = cv2.VideoCapture(str(video))
+    frame_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cam_ctx = CameraContext(
+        name=f"{section}-{'band' if use_band_crop else 'full'}",
+        index=0,
+        frame_width=frame_w,
+        frame_height=frame_h,
+        relay_url='',
+        line_x1=config.getint(section, 'detection_line_x1'),
+        line_x2=config.getint(section, 'detection_line_x2'),
+        cap=cap,
+    )
+    # 基準測試不觸發繼電器
+    cam_ctx.relay_paused = True
+
+    conf = config.getfloat('Detection', 'confidence_threshold')
+    nms = config.getfloat('Detection', 'nms_threshold')
+    model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
+    colors = [(0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 255, 0)]
+
+    count = 0
+    start = time.perf_counter()
+    while count < frames:
+        processed = process_camera_frame(
+            cam_ctx, model, class_names, colors, conf, nms, 0.0,
+            draw_annotations=False, model_type=model_type, config=run_config,
+        )
+        if processed is None:
+            break
+        count += 1
+    elapsed = time.perf_counter() - start
+    cam_ctx.release()
+
+    return {
+        'frames': count,
+        'fps': count / elapsed if elapsed > 0 else 0.0,
+        'total': cam_ctx.total_num,
+        'abnormal': cam_ctx.abnormal_num,
+        'band_crop': cam_ctx.band_cropper.get_stats() if cam_ctx.band_cropper is not None else {},
+    }
+
+
+def main(args):
+    config = load_config(args.config)
+    model, class_names = load_yolo_model(config)
+
+    print(f"\n{'='*60}")
+    print(f"帶狀裁切基準測試: {args.video} ({args.section})")
+    print(f"{'='*60}")
+
+    detection = benchmark_detection(args.video, model, class_names, config, args.section, args.frames, args.iou)
+    print(f"\n[推論] {detection['frames']} 幀")
+    print(f"  整張畫面: {detection['full_ms']:.1f} ms/幀")
+    print(f"  帶狀裁切: {detection['band_ms']:.1f} ms/幀")
+    print(f"  召回率: {detection['recall']:.2%} "
+          f"(帶狀區域內參考偵測 {detection['reference']}，帶狀裁切偵測 {detection['band_detections']})")
+
+    print("\n[完整流程]")
+    for use_band_crop in (False, True):
+        result = benchmark_pipeline(args.video, model, class_names, config, args.section, args.frames, use_band_crop)
+        mode = '帶狀裁切' if use_band_crop else '整張畫面'
+        print(f"  {mode}: {result['fps']:.1f} FPS, 總數 {result['total']}, 異常 {result['abnormal']}"
+              + (f", 裁切 {result['band_crop']}" if result['band_crop'] else ''))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='比較整張畫面與偵測線帶狀裁切的 FPS 與召回率')
+    parser.add_argument('--video', '-v', required=True, help='輸送帶錄影檔')
+    parser.add_argument('--config', default='config.ini', help='設定檔（相對於專案根目錄）')
+    parser.add_argument('--section', default='Camera1', help='使用哪個攝影機區塊的偵測線位置')
+    parser.add_argument('--frames', type=int, default=600, help='最多測試幀數')
+    parser.add_argument('--iou', type=float, default=0.5, help='配對偵測框的 IoU 閾值')
+
+    main(parser.parse_args())
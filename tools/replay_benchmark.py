@@ -0,0 +1,234 @@
+"""
+離線重播基準測試
+以錄好的輸送帶影片（或圖片序列）跑完整偵測流程：追蹤、計數與噴氣排程都與線上相同，
+繼電器請求改送到本機的替身伺服器。輸出 FPS、各階段耗時、計數與噴氣時間，
+存成 JSON 後可作為每次修改偵測流程的回歸基準。
+
+預設盡快讀取每一張畫面，同一支影片每次的計數都相同；--realtime 依影片幀率播放，
+處理來不及時跳過畫面，用來檢查線上速度下是否漏算。
+
+使用方法:
+    python tools/replay_benchmark.py --source belt.mp4 --section Camera1
+    python tools/replay_benchmark.py --source frames/ --fps 60 --realtime
+    python tools/replay_benchmark.py --source belt.mp4 --json result.json --baseline baseline.json
+"""
+import sys
+import json
+import time
+import configparser
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / 'src'))
+
+from candy_detector.config import DetectionSettings
+from candy_detector.metrics import CameraMetrics, MetricsRegistry
+from candy_detector.replay import RelayRecorder, ReplayCapture
+from run_detector import create_camera_context, create_multi_scale_detector, load_yolo_model, process_camera_frame
+
+# 顏色順序：abnormal=紅色, normal=綠色（對應 classes.txt 的順序）
+COLORS = [(0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 0)]
+
+
+def load_config(config_file):
+    """讀取設定檔"""
+    config = configparser.ConfigParser()
+    config.read(PROJECT_ROOT / config_file, encoding='utf-8')
+    return config
+
+
+def run_replay(source, model, class_names, config, section, realtime=False, speed=1.0, fps=None,
+               max_frames=0, use_relay=True, draw_annotations=False):
+    """
+    以重播來源跑一次完整偵測流程
+
+    Args:
+        source: 影片檔、圖片目錄或圖片 glob 樣式
+        model: 已載入的模型
+        class_names: 類別名稱
+        config: 設定檔
+        section: 使用哪個攝影機區塊（偵測線、ROI、噴氣延遲）
+        realtime: 依影片幀率播放
+        speed: realtime 模式的播放倍速
+        fps: 圖片序列的幀率
+        max_frames: 最多處理幀數（0 表示全部）
+        use_relay: 噴氣送到本機替身伺服器；False 時暫停噴氣
+        draw_annotations: 是否繪製標註（線上預設會繪製）
+
+    Returns:
+        結果字典
+    """
+    cap = ReplayCapture(source, realtime=realtime, speed=speed, fps=fps)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟重播來源: {source}")
+    cam_ctx = create_camera_context(config, section, cap=cap)
+    # 每次重播使用獨立的指標，結果不會與其他來源或前一次重播混在一起
+    cam_ctx.name = f"replay:{Path(str(source)).name}"
+    cam_ctx.metrics = CameraMetrics(cam_ctx.name, MetricsRegistry())
+
+    recorder = None
+    if use_relay:
+        recorder = RelayRecorder().start()
+        cam_ctx.relay_url = recorder.url
+    else:
+        cam_ctx.relay_paused = True
+
+    settings = DetectionSettings.from_config(config)
+    model_type = config.get('Paths', 'model_type', fallback='yolov4').lower()
+    # 與 run_detector.main 相同，依設定啟用多尺度檢測
+    multi_scale_detector = create_multi_scale_detector(config)
+
+    count = 0
+    start = time.perf_counter()
+    try:
+        while not max_frames or count < max_frames:
+            processed = process_camera_frame(
+                cam_ctx, model, class_names, COLORS,
+                settings.confidence_threshold, settings.nms_threshold,
+                time.perf_counter() - start,
+                draw_annotations=draw_annotations,
+                multi_scale_detector=multi_scale_detector,
+                model_type=model_type,
+                config=config,
+                settings=settings,
+            )
+            if processed is None:
+                break
+            count += 1
+        elapsed = time.perf_counter() - start
+
+        # 等待排程中的噴氣送出（最多 延遲 + 持續時間 + 1 秒）
+        scheduler = cam_ctx.relay_scheduler
+        deadline = time.monotonic() + (cam_ctx.relay_delay_ms + cam_ctx.relay_duration_ms) / 1000.0 + 1.0
+        while scheduler is not None and scheduler.get_stats()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2 if use_relay else 0.0)
+        relay_stats = scheduler.get_stats() if scheduler is not None else {}
+    finally:
+        cam_ctx.release()
+        if recorder is not None:
+            recorder.stop()
+
+    summary = cam_ctx.metrics.summary() if cam_ctx.metrics is not None else {}
+    return {
+        'source': str(source),
+        'section': section,
+        'mode': f"realtime x{speed:g}" if realtime else 'fast',
+        'frames': count,
+        'skipped_frames': cap.frames_skipped,
+        'elapsed_s': round(elapsed, 3),
+        'fps': round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        'counts': {
+            'total': cam_ctx.total_num,
+            'normal': cam_ctx.normal_num,
+            'abnormal': cam_ctx.abnormal_num,
+        },
+        'skipped_inferences': summary.get('skipped_inferences', 0),
+        'stages': summary.get('stages', {}),
+        'relay': {
+            'scheduler': relay_stats,
+            'recorded': recorder.get_stats() if recorder is not None else None,
+        },
+    }
+
+
+def print_report(result):
+    """輸出單一來源的結果"""
+    counts = result['counts']
+    print(f"\n[{result['source']}] {result['mode']}")
+    print(f"  畫面: {result['frames']} 幀（跳過 {result['skipped_frames']}，略過推論 {result['skipped_inferences']}）"
+          f"，{result['elapsed_s']:.2f} 秒，{result['fps']:.1f} FPS")
+    print(f"  計數: 總數 {counts['total']}，正常 {counts['normal']}，異常 {counts['abnormal']}")
+    print(f"  {'階段':<20}{'次數':>8}{'平均ms':>10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for stage, stats in result['stages'].items():
+        print(f"  {stage:<20}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+    scheduler = result['relay']['scheduler']
+    recorded = result['relay']['recorded']
+    if recorded is not None:
+        print(f"  噴氣: 排程 {scheduler.get('pulses', 0)} 次，替身收到 {recorded['pulses']} 次"
+              f"（未關閉 {recorded['unclosed']}），延遲平均 {scheduler.get('mean_lateness_ms', 0.0):.2f}ms"
+              f" / p95 {scheduler.get('p95_lateness_ms', 0.0):.2f}ms，"
+              f"持續 {recorded['mean_width_ms']:.1f}ms，最短間隔 {recorded['min_gap_ms']:.1f}ms")
+
+
+def compare_with_baseline(results, baseline, fps_tolerance):
+    """
+    與基準結果比較
+
+    fast 模式每次的計數應完全相同；FPS 低於基準超過 fps_tolerance 比例也視為退步。
+
+    Returns:
+        差異說明列表（空列表表示通過）
+    """
+    previous = {(item['source'], item['mode']): item for item in baseline.get('results', [])}
+    problems = []
+    for result in results:
+        key = (result['source'], result['mode'])
+        old = previous.get(key)
+        if old is None:
+            continue
+        if result['mode'] == 'fast' and result['counts'] != old['counts']:
+            problems.append(f"{result['source']}: 計數 {old['counts']} -> {result['counts']}")
+        if old['fps'] and result['fps'] < old['fps'] * (1.0 - fps_tolerance):
+            problems.append(f"{result['source']}: FPS {old['fps']:.1f} -> {result['fps']:.1f}")
+    return problems
+
+
+def main(args):
+    config = load_config(args.config)
+    if args.section not in config:
+        print(f"設定檔中找不到區塊 '{args.section}'")
+        return 2
+    model, class_names = load_yolo_model(config)
+
+    print(f"\n{'='*60}")
+    print(f"離線重播基準測試: {args.section}，{len(args.source)} 個來源")
+    print(f"{'='*60}")
+
+    results = []
+    for source in args.source:
+        result = run_replay(
+            source, model, class_names, config, args.section,
+            realtime=args.realtime, speed=args.speed, fps=args.fps, max_frames=args.frames,
+            use_relay=not args.no_relay, draw_annotations=args.draw,
+        )
+        print_report(result)
+        results.append(result)
+
+    report = {'config': args.config, 'section': args.section, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\n結果已寫入 {args.json}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        problems = compare_with_baseline(results, baseline, args.fps_tolerance)
+        if problems:
+            print("\n與基準比較: 退步")
+            for problem in problems:
+                print(f"  - {problem}")
+            return 1
+        print("\n與基準比較: 通過")
+    return 0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='以錄影重播完整偵測流程，輸出 FPS、各階段耗時、計數與噴氣時間')
+    parser.add_argument('--source', '-s', nargs='+', required=True, help='影片檔、圖片目錄或圖片 glob 樣式（可多個）')
+    parser.add_argument('--config', default='config.ini', help='設定檔（相對於專案根目錄）')
+    parser.add_argument('--section', default='Camera1', help='使用哪個攝影機區塊的偵測線與噴氣設定')
+    parser.add_argument('--frames', type=int, default=0, help='每個來源最多處理幀數（0 表示全部）')
+    parser.add_argument('--realtime', action='store_true', help='依影片幀率播放（預設盡快讀取）')
+    parser.add_argument('--speed', type=float, default=1.0, help='realtime 模式的播放倍速')
+    parser.add_argument('--fps', type=float, default=None, help='圖片序列的幀率（預設 30）')
+    parser.add_argument('--no-relay', action='store_true', help='不啟動繼電器替身，暫停噴氣')
+    parser.add_argument('--draw', action='store_true', help='繪製標註（計入 drawing 階段耗時）')
+    parser.add_argument('--json', help='將結果寫入 JSON 檔')
+    parser.add_argument('--baseline', help='與先前的 JSON 結果比較，計數不同或 FPS 退步時回傳 1')
+    parser.add_argument('--fps-tolerance', type=float, default=0.1, help='可接受的 FPS 下降比例')
+
+    sys.exit(main(parser.parse_args()))
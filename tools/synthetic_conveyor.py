@@ -0,0 +1,687 @@
+"""
+合成輸送帶影片產生器與速度上限評分
+從標註好的 YOLO 資料集裁出正常與瑕疵糖果，貼到輸送帶背景上，依設定的帶速、間距、
+隨機抖動與瑕疵比例移動，輸出影片與記錄每顆糖果穿越偵測線時間與類別的標準答案 JSON。
+
+score 以離線重播跑完整偵測流程並與標準答案比對計數；sweep 在固定的模型輸入尺寸與
+推論幀率下由慢到快產生多段影片，找出計數仍完全正確的最高帶速。
+
+找不到資料集圖片時改用繪製的圓形糖果（瑕疵加黑點），只適合檢查追蹤與計數流程。
+
+使用方法:
+    python tools/synthetic_conveyor.py generate --output belt.avi --speed 900 --count 60
+    python tools/synthetic_conveyor.py score --video belt.avi --section Camera1
+    python tools/synthetic_conveyor.py sweep --speeds 600,900,1200,1500,1800 --inference-fps 30 --input-size 416
+"""
+import sys
+import json
+import time
+import tempfile
+import functools
+import configparser
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / 'src'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from replay_benchmark import run_replay
+from run_detector import load_yolo_model
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+ABNORMAL_NAMES = ('abnormal', 'defect')  # 資料集 yaml 中代表瑕疵的類別名稱
+MAX_BACKGROUND_IMAGES = 25  # 以中位數合成背景時最多讀取的圖片數
+
+
+def load_config(config_file):
+    """讀取設定檔"""
+    config = configparser.ConfigParser()
+    config.read(PROJECT_ROOT / config_file, encoding='utf-8')
+    return config
+
+
+def truth_path_for(video_path):
+    """影片對應的標準答案檔路徑（與影片同目錄，副檔名 .truth.json）"""
+    video_path = Path(video_path)
+    return video_path.with_name(video_path.stem + '.truth.json')
+
+
+# ==================== 素材 ====================
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def resolve_dataset(data_yaml=None, dataset_dir=None, abnormal_ids=None, config=None):
+    """
+    找出資料集的 (圖片目錄, 標註目錄) 與代表瑕疵的類別 ID
+
+    資料集 yaml 的類別順序不一定與 models/classes.txt 相同，因此瑕疵類別依 yaml 的名稱判斷；
+    只給目錄時改用 classes.txt 的順序，或以 abnormal_ids 明確指定。
+
+    Args:
+        data_yaml: YOLO 資料集 yaml（path / train / val / names，可選 labels）
+        dataset_dir: 直接指定資料集根目錄（其下的 images/ 與 labels/ 結構相同）
+        abnormal_ids: 瑕疵類別 ID 列表（None 表示自動判斷）
+        config: 設定檔（讀取 classes.txt 路徑）
+
+    Returns:
+        ([(圖片目錄, 標註目錄), ...], 瑕疵類別 ID 集合)
+    """
+    pairs = []
+    names = None
+    if data_yaml:
+        import yaml
+
+        data_yaml = Path(data_yaml)
+        if not data_yaml.is_absolute():
+            data_yaml = PROJECT_ROOT / data_yaml
+        with open(data_yaml, 'r', encoding='utf-8') as f:
+            dataset = yaml.safe_load(f) or {}
+        root = Path(dataset.get('path') or data_yaml.parent)
+        if not root.is_absolute():
+            root = data_yaml.parent / root
+        labels = dataset.get('labels') if isinstance(dataset.get('labels'), dict) else {}
+        for split in ('train', 'val'):
+            for images in _as_list(dataset.get(split)):
+                image_dir = root / images
+                if labels.get(split):
+                    label_dir = root / labels[split]
+                else:
+                    # YOLO 慣例：將路徑中的 images 換成 labels
+                    parts = ['labels' if part == 'images' else part for part in Path(images).parts]
+                    label_dir = root.joinpath(*parts)
+                if (image_dir, label_dir) not in pairs:
+                    pairs.append((image_dir, label_dir))
+        names = dataset.get('names')
+    elif dataset_dir:
+        root = Path(dataset_dir)
+        if not root.is_absolute():
+            root = PROJECT_ROOT / root
+        pairs.append((root / 'images', root / 'labels'))
+
+    if abnormal_ids is not None:
+        return pairs, set(abnormal_ids)
+    if isinstance(names, dict):
+        names = [names[key] for key in sorted(names)]
+    if not names and config is not None:
+        classes_path = PROJECT_ROOT / config.get('Paths', 'classes', fallback='models/classes.txt')
+        if classes_path.exists():
+            names = [line.strip() for line in classes_path.read_text(encoding='utf-8').splitlines() if line.strip()]
+    ids = {idx for idx, name in enumerate(names or []) if str(name).lower() in ABNORMAL_NAMES}
+    return pairs, ids or {0}
+
+
+def _elliptical_alpha(height, width, box):
+    """在裁切範圍內以糖果框為準建立羽化的橢圓遮罩（0~1）"""
+    x, y, w, h = box
+    alpha = np.zeros((height, width), np.float32)
+    cv2.ellipse(alpha, (int(x + w / 2), int(y + h / 2)), (max(1, int(w / 2)), max(1, int(h / 2))), 0, 0, 360, 1.0, -1)
+    blur = max(3, int(min(w, h) * 0.12) | 1)
+    return cv2.GaussianBlur(alpha, (blur, blur), 0)
+
+
+def load_dataset_sprites(pairs, abnormal_ids, max_per_class=200, scale=1.0, min_size=12, rng=None):
+    """
+    從 YOLO 標註裁出糖果素材
+
+    Args:
+        pairs: [(圖片目錄, 標註目錄), ...]
+        abnormal_ids: 瑕疵類別 ID 集合
+        max_per_class: 每個類別最多保留的素材數
+        scale: 素材縮放比例
+        min_size: 忽略過小的框（像素）
+        rng: numpy 亂數產生器
+
+    Returns:
+        ({'normal': [(bgr, alpha), ...], 'abnormal': [...]}, 讀到的圖片路徑列表)
+    """
+    rng = rng or np.random.default_rng(0)
+    samples = []  # (圖片路徑, 標註檔路徑)
+    for image_dir, label_dir in pairs:
+        if not image_dir.is_dir() or not label_dir.is_dir():
+            continue
+        for image_path in sorted(p for p in image_dir.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS):
+            label_path = label_dir / image_path.relative_to(image_dir).with_suffix('.txt')
+            if label_path.exists():
+                samples.append((image_path, label_path))
+
+    sprites = {'normal': [], 'abnormal': []}
+    image_paths = []
+    for idx in rng.permutation(len(samples)):
+        if all(len(items) >= max_per_class for items in sprites.values()):
+            break
+        image_path, label_path = samples[idx]
+        # 中文路徑用 imdecode 讀取
+        image = cv2.imdecode(np.fromfile(str(image_path), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        image_paths.append(image_path)
+        img_h, img_w = image.shape[:2]
+        for line in label_path.read_text(encoding='utf-8').splitlines():
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            kind = 'abnormal' if int(float(parts[0])) in abnormal_ids else 'normal'
+            if len(sprites[kind]) >= max_per_class:
+                continue
+            xc, yc, w, h = (float(v) for v in parts[1:5])
+            w, h = w * img_w, h * img_h
+            if w < min_size or h < min_size:
+                continue
+            # 保留一點邊緣，讓羽化遮罩不會切到糖果
+            pad_w, pad_h = w * 0.1, h * 0.1
+            x1, y1 = int(max(0, xc * img_w - w / 2 - pad_w)), int(max(0, yc * img_h - h / 2 - pad_h))
+            x2, y2 = int(min(img_w, xc * img_w + w / 2 + pad_w)), int(min(img_h, yc * img_h + h / 2 + pad_h))
+            crop = image[y1:y2, x1:x2]
+            if crop.size == 0:
+                continue
+            alpha = _elliptical_alpha(crop.shape[0], crop.shape[1], (xc * img_w - w / 2 - x1, yc * img_h - h / 2 - y1, w, h))
+            if scale != 1.0:
+                size = (max(2, int(crop.shape[1] * scale)), max(2, int(crop.shape[0] * scale)))
+                crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+                alpha = cv2.resize(alpha, size, interpolation=cv2.INTER_AREA)
+            sprites[kind].append((crop.copy(), alpha))
+    return sprites, image_paths
+
+
+def synthetic_sprites(size=80, variants=8, rng=None):
+    """
+    繪製替代的糖果素材（找不到資料集時使用）
+
+    正常為黃色圓形，瑕疵在相同外觀上加黑點，灰階亮度與正常糖果相近。
+
+    Args:
+        size: 糖果直徑（像素）
+        variants: 每個類別的變化數
+        rng: numpy 亂數產生器
+
+    Returns:
+        {'normal': [(bgr, alpha), ...], 'abnormal': [...]}
+    """
+    rng = rng or np.random.default_rng(0)
+    sprites = {'normal': [], 'abnormal': []}
+    side = int(size * 1.2)
+    for kind in sprites:
+        for _ in range(variants):
+            diameter = size * rng.uniform(0.9, 1.1)
+            box = ((side - diameter) / 2, (side - diameter * 0.9) / 2, diameter, diameter * 0.9)
+            alpha = _elliptical_alpha(side, side, box)
+            color = np.array([30, 200, 235], np.float32) + rng.normal(0, 8, 3)
+            sprite = np.empty((side, side, 3), np.float32)
+            sprite[:] = color
+            # 左上方的反光讓素材有一點立體感
+            highlight = np.zeros((side, side), np.float32)
+            cv2.circle(highlight, (int(side * 0.4), int(side * 0.38)), int(diameter * 0.18), 1.0, -1)
+            sprite += cv2.GaussianBlur(highlight, (0, 0), diameter * 0.08)[..., None] * 40
+            if kind == 'abnormal':
+                for _ in range(int(rng.integers(1, 3))):
+                    center = (int(side / 2 + rng.uniform(-0.2, 0.2) * diameter), int(side / 2 + rng.uniform(-0.2, 0.2) * diameter))
+                    cv2.circle(sprite, center, max(2, int(diameter * rng.uniform(0.12, 0.16))), (20, 25, 30), -1)
+            sprites[kind].append((np.clip(sprite, 0, 255).astype(np.uint8), alpha))
+    return sprites
+
+
+def make_background(width, height, background=None, image_paths=(), rng=None):
+    """
+    建立輸送帶背景
+
+    依序使用：指定的背景圖、資料集圖片的逐像素中位數（移動中的糖果會被濾掉）、
+    帶有細微紋理的灰色輸送帶。
+
+    Args:
+        width: 畫面寬度
+        height: 畫面高度
+        background: 背景圖路徑（可選）
+        image_paths: 資料集圖片路徑
+        rng: numpy 亂數產生器
+
+    Returns:
+        BGR 背景圖
+    """
+    rng = rng or np.random.default_rng(0)
+    if background:
+        image = cv2.imdecode(np.fromfile(str(background), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(f"無法讀取背景圖: {background}")
+        return cv2.resize(image, (width, height))
+
+    image_paths = list(image_paths)
+    if len(image_paths) >= 3:
+        picks = rng.choice(len(image_paths), min(MAX_BACKGROUND_IMAGES, len(image_paths)), replace=False)
+        frames = []
+        for idx in picks:
+            image = cv2.imdecode(np.fromfile(str(image_paths[idx]), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                frames.append(cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA))
+        if len(frames) >= 3:
+            return np.median(np.stack(frames), axis=0).astype(np.uint8)
+
+    belt = np.full((height, width, 3), 95, np.float32)
+    # 沿運動方向拉長的雜訊，看起來像輸送帶的紋路
+    noise = cv2.resize(rng.normal(0, 6, (height // 4 + 1, width // 32 + 1)).astype(np.float32), (width, height))
+    belt += noise[..., None]
+    return np.clip(belt, 0, 255).astype(np.uint8)
+
+
+def _paste(frame, sprite, alpha, cx, cy):
+    """將素材以遮罩混合貼到畫面上（中心點為 cx, cy，超出畫面的部分裁掉）"""
+    sh, sw = alpha.shape
+    x1, y1 = int(round(cx - sw / 2)), int(round(cy - sh / 2))
+    fx1, fy1 = max(0, x1), max(0, y1)
+    fx2, fy2 = min(frame.shape[1], x1 + sw), min(frame.shape[0], y1 + sh)
+    if fx1 >= fx2 or fy1 >= fy2:
+        return
+    a = alpha[fy1 - y1:fy2 - y1, fx1 - x1:fx2 - x1, None]
+    roi = frame[fy1:fy2, fx1:fx2]
+    src = sprite[fy1 - y1:fy2 - y1, fx1 - x1:fx2 - x1]
+    roi[:] = (src * a + roi * (1.0 - a)).astype(np.uint8)
+
+
+# ==================== 產生影片 ====================
+
+def plan_objects(count, speed_px_frame, spacing, jitter, defect_rate, sprites, width, height, line_x,
+                 direction='rtl', belt_top=0.15, belt_bottom=0.85, rng=None):
+    """
+    排定每顆糖果的素材、位置與穿越偵測線的幀號
+
+    糖果以相同帶速移動，相鄰糖果沿運動方向的中心距離為 spacing * (1 ± jitter)，
+    但不小於兩顆糖果的寬度，避免重疊。
+
+    Returns:
+        糖果列表（含 offset：第 0 幀時距離入口的像素數）
+    """
+    rng = rng or np.random.default_rng(0)
+    objects = []
+    offset = 0.0
+    prev_half = 0.0
+    for idx in range(count):
+        kind = 'abnormal' if sprites['abnormal'] and rng.random() < defect_rate else 'normal'
+        if not sprites[kind]:
+            kind = 'abnormal'
+        sprite_idx = int(rng.integers(len(sprites[kind])))
+        sprite, alpha = sprites[kind][sprite_idx]
+        # 隨機旋轉 90 度的倍數，增加同一素材的變化
+        turns = int(rng.integers(4))
+        sprite, alpha = np.rot90(sprite, turns).copy(), np.rot90(alpha, turns).copy()
+        half = sprite.shape[1] / 2
+        if idx:
+            gap = spacing * (1.0 + jitter * rng.uniform(-1.0, 1.0))
+            offset += max(gap, (prev_half + half) * 1.1)
+        prev_half = half
+        margin = sprite.shape[0] / 2
+        y = rng.uniform(max(margin, belt_top * height), min(height - margin, belt_bottom * height))
+        objects.append({'id': idx + 1, 'kind': kind, 'sprite': sprite, 'alpha': alpha, 'y': float(y), 'offset': offset, 'half': half})
+
+    for obj in objects:
+        # 第 f 幀的中心位置：入口（完全在畫面外）沿運動方向前進 f * speed - offset
+        entry = width + obj['half'] if direction == 'rtl' else -obj['half']
+        sign = -1.0 if direction == 'rtl' else 1.0
+        obj['entry'] = entry
+        obj['sign'] = sign
+        travel = abs(line_x - entry)
+        obj['cross_frame'] = int(np.ceil((travel + obj['offset']) / speed_px_frame - 1e-9))
+        obj['enter_frame'] = int(np.ceil(obj['offset'] / speed_px_frame))
+        exit_travel = (width + 2 * obj['half'])
+        obj['exit_frame'] = int(np.ceil((exit_travel + obj['offset']) / speed_px_frame))
+    return objects
+
+
+def object_x(obj, frame_index, speed_px_frame):
+    """糖果在第 frame_index 幀的中心 x 座標"""
+    return obj['entry'] + obj['sign'] * (frame_index * speed_px_frame - obj['offset'])
+
+
+def generate_video(output, speed, fps=60.0, count=40, spacing=160.0, jitter=0.3, defect_rate=0.2, seed=0,
+                   width=1920, height=1080, line_x=100, direction='rtl', sprites=None, background=None,
+                   tail_frames=10):
+    """
+    產生合成輸送帶影片與標準答案
+
+    Args:
+        output: 影片輸出路徑（.avi 使用 MJPG，其他使用 mp4v）
+        speed: 帶速（像素/秒）
+        fps: 影片幀率（即偵測流程看到的推論幀率）
+        count: 糖果數量
+        spacing: 相鄰糖果的中心距離（像素）
+        jitter: 間距的隨機變化比例（0~1）
+        defect_rate: 瑕疵糖果比例
+        seed: 亂數種子（相同種子在不同帶速下產生相同的糖果序列）
+        width: 畫面寬度
+        height: 畫面高度
+        line_x: 偵測線 x 座標（偵測流程的 line_mid）
+        direction: rtl（右到左）或 ltr（左到右）
+        sprites: 素材 {'normal': [...], 'abnormal': [...]}
+        background: 背景圖（BGR）
+        tail_frames: 最後一顆糖果穿越偵測線後再多錄的幀數
+
+    Returns:
+        標準答案字典（同時寫入 truth_path_for(output)）
+    """
+    rng = np.random.default_rng(seed)
+    speed_px_frame = speed / fps
+    if speed_px_frame <= 0:
+        raise ValueError("帶速必須大於 0")
+    sprites = sprites or synthetic_sprites(rng=np.random.default_rng(seed))
+    if background is None:
+        background = make_background(width, height, rng=np.random.default_rng(seed))
+
+    objects = plan_objects(count, speed_px_frame, spacing, jitter, defect_rate, sprites, width, height, line_x,
+                           direction=direction, rng=rng)
+    frames = max(obj['cross_frame'] for obj in objects) + tail_frames + 1
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fourcc = cv2.VideoWriter_fourcc(*('MJPG' if output.suffix.lower() == '.avi' else 'mp4v'))
+    writer = cv2.VideoWriter(str(output), fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"無法建立影片: {output}")
+    frame = np.empty_like(background)
+    try:
+        for frame_index in range(frames):
+            np.copyto(frame, background)
+            for obj in objects:
+                if obj['enter_frame'] - 1 <= frame_index <= obj['exit_frame']:
+                    _paste(frame, obj['sprite'], obj['alpha'], object_x(obj, frame_index, speed_px_frame), obj['y'])
+            writer.write(frame)
+    finally:
+        writer.release()
+
+    crossings = [obj for obj in objects if 0 < obj['cross_frame'] < frames]
+    abnormal = sum(1 for obj in crossings if obj['kind'] == 'abnormal')
+    truth = {
+        'video': output.name,
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'frames': frames,
+        'direction': direction,
+        'line_x': line_x,
+        'speed_px_s': speed,
+        'speed_px_frame': round(speed_px_frame, 3),
+        'spacing_px': spacing,
+        'jitter': jitter,
+        'defect_rate': defect_rate,
+        'seed': seed,
+        'objects': [
+            {
+                'id': obj['id'],
+                'label': obj['kind'],
+                'y': round(obj['y'], 1),
+                'size': [int(obj['alpha'].shape[1]), int(obj['alpha'].shape[0])],
+                'enter_frame': obj['enter_frame'],
+                'cross_frame': obj['cross_frame'],
+                'cross_time_s': round(obj['cross_frame'] / fps, 4),
+                # 進入畫面到穿越偵測線之間偵測流程能看到幾幀
+                'frames_before_line': obj['cross_frame'] - obj['enter_frame'],
+            }
+            for obj in crossings
+        ],
+        'counts': {'total': len(crossings), 'normal': len(crossings) - abnormal, 'abnormal': abnormal},
+    }
+    truth_path_for(output).write_text(json.dumps(truth, ensure_ascii=False, indent=2), encoding='utf-8')
+    return truth
+
+
+# ==================== 評分 ====================
+
+def score_counts(counts, truth):
+    """
+    比較偵測流程的計數與標準答案
+
+    Args:
+        counts: run_replay 結果的 counts
+        truth: 標準答案字典
+
+    Returns:
+        {'expected': {...}, 'counted': {...}, 'errors': {...}, 'correct': bool}
+    """
+    expected = truth['counts']
+    errors = {key: counts.get(key, 0) - expected[key] for key in ('total', 'normal', 'abnormal')}
+    return {
+        'expected': expected,
+        'counted': {key: counts.get(key, 0) for key in ('total', 'normal', 'abnormal')},
+        'errors': errors,
+        'correct': not any(errors.values()),
+    }
+
+
+def score_video(video, model, class_names, config, section, realtime=False, truth=None):
+    """
+    以離線重播跑一段合成影片並評分
+
+    Returns:
+        run_replay 的結果加上 'score'
+    """
+    truth = truth or json.loads(truth_path_for(video).read_text(encoding='utf-8'))
+    result = run_replay(video, model, class_names, config, section, realtime=realtime, use_relay=False)
+    result['score'] = score_counts(result['counts'], truth)
+    return result
+
+
+def apply_input_size(config, model, input_size):
+    """
+    覆寫模型輸入尺寸
+
+    YOLOv4 在載入時讀取 [Detection] input_size，需在 load_yolo_model 之前修改設定；
+    YOLOv8 的 predict 沒有傳入 imgsz，這裡直接綁定到模型的 predict 上。
+    """
+    if model is None:
+        config.set('Detection', 'input_size', str(input_size))
+        return None
+    if config.get('Paths', 'model_type', fallback='yolov4').lower() == 'yolov8':
+        model.predict = functools.partial(model.predict, imgsz=input_size)
+    return model
+
+
+def sweep_speeds(speeds, model, class_names, config, section, inference_fps, sprites, background,
+                 width, height, line_x, count=40, spacing=160.0, jitter=0.3, defect_rate=0.2, seed=0,
+                 direction='rtl', realtime=False, workdir=None):
+    """
+    由慢到快逐一產生影片並評分，找出計數仍正確的最高帶速
+
+    每個帶速使用相同種子，糖果序列與間距相同，只有帶速不同。
+    推論幀率即影片幀率：偵測流程看到的每一幀都對應一次推論，結果可重現。
+
+    Returns:
+        {'results': [每個帶速的結果], 'max_correct_speed': 第一次出錯前的最高帶速（None 表示最慢的也出錯）}
+    """
+    results = []
+    max_correct = None
+    failed = False
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for speed in sorted(speeds):
+            video = Path(tmp) / f"belt_{speed:g}.avi"
+            truth = generate_video(
+                video, speed, fps=inference_fps, count=count, spacing=spacing, jitter=jitter,
+                defect_rate=defect_rate, seed=seed, width=width, height=height, line_x=line_x,
+                direction=direction, sprites=sprites, background=background,
+            )
+            result = score_video(video, model, class_names, config, section, realtime=realtime, truth=truth)
+            frames_before_line = [obj['frames_before_line'] for obj in truth['objects']]
+            item = {
+                'speed_px_s': speed,
+                'speed_px_frame': truth['speed_px_frame'],
+                'min_frames_before_line': min(frames_before_line) if frames_before_line else 0,
+                'frames': result['frames'],
+                'skipped_frames': result['skipped_frames'],
+                'fps': result['fps'],
+                'score': result['score'],
+            }
+            results.append(item)
+            print_sweep_row(item)
+            if result['score']['correct'] and not failed:
+                max_correct = speed
+            elif not result['score']['correct']:
+                failed = True
+    return {'results': results, 'max_correct_speed': max_correct}
+
+
+def print_sweep_row(item):
+    """輸出單一帶速的結果"""
+    score = item['score']
+    counted, expected = score['counted'], score['expected']
+    mark = 'OK' if score['correct'] else 'NG'
+    print(f"  {item['speed_px_s']:>8g}{item['speed_px_frame']:>10.1f}{item['min_frames_before_line']:>8}"
+          f"{counted['total']:>6}/{expected['total']:<4}{counted['abnormal']:>5}/{expected['abnormal']:<4}"
+          f"{item['fps']:>8.1f}  {mark}")
+
+
+# ==================== 命令列 ====================
+
+def _section_geometry(config, args):
+    """由攝影機區塊取得畫面尺寸與偵測線（命令列參數優先）"""
+    cam = config[args.section]
+    width = args.width or cam.getint('frame_width', fallback=1920)
+    height = args.height or cam.getint('frame_height', fallback=1080)
+    line_x = args.line_x if args.line_x is not None else (
+        cam.getint('detection_line_x1', fallback=width // 2) + cam.getint('detection_line_x2', fallback=width // 2)
+    ) // 2
+    return width, height, line_x
+
+
+def _load_assets(config, args, width, height):
+    """載入素材與背景（找不到資料集時改用繪製的素材）"""
+    rng = np.random.default_rng(args.seed)
+    sprites, image_paths = {'normal': [], 'abnormal': []}, []
+    if not args.synthetic_sprites:
+        abnormal_ids = [int(v) for v in args.abnormal_ids.split(',')] if args.abnormal_ids else None
+        pairs, ids = resolve_dataset(None if args.dataset else args.data, args.dataset, abnormal_ids, config)
+        sprites, image_paths = load_dataset_sprites(pairs, ids, args.max_sprites, args.sprite_scale, rng=rng)
+        if sprites['normal'] or sprites['abnormal']:
+            print(f"素材: 正常 {len(sprites['normal'])}，瑕疵 {len(sprites['abnormal'])}（瑕疵類別 ID {sorted(ids)}）")
+        else:
+            print("找不到資料集圖片，改用繪製的糖果素材（只適合檢查追蹤與計數流程）")
+    if not (sprites['normal'] or sprites['abnormal']):
+        sprites = synthetic_sprites(args.sprite_size, rng=rng)
+    background = make_background(width, height, args.background, image_paths, rng=rng)
+    return sprites, background
+
+
+def _prepare_model(config, args):
+    if args.input_size:
+        apply_input_size(config, None, args.input_size)
+    model, class_names = load_yolo_model(config)
+    if args.input_size:
+        model = apply_input_size(config, model, args.input_size)
+    return model, class_names
+
+
+def cmd_generate(config, args):
+    width, height, line_x = _section_geometry(config, args)
+    sprites, background = _load_assets(config, args, width, height)
+    fps = args.fps or config[args.section].getfloat('fps', fallback=60.0)
+    start = time.perf_counter()
+    truth = generate_video(
+        args.output, args.speed, fps=fps, count=args.count, spacing=args.spacing, jitter=args.jitter,
+        defect_rate=args.defect_rate, seed=args.seed, width=width, height=height, line_x=line_x,
+        direction=args.direction, sprites=sprites, background=background,
+    )
+    counts = truth['counts']
+    print(f"已產生 {args.output}: {truth['frames']} 幀 @ {fps:g} FPS，{time.perf_counter() - start:.1f} 秒")
+    print(f"  帶速 {args.speed:g} px/s（{truth['speed_px_frame']:.1f} px/幀），偵測線 x={line_x}")
+    print(f"  標準答案: 總數 {counts['total']}，正常 {counts['normal']}，瑕疵 {counts['abnormal']}"
+          f" -> {truth_path_for(args.output)}")
+    return 0
+
+
+def cmd_score(config, args):
+    model, class_names = _prepare_model(config, args)
+    result = score_video(args.video, model, class_names, config, args.section, realtime=args.realtime)
+    score = result['score']
+    print(f"\n[{args.video}] {result['mode']}，{result['frames']} 幀（跳過 {result['skipped_frames']}），{result['fps']:.1f} FPS")
+    print(f"  標準答案: {score['expected']}")
+    print(f"  偵測計數: {score['counted']}")
+    print(f"  結果: {'正確' if score['correct'] else '錯誤 ' + str(score['errors'])}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    return 0 if score['correct'] else 1
+
+
+def cmd_sweep(config, args):
+    width, height, line_x = _section_geometry(config, args)
+    sprites, background = _load_assets(config, args, width, height)
+    model, class_names = _prepare_model(config, args)
+    inference_fps = args.inference_fps or config[args.section].getfloat('fps', fallback=60.0)
+    speeds = [float(v) for v in args.speeds.split(',')]
+    input_size = args.input_size or config.getint('Detection', 'input_size', fallback=416)
+
+    print(f"\n{'='*60}")
+    print(f"帶速掃描: {args.section}，輸入尺寸 {input_size}，推論 {inference_fps:g} FPS，{args.count} 顆糖果")
+    print(f"{'='*60}")
+    print(f"  {'px/s':>8}{'px/幀':>9}{'可見幀':>6}{'總數':>9}{'瑕疵':>8}{'FPS':>9}")
+    report = sweep_speeds(
+        speeds, model, class_names, config, args.section, inference_fps, sprites, background,
+        width, height, line_x, count=args.count, spacing=args.spacing, jitter=args.jitter,
+        defect_rate=args.defect_rate, seed=args.seed, direction=args.direction, realtime=args.realtime,
+    )
+    report.update({'section': args.section, 'input_size': input_size, 'inference_fps': inference_fps})
+
+    if report['max_correct_speed'] is None:
+        print("\n最慢的帶速就已計數錯誤")
+    else:
+        print(f"\n計數正確的最高帶速: {report['max_correct_speed']:g} px/s"
+              f"（{report['max_correct_speed'] / inference_fps:.1f} px/幀）")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"結果已寫入 {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='產生合成輸送帶影片與標準答案，並找出計數正確的最高帶速')
+    parser.add_argument('--config', default='config.ini', help='設定檔（相對於專案根目錄）')
+    parser.add_argument('--section', default='Camera1', help='使用哪個攝影機區塊的畫面尺寸與偵測線')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    belt = argparse.ArgumentParser(add_help=False)
+    belt.add_argument('--count', type=int, default=40, help='糖果數量')
+    belt.add_argument('--spacing', type=float, default=160.0, help='相鄰糖果的中心距離（像素）')
+    belt.add_argument('--jitter', type=float, default=0.3, help='間距隨機變化比例（0~1）')
+    belt.add_argument('--defect-rate', type=float, default=0.2, help='瑕疵糖果比例')
+    belt.add_argument('--seed', type=int, default=0, help='亂數種子')
+    belt.add_argument('--direction', choices=('rtl', 'ltr'), default='rtl', help='運動方向：右到左或左到右')
+    belt.add_argument('--width', type=int, default=0, help='畫面寬度（預設使用攝影機區塊）')
+    belt.add_argument('--height', type=int, default=0, help='畫面高度（預設使用攝影機區塊）')
+    belt.add_argument('--line-x', type=int, default=None, help='偵測線 x 座標（預設為區塊偵測線中點）')
+    belt.add_argument('--data', default='datasets/candy_dataset.yaml', help='YOLO 資料集 yaml')
+    belt.add_argument('--dataset', help='資料集根目錄（其下有 images/ 與 labels/，指定時不使用 --data）')
+    belt.add_argument('--abnormal-ids', help='瑕疵類別 ID（逗號分隔，預設依類別名稱判斷）')
+    belt.add_argument('--max-sprites', type=int, default=200, help='每個類別最多裁切的素材數')
+    belt.add_argument('--sprite-scale', type=float, default=1.0, help='素材縮放比例')
+    belt.add_argument('--synthetic-sprites', action='store_true', help='不讀取資料集，使用繪製的糖果素材')
+    belt.add_argument('--sprite-size', type=int, default=80, help='繪製素材的直徑（像素）')
+    belt.add_argument('--background', help='輸送帶背景圖（預設由資料集圖片合成）')
+
+    model_args = argparse.ArgumentParser(add_help=False)
+    model_args.add_argument('--input-size', type=int, default=0, help='模型輸入尺寸（預設使用 [Detection] input_size）')
+    model_args.add_argument('--realtime', action='store_true', help='依影片幀率播放，處理來不及時跳過畫面')
+    model_args.add_argument('--json', help='將結果寫入 JSON 檔')
+
+    generate = subparsers.add_parser('generate', parents=[belt], help='產生影片與標準答案')
+    generate.add_argument('--output', '-o', required=True, help='影片輸出路徑（.avi 或 .mp4）')
+    generate.add_argument('--speed', type=float, required=True, help='帶速（像素/秒）')
+    generate.add_argument('--fps', type=float, default=None, help='影片幀率（預設使用攝影機區塊的 fps）')
+
+    score = subparsers.add_parser('score', parents=[model_args], help='重播影片並與標準答案比對計數')
+    score.add_argument('--video', required=True, help='合成影片（同目錄需有 .truth.json）')
+
+    sweep = subparsers.add_parser('sweep', parents=[belt, model_args], help='掃描帶速，找出計數正確的最高帶速')
+    sweep.add_argument('--speeds', required=True, help='帶速列表（像素/秒，逗號分隔）')
+    sweep.add_argument('--inference-fps', type=float, default=None, help='推論幀率（預設使用攝影機區塊的 fps）')
+
+    args = parser.parse_args()
+    config = load_config(args.config)
+    if args.section not in config:
+        print(f"設定檔中找不到區塊 '{args.section}'")
+        sys.exit(2)
+    handlers = {'generate': cmd_generate, 'score': cmd_score, 'sweep': cmd_sweep}
+    sys.exit(handlers[args.command](config, args))
@@ -9,6 +9,8 @@ from collections import deque
 from typing import Tuple, List, Optional
 import threading
 
+from candy_detector.framepool import FramePool
+
 
 class ModelOptimizer:
     """模型推論優化器"""
@@ -161,39 +163,167 @@ class AdaptiveThresholdAdjuster:
         return self.conf_threshold, self.nms_threshold
 
 
-class MultiThreadedFrameReader:
-    """多線程影像讀取器 - 提升 FPS"""
+class FrameGrabber:
+    """單一攝影機的抓取執行緒 - 持續讀取畫面到帶時間戳的環形緩衝區"""
 
-    def __init__(self, camera_contexts):
-        self.camera_contexts = camera_contexts
-        self.frames = [None] * len(camera_contexts)
+    def __init__(self, cam_ctx, buffer_size=3):
+        self.cam_ctx = cam_ctx
+        self.buffer = deque(maxlen=buffer_size)  # [(seq, capture_ts, FrameHandle), ...]
+        self.pool = FramePool(max_free=buffer_size + 4)
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.last_read_seq = 0
+        self.dropped_frames = 0
+        self.read_failures = 0
         self.stopped = False
-        self.lock = threading.Lock()
+        self.thread = None
 
     def start(self):
-        """啟動讀取線程"""
-        for idx, cam_ctx in enumerate(self.camera_contexts):
-            t = threading.Thread(target=self._update, args=(idx, cam_ctx), daemon=True)
-            t.start()
+        """啟動抓取線程"""
+        self.stopped = False
+        self.thread = threading.Thread(
+            target=self._update, name=f"grab-{self.cam_ctx.name}", daemon=True
+        )
+        self.thread.start()
         return self
 
-    def _update(self, idx, cam_ctx):
-        """持續讀取影像"""
+    def _update(self):
+        """持續讀取影像（攝影機可能在重新連線時被替換，因此每輪重新取得 cap）"""
         while not self.stopped:
-            ret, frame = cam_ctx.cap.read()
-            if ret:
-                with self.lock:
-                    self.frames[idx] = frame
-            time.sleep(0.001)
+            cap = self.cam_ctx.cap
+            if cap is None or not cap.isOpened():
+                time.sleep(0.05)
+                continue
+
+            try:
+                # 直接讀進緩衝池的陣列，不逐幀配置新記憶體
+                ret, handle = self.pool.read(cap)
+            except cv2.error:
+                ret, handle = False, None
+            capture_ts = time.monotonic()
+
+            if not ret:
+                with self.cond:
+                    self.read_failures += 1
+                time.sleep(0.005)
+                continue
+
+            evicted = None
+            with self.cond:
+                if len(self.buffer) == self.buffer.maxlen:
+                    evicted = self.buffer[0][2]
+                self.seq += 1
+                self.buffer.append((self.seq, capture_ts, handle))
+                self.cond.notify_all()
+            if evicted is not None:
+                # 擠出環形緩衝區的畫面由緩衝區釋放引用，仍被使用者持有時不會歸還
+                evicted.release()
+
+    def read(self, timeout=1.0):
+        """
+        取得最新一張尚未讀取的畫面
+
+        中間被跳過的畫面計入 dropped_frames。
+
+        Returns:
+            (ret, handle, capture_ts)，handle 為唯讀 FrameHandle（呼叫端用完需 release()），
+            capture_ts 為 time.monotonic() 時間
+        """
+        with self.cond:
+            has_new = self.cond.wait_for(
+                lambda: self.stopped or (self.buffer and self.buffer[-1][0] > self.last_read_seq),
+                timeout,
+            )
+            if not has_new or not self.buffer or self.buffer[-1][0] <= self.last_read_seq:
+                return False, None, 0.0
+
+            seq, capture_ts, handle = self.buffer[-1]
+            if self.last_read_seq:
+                self.dropped_frames += seq - self.last_read_seq - 1
+            self.last_read_seq = seq
+            return True, handle.acquire(), capture_ts
+
+    def read_since(self, seq):
+        """
+        取得緩衝區內序號大於 seq 的所有畫面（供錄影等需要連續畫面的使用者）
+
+        Returns:
+            [(seq, capture_ts, handle), ...]，每個 handle 都已取得引用，呼叫端用完需 release()
+        """
+        with self.cond:
+            return [(item_seq, ts, handle.acquire()) for item_seq, ts, handle in self.buffer if item_seq > seq]
+
+    def stop(self):
+        """停止抓取"""
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        with self.cond:
+            items = list(self.buffer)
+            self.buffer.clear()
+        for _, _, handle in items:
+            handle.release()
+
+    def get_stats(self):
+        """取得抓取統計"""
+        with self.cond:
+            return {
+                'captured_frames': self.seq,
+                'dropped_frames': self.dropped_frames,
+                'read_failures': self.read_failures,
+                'frame_pool': self.pool.get_stats(),
+            }
+
+
+class MultiThreadedFrameReader:
+    """多線程影像讀取器 - 每個攝影機一個抓取執行緒，偵測迴圈永遠取最新畫面"""
+
+    def __init__(self, camera_contexts, buffer_size=3):
+        self.buffer_size = buffer_size
+        self.grabbers = []
+        for cam_ctx in camera_contexts:
+            self._attach(cam_ctx)
+
+    def _attach(self, cam_ctx):
+        """建立抓取器並掛到 CameraContext 上"""
+        grabber = FrameGrabber(cam_ctx, self.buffer_size)
+        cam_ctx.grabber = grabber
+        self.grabbers.append(grabber)
+        return grabber
 
-    def read(self, idx):
-        """讀取特定攝影機的最新畫面"""
-        with self.lock:
-            return self.frames[idx]
+    def start(self):
+        """啟動讀取線程"""
+        for grabber in self.grabbers:
+            if grabber.thread is None:
+                grabber.start()
+        return self
+
+    def add(self, cam_ctx):
+        """動態新增攝影機並立即開始抓取"""
+        return self._attach(cam_ctx).start()
+
+    def remove(self, cam_ctx):
+        """停止並移除攝影機的抓取器"""
+        grabber = getattr(cam_ctx, 'grabber', None)
+        if grabber is None:
+            return
+        grabber.stop()
+        if grabber in self.grabbers:
+            self.grabbers.remove(grabber)
+        cam_ctx.grabber = None
+
+    def read(self, idx, timeout=1.0):
+        """讀取特定攝影機的最新畫面 -> (ret, handle, capture_ts)，handle 用完需 release()"""
+        return self.grabbers[idx].read(timeout)
 
     def stop(self):
         """停止讀取"""
-        self.stopped = True
+        for grabber in self.grabbers:
+            grabber.stop()
+            grabber.cam_ctx.grabber = None
+        self.grabbers.clear()
 
 
 class PerformanceMonitor: